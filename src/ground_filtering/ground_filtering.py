@@ -1,13 +1,28 @@
 import configparser
 import json
+import multiprocessing
 import os
+import time
 
 import pdal
 
+from src.ground_filtering.outliers import NOISE, classify_outliers
 from src.tile import Tile
 from src.utils.helpers import Stages
+from src.utils.intermediate import get_size, is_arrays, read_points
+from src.utils.point_source import PointSource
+from src.utils.points import PointBuffer
 
 # TODO: Move to better location; want to prevent loading every time it is run, but keeping it here is strange
+OUTLIER_FILTERING = [
+    {
+        "type": "filters.elm"
+    },
+    {
+        "type": "filters.outlier"
+    }
+]
+
 GROUND_FILTERING_DTM = [
     {
         "type": "filters.elm"
@@ -46,24 +61,114 @@ class GroundFiltering:
 
         self._to_overwrite = True if config["global"]["overwrite_existing_files"] == "true" else False
 
-    def remove_outliers(self, stage: Stages):
-        """ Remove outliers current input tile
+        # pdal: filters.elm + filters.outlier pipelines, native: in-process NumPy/cKDTree implementation
+        self._backend = config.get("ground_filtering", "backend", fallback="pdal")
+        self._workers = int(config.get("ground_filtering", "workers", fallback="-1"))
+
+        self._point_source = PointSource()
+
+    def remove_outliers(self, stage: Stages = None):
+        """ Remove outliers current input tile. The outlier filters only classify points as noise (7), so without a stage
+        all points are returned and the products can be selected afterwards with select_points().
 
-        :return: Array containing filtered raster result
+        :param stage: Stage to filter the points for (dsm or dtm), or None to only run the outlier filters
+        :return: PointBuffer object containing the filtered points
         """
-        if stage == Stages.INTERPOLATED_DSM:
+        if self._backend == "native" or is_arrays(self._tile.filepath):
+            start_time = time.time()
+            points = read_points(self._tile.filepath, origin=self.get_origin())
+
+            print('{0}: Read {1} points of "{2}" ({3} MB) in {4} seconds.'.format(
+                multiprocessing.current_process().name,
+                len(points),
+                self._tile.get_tile_name(),
+                str(round(get_size(self._tile.filepath) / 1024 ** 2, 2)),
+                str(round(time.time() - start_time, 2))
+            ))
+
+        if self._backend == "native":
+            points = classify_outliers(points, workers=self._workers)
+
+            return points if stage is None else self.select_points(points, stage)
+
+        if stage is None:
+            pdal_config = OUTLIER_FILTERING.copy()  # Copy to avoid changing original config
+
+        elif stage == Stages.INTERPOLATED_DSM:
             pdal_config = GROUND_FILTERING_DSM.copy()  # Copy to avoid changing original config
 
         else:
             pdal_config = GROUND_FILTERING_DTM.copy()  # Copy to avoid changing original config
 
-        # Insert the filepath of this specific file in the pipeline
-        pdal_config.insert(0, self._tile.filepath)
+        if is_arrays(self._tile.filepath):  # PDAL cannot read the arrays, so they are passed in memory
+            pipeline = pdal.Pipeline(json.dumps(pdal_config), arrays=[points.to_structured()])
+
+        else:
+            # Insert the filepath of this specific file in the pipeline
+            pdal_config.insert(0, self._tile.filepath)
 
-        # pdal_config.append(save_name) # Appends the correct save path for this tile and stage
+            # pdal_config.append(save_name) # Appends the correct save path for this tile and stage
+
+            pipeline = pdal.Pipeline(json.dumps(pdal_config))  # .dumps() to go from json to str
+
+        pipeline.execute()
+
+        return PointBuffer.from_structured(pipeline.arrays[0], origin=self.get_origin())
+
+    def remove_outliers_in_area(self, filepaths: list, bounds: list):
+        """ Runs the outlier filters once over an area that spans several files, e.g. a main tile and the strips of its
+        neighbours that fall within the buffer. Every file is cropped to the area before the files are merged, with a
+        spatial index (point_source in the config) only the indexed chunks that intersect the area are read.
+
+        :param filepaths: List containing the paths of all files that overlap the area
+        :param bounds: List representing the area as [minx, miny, maxx, maxy]
+        :return: PointBuffer object containing the filtered points, noise is classified as 7 but not removed
+        """
+        if self._backend == "native":
+            return classify_outliers(
+                self._point_source.read(filepaths, bounds=bounds, origin=self.get_origin()), workers=self._workers
+            )
+
+        pdal_config, tags = self._point_source.get_readers(filepaths, bounds)
+
+        pdal_config.append({
+            "type": "filters.merge",
+            "inputs": tags
+        })
+
+        pdal_config.extend(OUTLIER_FILTERING)
 
         pipeline = pdal.Pipeline(json.dumps(pdal_config))  # .dumps() to go from json to str
 
         pipeline.execute()
 
-        return pipeline.arrays
+        return PointBuffer.from_structured(pipeline.arrays[0], origin=self.get_origin())
+
+    def get_origin(self):
+        """ Returns the local origin of the points of this tile, which is the top left corner of the (unbuffered) tile
+        and thereby also of the raster that is interpolated from them.
+
+        :return: List containing the x and y coordinate of the origin
+        """
+        geometry = self._tile.get_unbuffered_geometry()
+
+        if geometry is None:  # Main tiles have no buffer
+            geometry = self._tile.get_geometry()
+
+        bounds = [int(bound) for bound in geometry.bounds]
+
+        return [bounds[0], bounds[3]]
+
+    @staticmethod
+    def select_points(points: PointBuffer, stage: Stages):
+        """ Selects the points used for a product from points that went through the outlier filters only. Equivalent to
+        the filters.range step of GROUND_FILTERING_DTM and GROUND_FILTERING_DSM.
+
+        :param points: PointBuffer object as returned by remove_outliers() without a stage
+        :param stage: Stage to select the points for (dsm or dtm)
+        :return: PointBuffer object containing the selected points
+        """
+        if stage == Stages.INTERPOLATED_DSM:
+            return points.select(points.classification != NOISE)
+
+        return points.select(points.classification == 2)
@@ -0,0 +1,116 @@
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+NOISE = 7  # Classification given to outliers, same as PDAL
+
+# Defaults of PDAL's filters.elm and filters.outlier (statistical method)
+ELM_CELL = 10.0
+ELM_THRESHOLD = 1.0
+OUTLIER_MEAN_K = 8
+OUTLIER_MULTIPLIER = 2.0
+
+BLOCK_SIZE = 1000000  # Number of points queried at once for the kNN distances
+
+
+def statistical_outliers(xyz, mean_k: int = OUTLIER_MEAN_K, multiplier: float = OUTLIER_MULTIPLIER, workers: int = -1):
+    """ Statistical outlier detection like filters.outlier. For every point the mean distance to its mean_k nearest
+    neighbours is computed, points for which this mean is larger than the mean over all points plus multiplier times
+    its standard deviation are outliers.
+
+    :param xyz: Numpy array containing the points as [[x, y, z], ...]
+    :param mean_k: Number of neighbours to compute the mean distance over
+    :param multiplier: Number of standard deviations above the mean distance a point is considered an outlier
+    :param workers: Number of workers cKDTree may use for a query, -1 uses all cores
+    :return: Boolean numpy array that is True for outliers
+    """
+    if len(xyz) <= mean_k:
+        return np.zeros(len(xyz), dtype=bool)
+
+    tree = cKDTree(xyz)
+    mean_distances = np.empty(len(xyz), dtype=np.float64)
+
+    for start in range(0, len(xyz), BLOCK_SIZE):
+        # The nearest neighbour of every point is the point itself, so k + 1 neighbours are needed
+        distances, _ = tree.query(xyz[start:start + BLOCK_SIZE], k=mean_k + 1, workers=workers)
+        mean_distances[start:start + BLOCK_SIZE] = distances[:, 1:].mean(axis=1)
+
+    threshold = mean_distances.mean() + multiplier * mean_distances.std(ddof=1)
+
+    return mean_distances > threshold
+
+
+def extended_local_minimum(xyz, cell: float = ELM_CELL, threshold: float = ELM_THRESHOLD):
+    """ Extended Local Minimum (ELM) low point detection like filters.elm. The points are binned into a grid, the
+    lowest point of a cell is noise if it lies more than threshold below the lowest point of every neighbouring cell.
+    If it is, the next lowest point of that cell is tested in the next round, until a point is not too low.
+
+    :param xyz: Numpy array containing the points as [[x, y, z], ...]
+    :param cell: Float representing the size of the grid cells
+    :param threshold: Float representing how far below its neighbours a point must be to be noise
+    :return: Boolean numpy array that is True for low noise points
+    """
+    noise = np.zeros(len(xyz), dtype=bool)
+
+    if len(xyz) == 0:
+        return noise
+
+    cols = ((xyz[:, 0] - xyz[:, 0].min()) // cell).astype(np.intp)
+    rows = ((xyz[:, 1] - xyz[:, 1].min()) // cell).astype(np.intp)
+    shape = (int(rows.max()) + 1, int(cols.max()) + 1)
+
+    cell_ids = rows * shape[1] + cols
+
+    # Sort by cell and then by height, so every cell is a run of points from low to high
+    order = np.lexsort((xyz[:, 2], cell_ids))
+    z = xyz[order, 2]
+
+    cells, start, counts = np.unique(cell_ids[order], return_index=True, return_counts=True)
+
+    cell_min = np.full(shape[0] * shape[1], np.inf)
+    cell_min[cells] = z[start]
+    cell_min = cell_min.reshape(shape)
+
+    # Lowest point of the 8 surrounding cells, empty cells are ignored
+    padded = np.pad(cell_min, 1, mode="constant", constant_values=np.inf)
+    neighbour_min = np.full(shape, np.inf)
+
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dx != 0 or dy != 0:
+                neighbour_min = np.minimum(
+                    neighbour_min, padded[1 + dy:1 + dy + shape[0], 1 + dx:1 + dx + shape[1]]
+                )
+
+    limit = neighbour_min.ravel()[cells] - threshold
+
+    active = np.arange(len(cells))
+    rank = 0
+
+    while active.size > 0:
+        active = active[counts[active] > rank]
+
+        low = z[start[active] + rank] < limit[active]
+
+        noise[order[start[active[low]] + rank]] = True
+
+        active = active[low]
+        rank += 1
+
+    return noise
+
+
+def classify_outliers(points, workers: int = -1):
+    """ Runs ELM and the statistical outlier detection and classifies all outliers as noise, like running filters.elm
+    followed by filters.outlier in PDAL. Points are not removed.
+
+    :param points: PointBuffer object containing the points
+    :param workers: Number of workers cKDTree may use for a query, -1 uses all cores
+    :return: The same PointBuffer object, with the classification of outliers set to NOISE
+    """
+    noise = extended_local_minimum(points.xyz)
+    noise |= statistical_outliers(points.xyz, workers=workers)
+
+    points.classification[noise] = NOISE
+
+    return points
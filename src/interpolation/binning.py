@@ -0,0 +1,56 @@
+import numpy as np
+
+NO_DATA = -9999
+
+REDUCERS = ["max", "min", "mean", "median"]
+
+
+def bin_points(points, origin, cell_size, shape, reducer: str = "max"):
+    """ Bins points into the raster grid in one vectorized pass and reduces the heights of the points in every cell
+    to a single value. Cells without points are set to NO_DATA.
+
+    :param points: Numpy array containing the points as [[x, y, z], ...]
+    :param origin: List containing the coordinates of the top left corner of the raster
+    :param cell_size: Float representing the raster cell size
+    :param shape: Tuple representing the shape of the raster (rows, columns)
+    :param reducer: String representing how the heights in a cell are combined (max, min, mean or median)
+    :return: Numpy array of the given shape containing the binned values
+    """
+    if reducer not in REDUCERS:
+        raise ValueError("Unknown cell reducer '{0}', expected one of {1}".format(reducer, REDUCERS))
+
+    rows = np.floor((origin[1] - points[:, 1]) / cell_size).astype(np.intp)
+    cols = np.floor((points[:, 0] - origin[0]) / cell_size).astype(np.intp)
+
+    inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+
+    cells = rows[inside] * shape[1] + cols[inside]
+    z = np.asarray(points[inside, 2], dtype=np.float64)
+
+    raster = np.full(shape[0] * shape[1], NO_DATA, dtype=np.float64)
+
+    if reducer == "mean":
+        counts = np.bincount(cells, minlength=raster.size)
+        sums = np.bincount(cells, weights=z, minlength=raster.size)
+
+        filled = counts > 0
+        raster[filled] = sums[filled] / counts[filled]
+
+    else:
+        # Sort by cell and then by height, so every cell is a sorted run of heights
+        order = np.lexsort((z, cells))
+        cells = cells[order]
+        z = z[order]
+
+        filled, start, counts = np.unique(cells, return_index=True, return_counts=True)
+
+        if reducer == "max":
+            raster[filled] = z[start + counts - 1]
+
+        elif reducer == "min":
+            raster[filled] = z[start]
+
+        else:
+            raster[filled] = (z[start + (counts - 1) // 2] + z[start + counts // 2]) / 2
+
+    return raster.reshape(shape)
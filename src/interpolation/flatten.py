@@ -5,10 +5,12 @@ import rasterio
 
 import numpy as np
 
-from shapely.geometry import Point, MultiPoint
 from rasterio.features import rasterize
 
-from src.utils.helpers import vector_prepare, wfs_prepare, Stages
+from src.interpolation.laplace import in_convex_hull
+from src.utils.footprints import FootprintProvider
+from src.utils.helpers import vector_prepare, Stages
+from src.utils.polygon_store import query_geopackage
 
 NO_DATA = -9999
 MIN_N = 0
@@ -26,11 +28,17 @@ class Flatten:
         self._raster_cell_size = float(config["global"]["base_raster_cell_size"])
 
         self._polygon_paths = config["folder_paths"]["flattening_polygons"]
-        self._wfs_url = ['http://3dbag.bk.tudelft.nl/data/wfs', 'BAG3D:pand3d']
+        self._footprints = FootprintProvider()
 
         self._polygons = [os.path.join(self._polygon_paths, f) for f in os.listdir(self._polygon_paths) if ".shp" in f]
 
-    def water(self, origin, res, raster, tin, extents, stage):
+        # Pre-tiled polygons, used instead of the shapefiles if set
+        self._polygon_geopackage = config["folder_paths"].get("polygon_geopackage", "")
+
+        # Number of passes to patch holes with, 0 repeats until all holes are closed
+        self._patch_iterations = int(config.get("flattening", "patch_iterations", fallback="1"))
+
+    def water(self, origin, res, raster, tin, extents, stage, offset=(0, 0), hull=None):
         """ Function that flattens the water bodies that are present within the specified raster. Uses all local
         polygons in shapefile format that are available in the specified folder in the config, theoretically not limited
         to water. Retrieves the polygons within the bounding box of the raster to interpolate the median value for this
@@ -42,120 +50,299 @@ class Flatten:
         :param raster: Numpy array containing the content of the raster (x, y, z)
         :param tin: startin.DT() object containing all relevant LAS points for interpolating values of polygons
         :param extents: List containing the extents of the raster as [[minx, maxx], [miny, maxy]]
+        :param offset: List containing the origin the points in the TIN are relative to
+        :param hull: Numpy array containing the convex hull of the points in the TIN, relative to the offset, see
+        convex_hull_ring(). Only vertices within the hull are sampled, if None the bounds of the cells with data are used
         :return: Numpy array containing raster with flattened areas where polygons were found
         """
         print('\n{0}: Starting to flatten water bodies'.format(
             multiprocessing.current_process().name,
         ))
 
-        x0 = extents[0][0]
-        x1 = extents[0][1]
-        y0 = extents[1][0]
-        y1 = extents[1][1]
+        polygons = self.get_vectors(extents=extents, stage=stage)
+
+        if len(polygons) > 0 and tin is not None:
+            if hull is None:
+                hull = self.get_data_bounds(origin=origin, raster=raster, offset=offset)
+
+            if hull is None:  # No cells with data
+                return raster
+
+            heights = self.sample_heights(
+                polygons=polygons,
+                tin=tin,
+                contains=lambda xy: in_convex_hull(hull, xy - np.asarray(offset, dtype=np.float64)),
+                offset=offset
+            )
+
+            shapes = [(polygon, np.median(els)) for polygon, els in zip(polygons, heights) if len(els) > 0]
+
+            if len(shapes) > 0:
+                raster = self.burn(origin=origin, raster=raster, shapes=shapes)
+
+        return raster
+
+    def get_data_bounds(self, origin, raster, offset=(0, 0)):
+        """ Determines the bounding box of the cells that have data, as a hull to test the polygon vertices against.
+
+        :param origin: List containing the coordinates of the top left corner of the raster
+        :param raster: Numpy array containing the content of the raster
+        :param offset: List containing the origin the hull should be relative to
+        :return: Numpy array containing the corners as [[x, y], ...] in counter-clockwise order, or None if no cell has
+        data
+        """
+        data = raster != NO_DATA
+
+        rows = np.nonzero(data.any(axis=1))[0]
+        cols = np.nonzero(data.any(axis=0))[0]
+
+        if len(rows) == 0:
+            return None
+
+        minx = origin[0] + cols[0] * self._raster_cell_size - offset[0]
+        maxx = origin[0] + (cols[-1] + 1) * self._raster_cell_size - offset[0]
+        miny = origin[1] - (rows[-1] + 1) * self._raster_cell_size - offset[1]
+        maxy = origin[1] - rows[0] * self._raster_cell_size - offset[1]
 
-        bbox = [[x0, x1], [y0, y1]]
+        return np.array([[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy]], dtype=np.float64)
+
+    def get_vectors(self, extents, stage):
+        """ Retrieves all polygons that are used for flattening within the extents of the raster, clipped to these
+        extents. Uses the local polygons (from the GeoPackage if configured, otherwise the shapefiles) and, for the DTM
+        only, the buildings from the WFS service (served from the footprint cache).
+
+        :param extents: List containing the extents of the raster as [[minx, maxx], [miny, maxy]]
+        :param stage: String representing the stage of the raster (dsm or dtm)
+        :return: List containing shapely Polygons
+        """
+        bbox = [[extents[0][0], extents[0][1]], [extents[1][0], extents[1][1]]]
 
         input_vectors = []
 
-        for polygon in self._polygons:
-            vec = vector_prepare(bbox=bbox, filepath=polygon)
-            if len(vec) != 0:
-                input_vectors.append(vec)
+        if self._polygon_geopackage != "":
+            input_vectors.append(query_geopackage(
+                filepath=self._polygon_geopackage,
+                layer="flattening",
+                bounds=[extents[0][0], extents[1][0], extents[0][1], extents[1][1]]
+            ))
+
+        else:
+            for polygon in self._polygons:
+                vec = vector_prepare(bbox=bbox, filepath=polygon)
+                if len(vec) != 0:
+                    input_vectors.append(vec)
 
         if stage == Stages.INTERPOLATED_DTM:  # Only flatten buildings if it's DTM
             try:
-                vec = wfs_prepare(bbox=bbox, url=self._wfs_url[0], layer=self._wfs_url[1])
+                vec = self._footprints.get(bbox=bbox)
 
                 if len(vec) != 0:
                     input_vectors.append(vec)
 
-            except:  # WFS server might be down
-                pass
+            except Exception as e:  # WFS server might be down or too slow, flatten without the buildings
+                print('\n{0}: Could not retrieve the buildings, not flattening them: {1}'.format(
+                    multiprocessing.current_process().name,
+                    str(e)
+                ))
 
-        if len(input_vectors) > 0 and tin is not None:
-            xs = np.linspace(x0, x1, res[0])
-            ys = np.linspace(y0, y1, res[1])
-            xg, yg = np.meshgrid(xs, ys)
+        return [polygon for polygons in input_vectors for polygon in polygons]
 
-            cell_centers = np.vstack((xg.ravel(), yg.ravel(), raster.ravel())).transpose()
+    @staticmethod
+    def sample_heights(polygons, tin, contains, offset=(0, 0)):
+        """ Interpolates the height of the vertices of every polygon in the TIN. Vertices that are shared by several
+        polygons, or appear twice in a ring, are tested and interpolated only once, but still count for every polygon
+        and ring they are in.
+
+        :param polygons: List containing shapely Polygons
+        :param tin: startin.DT() object containing all relevant LAS points for interpolating values of polygons
+        :param contains: Function that takes a numpy array of vertices [[x, y], ...] and returns a boolean numpy array
+        that is True for the vertices that should be sampled
+        :param offset: List containing the origin the points in the TIN are relative to
+        :return: List containing a list of sampled heights per polygon
+        """
+        vertices = []
+        polygon_ids = []
 
-            data = cell_centers[cell_centers[:, 2] != NO_DATA]
-            data_hull = MultiPoint(data).convex_hull
+        for polygon_id, polygon in enumerate(polygons):
+            for ring in [polygon.exterior] + list(polygon.interiors):
+                coords = np.asarray(ring.coords, dtype=np.float64)[:, :2]
 
-            shapes = []
+                vertices.append(coords)
+                polygon_ids.append(np.full(len(coords), polygon_id, dtype=np.intp))
 
-            for polygons in input_vectors:
-                for polygon in polygons:
+        if len(vertices) == 0:
+            return [[] for _ in polygons]
 
-                    els = []
+        unique, inverse = np.unique(np.concatenate(vertices), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)  # Some numpy versions return the inverse with an extra axis
+        polygon_ids = np.concatenate(polygon_ids)
 
-                    for vertex in polygon.exterior.coords:
+        values = np.full(len(unique), np.nan)
 
-                        if Point(vertex).within(data_hull):
-                            try:
-                                els += [tin.interpolate_laplace(vertex[0], vertex[1])]
+        interpolate = tin.interpolate_laplace
 
-                            except OSError:  # Apparently we can sometimes still be outside CH
-                                pass
+        for index in np.nonzero(contains(unique))[0]:
+            try:
+                values[index] = interpolate(unique[index, 0] - offset[0], unique[index, 1] - offset[1])
+
+            except OSError:  # Apparently we can sometimes still be outside CH
+                pass
 
-                    for interior in polygon.interiors:
-                        for vertex in interior.coords:
+        # Back to every vertex of every ring, in the original order, grouped per polygon
+        vertex_values = values[inverse]
+        sampled = ~np.isnan(vertex_values)
 
-                            if Point(vertex).within(data_hull):
-                                try:
-                                    els += [tin.interpolate_laplace(vertex[0], vertex[1])]
+        heights = [[] for _ in polygons]
 
-                                except OSError:  # Apparently we can sometimes still be outside CH
-                                    pass
+        for polygon_id, value in zip(polygon_ids[sampled].tolist(), vertex_values[sampled].tolist()):
+            heights[polygon_id].append(value)
 
-                    if len(els) > 0:
-                        shapes.append((polygon, np.median(els)))
+        return heights
 
-            if len(shapes) > 0:
-                transform = rasterio.transform.from_origin(
-                    west=origin[0],
-                    north=origin[1],
-                    xsize=self._raster_cell_size,
-                    ysize=self._raster_cell_size
-                )
+    def burn(self, origin, raster, shapes):
+        """ Rasterizes the polygons with their flattened height and overlays them on the raster.
 
-                raster_polygons = rasterize(shapes=shapes, out_shape=raster.shape, fill=NO_DATA, transform=transform)
+        :param origin: List containing the coordinates of the top left corner of the raster
+        :param raster: Numpy array containing the content of the raster
+        :param shapes: List containing tuples of (polygon, height)
+        :return: Numpy array containing raster with flattened areas
+        """
+        transform = rasterio.transform.from_origin(
+            west=origin[0],
+            north=origin[1],
+            xsize=self._raster_cell_size,
+            ysize=self._raster_cell_size
+        )
+
+        raster_polygons = rasterize(shapes=shapes, out_shape=raster.shape, fill=NO_DATA, transform=transform)
 
-                for yi in range(res[1]):
-                    for xi in range(res[0]):
-                        if raster_polygons[yi, xi] != NO_DATA:
-                            raster[yi, xi] = raster_polygons[yi, xi]
+        np.copyto(raster, raster_polygons, where=raster_polygons != NO_DATA, casting="unsafe")
 
         return raster
 
-    @staticmethod
-    def patch(res, raster):
+    def get_patch_iterations(self):
+        return self._patch_iterations
+
+    def patch(self, res, raster):
         """ Function that patches in any holes that may have unwillingly occurred in the process. Checks if a raster
         value is NO_DATA, then uses the median of the 8 surrounding cells to give the missing cell a value. Only uses
         value of surrounding cell if that is not NO_DATA.
 
+        Gives the same result as visiting the cells one by one from the top left, where a patched cell is used by the
+        cells after it, see patch_holes(). Holes that are left because all their neighbours were NO_DATA are closed by
+        further passes, up to patch_iterations in the config.
+
         :param res: List representing the resolution of the raster [x-res, y-res]
         :param raster: Numpy array holding the raster value [x, y, z]
         :return: Raster with all NO_DATA holes patched
         """
-        mp = [[-1, -1], [-1, 0], [-1, 1], [0, -1], [0, 1], [1, -1], [1, 0], [1, 1]]
+        view = raster[:res[1], :res[0]]
+
+        iteration = 0
 
-        for yi in range(res[1]):
-            for xi in range(res[0]):
+        while self._patch_iterations == 0 or iteration < self._patch_iterations:
+            if patch_holes(view) == 0:  # No holes left, or none that can be patched
+                break
 
-                if raster[yi, xi] == NO_DATA:
-                    vals = []
+            iteration += 1
 
-                    for m in range(8):
-                        xw, yw = xi + mp[m][0], yi + mp[m][1]
+        return raster
 
-                        if 0 <= xw < res[0] and 0 <= yw < res[1]:
-                            val = raster[yw, xw]
 
-                            if val != NO_DATA:
-                                vals += [val]
+# Neighbours that come before a cell when visiting the cells row by row from the top left, and those that come after
+PREDECESSORS = [(-1, -1), (-1, 0), (-1, 1), (0, -1)]
+SUCCESSORS = [(0, 1), (1, -1), (1, 0), (1, 1)]
 
-                    if len(vals) > MIN_N:
-                        raster[yi, xi] = np.median(vals)
 
-        return raster
+def get_wavefront_levels(holes):
+    """ Determines in which order holes can be patched at the same time, while every hole still sees its neighbours as
+    if all cells were visited one by one from the top left. A hole depends on the holes before it (left, top left, top
+    and top right), so its level is one more than the highest level of those. Holes with the same level do not depend
+    on each other.
+
+    :param holes: Boolean numpy array, True for the cells that are NO_DATA
+    :return: Numpy integer array of the same shape containing the level of every hole, -1 for the other cells
+    """
+    rows, cols = holes.shape
+    levels = np.full(holes.shape, -1, dtype=np.int64)
+    x = np.arange(cols)
+
+    for y in np.nonzero(holes.any(axis=1))[0]:
+        row = holes[y]
+
+        # Level from the holes in the row above, 0 if there are none
+        if y > 0:
+            above = np.pad(levels[y - 1], 1, mode="constant", constant_values=-1)
+            start = np.maximum(np.maximum(above[:-2], above[1:-1]), above[2:]) + 1
+        else:
+            start = np.zeros(cols, dtype=np.int64)
+
+        # Within a run of holes every hole also depends on the one to its left: level[x] = max(start[j] + x - j) over
+        # the holes j of the run up to x. Later runs are offset so the running maximum restarts for every run
+        runs = np.cumsum(row & ~np.concatenate([[False], row[:-1]]))
+        offset = start.max() + cols + 1
+
+        running = np.maximum.accumulate(np.where(row, start - x + runs * offset, np.iinfo(np.int64).min))
+
+        levels[y] = np.where(row, running - runs * offset + x, -1)
+
+    return levels
+
+
+def patch_holes(raster, first_row: int = 0):
+    """ Patches every NO_DATA cell with the median of its 8 neighbours that are not NO_DATA, in place. The result is the
+    same as visiting the cells one by one from the top left, so a patched hole is used by the holes after it, but the
+    holes are patched per wavefront level with array operations instead.
+
+    :param raster: Numpy array holding the raster values
+    :param first_row: Integer representing the first row to patch; the rows above it are context that was already
+    visited (e.g. the last row of the previous band), their holes are not patched again
+    :return: Integer representing the number of holes that were patched
+    """
+    holes = raster == NO_DATA
+    holes[:first_row] = False
+
+    if not holes.any():
+        return 0
+
+    ys, xs = np.nonzero(holes)
+    levels = get_wavefront_levels(holes)[ys, xs]
+
+    order = np.argsort(levels, kind="stable")
+    level_starts = np.searchsorted(levels[order], np.arange(levels.max() + 2))
+
+    # Padded with NO_DATA, so the neighbours of the border cells can be read without checks
+    padded = np.pad(raster, 1, mode="constant", constant_values=NO_DATA)
+    padded_holes = np.pad(holes, 1, mode="constant", constant_values=True)
+
+    patched = 0
+
+    for level in range(len(level_starts) - 1):
+        selection = order[level_starts[level]:level_starts[level + 1]]
+        y, x = ys[selection] + 1, xs[selection] + 1
+
+        # Holes before a cell are already patched (or still NO_DATA), holes after it are not patched yet
+        neighbours = np.stack(
+            [padded[y + dy, x + dx] for dy, dx in PREDECESSORS] +
+            [np.where(padded_holes[y + dy, x + dx], NO_DATA, padded[y + dy, x + dx]) for dy, dx in SUCCESSORS],
+            axis=1
+        ).astype(raster.dtype)
+
+        valid = neighbours != NO_DATA
+        count = valid.sum(axis=1)
+
+        # Sorted with the NO_DATA values last, the median is in the middle of the valid values
+        neighbours[~valid] = np.inf
+        neighbours.sort(axis=1)
+
+        rows = np.arange(len(selection))
+        median = (neighbours[rows, (count - 1) // 2] + neighbours[rows, count // 2]) / 2
+
+        to_patch = count > MIN_N
+        padded[y[to_patch], x[to_patch]] = median[to_patch]
+
+        patched += int(to_patch.sum())
+
+    raster[ys, xs] = padded[ys + 1, xs + 1]
+
+    return patched
@@ -1,4 +1,5 @@
 import configparser
+import math
 import multiprocessing
 import os
 import time
@@ -9,16 +10,30 @@ import startin
 
 import numpy as np
 
-from scipy.spatial import cKDTree
+from rasterio.windows import Window
+from shapely.geometry import Polygon, box
 
 from src.ground_filtering.ground_filtering import GroundFiltering
-from src.interpolation.flatten import Flatten
+from src.interpolation.binning import bin_points
+from src.interpolation.flatten import Flatten, patch_holes
+from src.interpolation.laplace import (
+    HULL_TOLERANCE, convex_hull_ring, extent_triangles, in_convex_hull, laplace_grid, laplace_grid_loop
+)
+from src.interpolation.quad_idw import (
+    INCR_RK, MAX_ITER, START_RK, GridBucketNeighbours, KDTreeNeighbours, quad_idw_cells, quad_idw_grid, quad_idw_loop
+)
 from src.raster import Raster
 from src.tile import Tile
+from src.utils.intermediate import count_points
 from src.utils.helpers import Stages
+from src.utils.points import PointBuffer
 
 NO_DATA = -9999
 
+# Estimated memory use while interpolating a band, used to derive the band height from the memory ceiling
+BYTES_PER_POINT = 400  # TIN, search index and coordinates of a single point
+BYTES_PER_CELL = 48  # Band raster, its float32 copy and the temporary arrays of the engines
+
 
 class Interpolation:
     def __init__(self, input_tile: Tile, result_type: str):
@@ -33,14 +48,23 @@ class Interpolation:
 
         self._raster_cell_size = float(config["global"]["base_raster_cell_size"])
 
+        # 0 interpolates the whole subtile at once, otherwise the subtile is streamed in bands that fit in this many MB
+        self._memory_ceiling = float(config["global"].get("memory_ceiling_in_mb", "0"))
+
         self._interpolation_variables = config["interpolation_dsm"] if result_type == "dsm" else config["interpolation_dtm"]
         self._stage = Stages.INTERPOLATED_DSM if result_type == "dsm" else Stages.INTERPOLATED_DTM
 
+        # batch: evaluate the whole grid per call, loop: cell-by-cell reference implementation
+        self._engine = self._interpolation_variables.get("engine", "batch")
+        self._workers = int(self._interpolation_variables.get("workers", "-1"))
+        self._cell_reducer = self._interpolation_variables.get("cell_reducer", "max")
+        self._neighbour_index = self._interpolation_variables.get("neighbour_index", "kdtree")
+
         tile_bounds = self._tile.get_unbuffered_geometry().bounds
         tile_bounds = [int(bound) for bound in tile_bounds]
         
         self._raster = None
-        self._las_data = None
+        self._points = None
 
         self._tin = startin.DT()
 
@@ -54,11 +78,11 @@ class Interpolation:
         # Origin = [minx, maxy] == topleft corner
         self._origin = [tile_bounds[0], tile_bounds[3]]
 
-        self._y_range = reversed(np.arange(
+        self._y_range = np.arange(
             start=tile_bounds[1],
             stop=tile_bounds[1] + self._resolution[1] * self._raster_cell_size,
             step=self._raster_cell_size
-        ))
+        )[::-1]
 
         self._x_range = np.arange(
             start=tile_bounds[0],
@@ -66,34 +90,86 @@ class Interpolation:
             step=self._raster_cell_size
         )
 
+        # The points are relative to the origin, so the engines work on the grid relative to the origin as well
+        self._x_local = self._x_range - self._origin[0]
+        self._y_local = self._y_range - self._origin[1]
+
         print('extents', self._extents)
         print('resolution', self._resolution)
         print('origin', self._origin)
 
+    def get_stage(self):
+        return self._stage
+
+    def get_tile(self):
+        return self._tile
+
+    def needs_points(self):
+        """ Checks if interpolate() will interpolate, so outlier filtering can be skipped if it won't
+
+        :return: True if the input is not empty and the output does not exist or should be overwritten
+        """
+        save_name = self._get_save_name()
+
+        if self._is_empty():
+            return False
+
+        return os.path.exists(save_name) and self._to_overwrite is True or not os.path.exists(save_name)
+
+    def has_filtered_points(self):
+        """ Checks if the points of this subtile were already filtered and partitioned as part of its main tile
+
+        :return: True if the filtered points are stored in the filtered stage
+        """
+        return os.path.exists(self._get_filtered_points_name())
+
+    def _is_empty(self):
+        if self._tile.point_count is not None:
+            return self._tile.point_count == 0
+
+        if self.has_filtered_points():
+            return np.load(self._get_filtered_points_name(), mmap_mode="r").shape[0] == 0
+
+        # Can happen if there are 0 points in that subtile
+        return count_points(self._tile.filepath) == 0
+
+    def set_points(self, points: PointBuffer):
+        """ Provides points that have already been filtered for this stage, so pre-processing does not filter again
+
+        :param points: PointBuffer object containing the filtered points
+        :return: None
+        """
+        self._points = points
+
     def interpolate(self):
         save_name = self._get_save_name()
 
         interpolation_success = False
 
-        # Empty LAS is 229 bytes, can happen if there are 0 points in that subtile
-        # TODO: More elegant solution
-        if os.path.getsize(self._tile.filepath) < 1000:
-            print("Size of input file is less than 1000 bytes, not interpolating")
+        if self._is_empty():
+            print("Input of subtile contains no points, not interpolating")
 
         elif os.path.exists(save_name) and self._to_overwrite is True or not os.path.exists(save_name):
 
             try:
                 self._do_pre_processing()
 
-                if self._stage == Stages.INTERPOLATED_DTM:
-                    interpolation_success = self._startin_laplace()
+                if self._memory_ceiling > 0:
+                    interpolation_success = self._interpolate_streaming()
 
                 else:
-                    interpolation_success = self._quad_idw()
+                    self._raster = self._interpolate_rows(
+                        points=self._points.xyz,
+                        tin=self._tin,
+                        y_range=self._y_local,
+                        top=0
+                    )
+
+                    interpolation_success = True
 
-                self._do_post_processing()
+                    self._do_post_processing()
 
-                self._save_raster()
+                    self._save_raster()
 
             except Exception as e:
                 print('\n{0}: Ran into an error while interpolating: {1}'.format(
@@ -106,6 +182,12 @@ class Interpolation:
             # File already exists so assuming interpolation was a success previously
             interpolation_success = True
 
+        # The TIN, raster and points are only needed while interpolating, release them before the next product of the
+        # same subtile is interpolated in this process
+        self._tin = None
+        self._raster = None
+        self._points = None
+
         if interpolation_success is True:
             self._tile.related_raster = Raster(
                 raster_name=self._tile.get_tile_name(),
@@ -115,12 +197,21 @@ class Interpolation:
 
         self._tile.interpolated = True
 
+    def _get_filtered_points_name(self):
+        return self._tile.get_save_path(
+            stage=Stages.FILTERED, subtile_id=self._tile.get_tile_name(), extension="npy"
+        )
+
     def _get_save_name(self):
         return self._tile.get_save_path(
             stage=self._stage, subtile_id=self._tile.get_tile_name(), extension="TIF"
         )
 
-    def _save_raster(self):
+    def _get_profile(self):
+        """ Returns the GeoTIFF profile of the interpolated raster of this subtile
+
+        :return: Dictionary containing the rasterio profile
+        """
         transform = rasterio.transform.from_origin(
             west=self._origin[0],
             north=self._origin[1],
@@ -128,22 +219,23 @@ class Interpolation:
             ysize=self._raster_cell_size
         )
 
+        return {
+            "driver": "GTiff",
+            "height": self._resolution[1],
+            "width": self._resolution[0],
+            "count": 1,
+            "dtype": "float32",
+            "crs": "EPSG:28992",
+            "transform": transform,
+            "nodata": NO_DATA,
+        }
+
+    def _save_raster(self):
         self._raster = self._raster.astype(np.float32)
 
         with rasterio.Env():
 
-            with rasterio.open(
-                    self._get_save_name(),
-                    "w",
-                    driver='GTiff',
-                    height=self._raster.shape[0],
-                    width=self._raster.shape[1],
-                    count=1,
-                    dtype=str(self._raster.dtype),
-                    crs='EPSG:28992',
-                    transform=transform,
-                    nodata=NO_DATA
-            ) as dest:
+            with rasterio.open(self._get_save_name(), "w", **self._get_profile()) as dest:
                 dest.write(self._raster, 1)
 
     def _do_pre_processing(self):
@@ -151,17 +243,33 @@ class Interpolation:
             multiprocessing.current_process().name,
         ))
 
-        ground_filtering = GroundFiltering(input_tile=self._tile)
+        if self._points is None and self.has_filtered_points():  # Filtered as part of the main tile
+            # Memory mapped, so only the columns of the buffer are read
+            points = np.load(self._get_filtered_points_name(), mmap_mode="r")
+
+            self._points = GroundFiltering.select_points(
+                PointBuffer.from_structured(points, origin=self._origin), self._stage
+            )
+
+            del points
+
+        elif self._points is None:  # Not filtered yet as part of a shared filtering step
+            ground_filtering = GroundFiltering(input_tile=self._tile)
 
-        self._las_data = ground_filtering.remove_outliers(self._stage)
+            self._points = ground_filtering.remove_outliers(self._stage)
 
-        self._las_data = np.asarray(self._las_data[0].tolist())[:, :3]
+        self._points = self._points.with_origin(self._origin)
 
         print('\n{0}: Finished outlier filtering'.format(
             multiprocessing.current_process().name,
         ))
 
-        self._tin.insert(self._las_data)
+        if self._memory_ceiling > 0:
+            # Sorted by y so the points of a band are a contiguous slice, the TINs are created per band
+            self._points = self._points.select(np.argsort(self._points.xyz[:, 1], kind="stable"))
+
+        else:
+            self._tin.insert(self._points.xyz)
 
     def _do_post_processing(self):
         print(self._raster)
@@ -174,7 +282,9 @@ class Interpolation:
             raster=self._raster,
             tin=self._tin,
             extents=self._extents,
-            stage=self._stage
+            stage=self._stage,
+            offset=self._points.origin,
+            hull=convex_hull_ring(self._points.xyz) if len(self._points) >= 3 else None
         )
 
         print(self._raster)
@@ -183,7 +293,22 @@ class Interpolation:
 
         print(self._raster)
 
-    def _startin_laplace(self):
+    def _interpolate_rows(self, points, tin, y_range, top):
+        """ Interpolates a band of rows (or all rows) of the raster with the engine for this stage.
+
+        :param points: Numpy array containing the points as [[x, y, z], ...] that are needed for these rows, relative
+        to the origin of the raster
+        :param tin: startin.DT() object containing these points
+        :param y_range: Numpy array containing the y coordinate of every row (top row first), relative to the origin
+        :param top: Float representing the y coordinate of the top edge of the first row, relative to the origin
+        :return: Numpy array containing the interpolated rows
+        """
+        if self._stage == Stages.INTERPOLATED_DTM:
+            return self._startin_laplace(points=points, tin=tin, y_range=y_range)
+
+        return self._quad_idw(points=points, y_range=y_range, top=top)
+
+    def _startin_laplace(self, points, tin, y_range):
         """Takes the grid parameters and the ground points. Interpolates using Laplace method.
         """
         print('\n{0}: Starting Laplace'.format(
@@ -192,116 +317,438 @@ class Interpolation:
 
         start_time = time.time()
 
-        self._raster = np.zeros([self._resolution[1], self._resolution[0]])
+        if self._engine == "loop":
+            raster = laplace_grid_loop(tin=tin, x_range=self._x_local, y_range=y_range)
 
-        yi = 0
+        else:
+            raster = laplace_grid(
+                tin=tin,
+                x_range=self._x_local,
+                y_range=y_range,
+                hull=convex_hull_ring(points)
+            )
+
+        print('\n{0}: Finished Laplace in {1} seconds'.format(
+            multiprocessing.current_process().name,
+            time.time() - start_time
+        ))
 
-        for y in self._y_range:
-            xi = 0
+        return raster
 
-            for x in self._x_range:
-                tri = self._tin.locate(x, y)
+    def _quad_idw(self, points, y_range, top):
+        print('\n{0}: Starting Quad IDW'.format(
+            multiprocessing.current_process().name,
+        ))
 
-                if tri != [] and 0 not in tri:
-                    try:
-                        self._raster[yi, xi] = self._tin.interpolate_laplace(x, y)
+        start_time = time.time()
 
-                    except Exception as e:
-                        print(e)
+        if self._engine == "loop":
+            raster = quad_idw_loop(points=points, x_range=self._x_local, y_range=y_range)
 
-                else:
-                    self._raster[yi, xi] = NO_DATA
+        elif self._engine == "hybrid":
+            raster = self._binned_quad_idw(points=points, y_range=y_range, top=top)
 
-                xi += 1
-            yi += 1
+        else:
+            raster = quad_idw_grid(
+                points=points,
+                neighbours=self._get_neighbours(points),
+                x_range=self._x_local,
+                y_range=y_range
+            )
 
-        print('\n{0}: Finished Laplace in {1} seconds'.format(
+        print('\n{0}: Finished Quad IDW in {1} seconds'.format(
             multiprocessing.current_process().name,
             time.time() - start_time
         ))
 
-        return True
+        return raster
 
-    def _quad_idw(self):
-        start_rk = 1
-        pwr = 2
-        minp = 1
-        incr_rk = 3
-        tolerance = 2
-        maxiter = 2
+    def _get_neighbours(self, points):
+        """ Creates the neighbour search backend chosen in the config for the Quad IDW engines. Buckets are aligned to
+        the raster and are a whole number of cells, about the size of the first search radius.
 
-        print('\n{0}: Starting Quad IDW'.format(
-            multiprocessing.current_process().name,
-        ))
+        :param points: Numpy array containing the points as [[x, y, z], ...], relative to the origin of the raster
+        :return: KDTreeNeighbours or GridBucketNeighbours object over the points
+        """
+        if self._neighbour_index == "buckets":
+            bucket_size = self._raster_cell_size * max(1, round(START_RK / self._raster_cell_size))
 
-        start_time = time.time()
+            return GridBucketNeighbours(points, cell_size=bucket_size, origin=[0, 0])
 
-        ras = np.zeros([self._resolution[1], self._resolution[0]])
-        tree = cKDTree(np.array([self._las_data[:, 0], self._las_data[:, 1]]).transpose())
+        return KDTreeNeighbours(points, workers=self._workers)
 
-        yi = 0
+    def _binned_quad_idw(self, points, y_range, top):
+        """ Bins the points into the raster cells they fall in, every cell that contains points gets the reduced height
+        of those points. Only the cells that stay empty are interpolated with Quad IDW.
 
-        for y in self._y_range:
-            xi = 0
+        :param points: Numpy array containing the points as [[x, y, z], ...], relative to the origin of the raster
+        :param y_range: Numpy array containing the y coordinate of every row (top row first), relative to the origin
+        :param top: Float representing the y coordinate of the top edge of the first row, relative to the origin
+        :return: Numpy array containing the raster
+        """
+        raster = bin_points(
+            points=points,
+            origin=[0, top],
+            cell_size=self._raster_cell_size,
+            shape=(len(y_range), self._resolution[0]),
+            reducer=self._cell_reducer
+        )
 
-            for x in self._x_range:
-                done = False
-                i = 0
-                rk = start_rk
-                xyp = []
+        rows, cols = np.nonzero(raster == NO_DATA)
 
-                while done is False:
-                    ix = tree.query_ball_point([x, y], rk, tolerance)
+        print('\n{0}: Binned points, {1} of {2} cells left to interpolate'.format(
+            multiprocessing.current_process().name,
+            rows.size,
+            raster.size
+        ))
 
-                    if len(ix) >= 4 * minp:  # Need at least minp points per quadrant
+        if rows.size > 0:
+            raster[rows, cols] = quad_idw_cells(
+                points=points,
+                neighbours=self._get_neighbours(points),
+                qx=self._x_local[cols],
+                qy=y_range[rows]
+            )
 
-                        xyp = self._las_data[ix]
+        return raster
 
-                        qs = [
-                            xyp[(xyp[:, 0] < x) & (xyp[:, 1] < y)],
-                            xyp[(xyp[:, 0] > x) & (xyp[:, 1] < y)],
-                            xyp[(xyp[:, 0] < x) & (xyp[:, 1] > y)],
-                            xyp[(xyp[:, 0] > x) & (xyp[:, 1] > y)]
-                        ]
+    def _get_halo(self):
+        """ Returns how far outside of a band points are still needed to interpolate the band, which is the largest
+        search radius used by the engines. Laplace has no search radius, for the DTM this is where the points of a band
+        start, see _get_missing_extent().
 
-                        if min(qs[0].size, qs[1].size, qs[2].size, qs[3].size) >= minp:
-                            done = True
+        :return: Float representing the distance in meters
+        """
+        return max(float(self._interpolation_variables["radius"]), START_RK + INCR_RK * (MAX_ITER - 1))
 
-                    if i >= maxiter:
-                        ras[yi, xi] = NO_DATA
-                        break
+    def _get_band_rows(self):
+        """ Derives the number of raster rows per band from the memory ceiling, using the average number of points
+        per row and the estimated memory use per point and per cell.
 
-                    rk += incr_rk
-                    i += 1
+        :return: Integer representing the number of rows per band
+        """
+        budget = self._memory_ceiling * 1024 * 1024
 
-                else:
-                    a_sum = 0
-                    b_sum = 0
+        points_per_row = len(self._points) / max(self._resolution[1], 1)
+        halo_rows = math.ceil(self._get_halo() / self._raster_cell_size)
 
-                    for pt in xyp:
-                        dst = np.sqrt((x - pt[0]) ** 2 + (y - pt[1]) ** 2)
+        rows = (budget - 2 * halo_rows * points_per_row * BYTES_PER_POINT) / \
+               (self._resolution[0] * BYTES_PER_CELL + points_per_row * BYTES_PER_POINT)
 
-                        if dst > 0:
-                            u = pt[2]
-                            w = 1 / dst ** pwr
+        return int(min(max(rows, 1), max(self._resolution[1], 1)))
 
-                            a_sum += u * w
-                            b_sum += w
+    def _get_bands(self):
+        """ Splits the raster into horizontal bands.
 
-                    if b_sum > 0:
-                        ras[yi, xi] = a_sum / b_sum
+        :return: List of tuples containing the first and last (exclusive) row of every band
+        """
+        band_rows = self._get_band_rows()
 
-                    else:
-                        ras[yi, xi] = NO_DATA
+        return [
+            (first, min(first + band_rows, self._resolution[1])) for first in range(0, self._resolution[1], band_rows)
+        ]
 
-                xi += 1
-            yi += 1
+    def _interpolate_streaming(self):
+        """ Interpolates the subtile in horizontal bands to keep memory use below the configured ceiling. For every
+        band only the points within the band plus the search radius are put in a TIN and search index, and the
+        finished band is written straight to its window in the output GeoTIFF. For the DTM the points of a band are
+        extended until its TIN interpolates the band like the TIN of the whole subtile, see _get_missing_extent().
 
-        print('\n{0}: Finished Quad IDW in {1} seconds'.format(
+        Flattening needs the heights of complete polygons, so it runs as a second pass over the bands: the vertex
+        heights are sampled while the TIN of a band is available, then every band is read back with one row above and
+        below it, flattened, patched and written again. Every further patch iteration is another pass over all bands,
+        so the result does not depend on the band height.
+
+        The raster is written under a temporary name and only moved to its save name once it is complete, so an
+        interrupted run never leaves a partial or unflattened raster that a rerun would take as finished.
+
+        :return: True if the raster was written
+        """
+        bands = self._get_bands()
+
+        print('\n{0}: Streaming interpolation in {1} bands of at most {2} rows'.format(
             multiprocessing.current_process().name,
-            time.time() - start_time
+            len(bands),
+            bands[0][1] - bands[0][0]
         ))
 
-        self._raster = ras
+        flatten = Flatten()
+        polygons = flatten.get_vectors(extents=self._extents, stage=self._stage)
+
+        save_name = self._get_save_name()
+        temporary_name = "{0}.{1}.tmp".format(save_name, os.getpid())
+
+        try:
+            with rasterio.Env():
+                heights = self._write_bands(filepath=temporary_name, bands=bands, flatten=flatten, polygons=polygons)
+
+                shapes = [(polygon, np.median(els)) for polygon, els in zip(polygons, heights) if len(els) > 0]
+
+                self._flatten_bands(filepath=temporary_name, bands=bands, flatten=flatten, shapes=shapes)
+
+        except Exception:
+            if os.path.exists(temporary_name):
+                os.remove(temporary_name)
+
+            raise
+
+        os.replace(temporary_name, save_name)
 
         return True
+
+    def _write_bands(self, filepath, bands, flatten, polygons):
+        """ Interpolates every band from the points within the band plus the search radius (plus the points the
+        Laplace interpolant of the band depends on for the DTM) and writes it to its window of a new GeoTIFF. The
+        vertex heights of the polygons are sampled while the TIN of a band is available.
+
+        :param filepath: String representing the path of the GeoTIFF to create
+        :param bands: List of tuples containing the first and last (exclusive) row of every band
+        :param flatten: Flatten object that samples the vertex heights
+        :param polygons: List containing the shapely Polygons to flatten
+        :return: List containing a list of sampled heights per polygon
+        """
+        halo = self._get_halo()
+        ys = self._points.xyz[:, 1]
+
+        hull = convex_hull_ring(self._points.xyz) if len(self._points) >= 3 else None
+
+        # The vertex heights are sampled with Laplace as well, for the DSM these are the only locations that need it
+        corners = self._get_corners(polygons)
+
+        heights = [[] for _ in polygons]
+
+        with rasterio.open(filepath, "w", **self._get_profile()) as dest:
+
+            for first, last in bands:
+                # Relative to the origin, like the points
+                top = -first * self._raster_cell_size
+                bottom = -last * self._raster_cell_size
+
+                lower = bottom - halo
+                upper = top + halo
+
+                extent = self._get_laplace_extent(corners, first=first, bottom=bottom, top=top)
+
+                while True:
+                    start = np.searchsorted(ys, lower, side="left")
+                    end = np.searchsorted(ys, upper, side="right")
+                    points = self._points.xyz[start:end]
+
+                    if len(points) < 3:  # Not enough points to triangulate
+                        break
+
+                    tin = startin.DT()
+                    tin.insert(points)
+
+                    if extent is None:
+                        break
+
+                    missing = self._get_missing_extent(tin, points=points, start=start, end=end, extent=extent,
+                                                       hull=hull)
+
+                    if missing is None or missing[0] >= lower and missing[1] <= upper:
+                        break
+
+                    lower = min(lower, missing[0])
+                    upper = max(upper, missing[1])
+
+                    del tin
+
+                if len(points) < 3:
+                    dest.write(np.full((last - first, self._resolution[0]), NO_DATA, np.float32), 1,
+                               window=Window(0, first, self._resolution[0], last - first))
+                    continue
+
+                if bottom - lower > halo or upper - top > halo:
+                    print('\n{0}: Extended band {1} to {2} m below and {3} m above it for its TIN'.format(
+                        multiprocessing.current_process().name,
+                        first,
+                        str(round(bottom - lower, 2)),
+                        str(round(upper - top, 2))
+                    ))
+
+                band = self._interpolate_rows(points=points, tin=tin, y_range=self._y_local[first:last], top=top)
+
+                dest.write(band.astype(np.float32), 1, window=Window(0, first, self._resolution[0], last - first))
+
+                band_heights = flatten.sample_heights(
+                    polygons=polygons,
+                    tin=tin,
+                    contains=lambda vertices: self._in_band(vertices - self._origin, first=first, bottom=bottom,
+                                                            top=top),
+                    offset=self._points.origin
+                )
+
+                for polygon_heights, els in zip(heights, band_heights):
+                    polygon_heights += els
+
+                del tin
+
+        return heights
+
+    @staticmethod
+    def _get_corners(polygons):
+        """ Collects the vertices of the rings of polygons.
+
+        :param polygons: List containing shapely Polygons
+        :return: Numpy array containing the vertices as [[x, y], ...]
+        """
+        rings = [ring for polygon in polygons for ring in [polygon.exterior] + list(polygon.interiors)]
+
+        if len(rings) == 0:
+            return np.empty((0, 2))
+
+        return np.concatenate([np.asarray(ring.coords, dtype=np.float64)[:, :2] for ring in rings])
+
+    @staticmethod
+    def _in_band(xy, first, bottom, top):
+        """ Tests which locations lie in a band, the top edge of the raster belongs to the first band.
+
+        :param xy: Numpy array containing the locations as [[x, y], ...], relative to the origin
+        :param first: Integer representing the first row of the band
+        :param bottom: Float representing the y coordinate of the bottom edge of the band, relative to the origin
+        :param top: Float representing the y coordinate of the top edge of the band, relative to the origin
+        :return: Boolean numpy array, True for the locations in the band
+        """
+        return (bottom <= xy[:, 1]) & (xy[:, 1] < top) | (first == 0) & (xy[:, 1] == 0)
+
+    def _get_laplace_extent(self, corners, first, bottom, top):
+        """ Determines the area of a band that is interpolated with Laplace: the whole band for the DTM, the polygon
+        vertices in the band for the DSM.
+
+        :param corners: Numpy array containing the polygon vertices as [[x, y], ...], see _get_corners()
+        :param first: Integer representing the first row of the band
+        :param bottom: Float representing the y coordinate of the bottom edge of the band, relative to the origin
+        :param top: Float representing the y coordinate of the top edge of the band, relative to the origin
+        :return: List representing the area as [minx, miny, maxx, maxy] relative to the origin, None if there is none
+        """
+        if self._stage == Stages.INTERPOLATED_DTM:
+            return [0, bottom, self._extents[0][1] - self._origin[0], top]
+
+        xy = corners - self._origin
+        xy = xy[self._in_band(xy, first=first, bottom=bottom, top=top)]
+
+        if len(xy) == 0:
+            return None
+
+        return [xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max()]
+
+    def _get_missing_extent(self, tin, points, start, end, extent, hull):
+        """ Finds the points of the subtile outside of a band TIN that would change how the TIN interpolates an area of
+        the band with Laplace. Laplace has no search radius, the value at a location depends on the triangles whose
+        circumcircle contains it, which reach far outside the band across gaps in the points (buildings, water). The
+        band TIN interpolates the area like the TIN of all points if no other point is in the circumcircle of a
+        triangle that reaches the area or of its neighbours, no other point is beyond the hull edges of these
+        triangles, and the area is covered by the band TIN as far as it is by the convex hull of all points.
+
+        :param tin: startin.DT() object containing the points of the band
+        :param points: Numpy array containing the points of the band, self._points.xyz[start:end]
+        :param start: Integer representing the index of the first point of the band in the points sorted by y
+        :param end: Integer representing the index after the last point of the band
+        :param extent: List representing the area as [minx, miny, maxx, maxy], relative to the origin
+        :param hull: Numpy array containing the convex hull of all points, see convex_hull_ring()
+        :return: Tuple with the lowest and highest y coordinate of the points that are missing, None if none are
+        """
+        xyz = self._points.xyz
+        ys = xyz[:, 1]
+
+        vertices = np.asarray(tin.all_vertices(), dtype=np.float64)[:, :2]
+        triangles = np.asarray(tin.all_triangles(), dtype=np.intp).reshape(-1, 3)
+
+        centres, radii, hull_edges = extent_triangles(vertices, triangles, extent)
+
+        missing = []
+
+        # Points in a circumcircle, only circumcircles that extend outside of the points of the band can contain any
+        lows = np.searchsorted(ys, centres[:, 1] - radii, side="left")
+        highs = np.searchsorted(ys, centres[:, 1] + radii, side="right")
+
+        for index in np.nonzero((lows < start) | (highs > end))[0]:
+            for candidates in (xyz[lows[index]:start], xyz[end:highs[index]]):
+                distances = (candidates[:, 0] - centres[index, 0]) ** 2 + (candidates[:, 1] - centres[index, 1]) ** 2
+
+                missing.append(candidates[distances < radii[index] ** 2 * (1 - 1e-9), 1])
+
+        # Points beyond a hull edge of the band TIN, the hull of all points has the outermost of them
+        for a, b, c in hull_edges:
+            edge = vertices[b] - vertices[a]
+            inside = edge[0] * (vertices[c, 1] - vertices[a, 1]) - edge[1] * (vertices[c, 0] - vertices[a, 0])
+            sides = edge[0] * (hull[:, 1] - vertices[a, 1]) - edge[1] * (hull[:, 0] - vertices[a, 0])
+
+            beyond = (np.sign(sides) == -np.sign(inside)) & (np.abs(sides) > HULL_TOLERANCE * np.hypot(*edge))
+
+            missing.append(hull[beyond, 1])
+
+        # Parts of the area inside the hull of all points but outside the hull of the band TIN, the band needs the
+        # ends of the edges of the hull of all points along the area
+        covered = Polygon(hull).intersection(box(*extent))
+
+        if covered.geom_type == "Polygon" and not covered.is_empty and not in_convex_hull(
+                convex_hull_ring(points), np.asarray(covered.exterior.coords)).all():
+            ends = np.roll(hull, -1, axis=0)
+            along = (np.minimum(hull[:, 1], ends[:, 1]) <= extent[3]) & \
+                    (np.maximum(hull[:, 1], ends[:, 1]) >= extent[1])
+
+            missing.extend([hull[along, 1], ends[along, 1]])
+
+        missing = np.concatenate(missing) if len(missing) > 0 else np.empty(0)
+
+        if len(missing) == 0:
+            return None
+
+        return missing.min(), missing.max()
+
+    def _flatten_bands(self, filepath, bands, flatten, shapes):
+        """ Burns the polygons into a GeoTIFF written by _write_bands() and patches its holes, band by band. The first
+        pass burns the polygons, every pass patches once over all bands, like one pass of Flatten.patch over the whole
+        raster.
+
+        :param filepath: String representing the path of the GeoTIFF
+        :param bands: List of tuples containing the first and last (exclusive) row of every band
+        :param flatten: Flatten object that burns the polygons
+        :param shapes: List of tuples containing a shapely Polygon and its height
+        :return: None
+        """
+        iterations = flatten.get_patch_iterations()
+
+        with rasterio.open(filepath, "r+") as dest:
+            iteration = 0
+
+            while True:
+                burn = iteration == 0 and len(shapes) > 0
+                patch = iterations == 0 or iteration < iterations
+
+                if not burn and not patch:
+                    break
+
+                patched = 0
+
+                for first, last in bands:
+                    # One row of context on both sides. The row above was visited already in this pass and is not
+                    # patched again, the row below is not visited yet, as on the whole raster
+                    window_first = max(first - 1, 0)
+                    window_last = min(last + 1, self._resolution[1])
+
+                    window = Window(0, window_first, self._resolution[0], window_last - window_first)
+                    raster = dest.read(1, window=window).astype(np.float64)
+
+                    if burn:
+                        raster = flatten.burn(
+                            origin=[self._origin[0], self._origin[1] - window_first * self._raster_cell_size],
+                            raster=raster,
+                            shapes=shapes
+                        )
+
+                    if patch:
+                        patched += patch_holes(raster, first_row=first - window_first)
+
+                    dest.write(
+                        raster[first - window_first:last - window_first].astype(np.float32),
+                        1,
+                        window=Window(0, first, self._resolution[0], last - first)
+                    )
+
+                if not patch or patched == 0:
+                    break
+
+                iteration += 1
@@ -0,0 +1,199 @@
+import numpy as np
+
+from scipy.spatial import ConvexHull
+
+NO_DATA = -9999
+HULL_TOLERANCE = 1e-6
+
+
+def convex_hull_ring(points):
+    """ Computes the 2D convex hull of a point cloud, which is the area in which startin can interpolate.
+
+    :param points: Numpy array containing the points as [[x, y, z], ...]
+    :return: Numpy array containing the hull vertices as [[x, y], ...] in counter-clockwise order
+    """
+    xy = np.ascontiguousarray(points[:, :2], dtype=np.float64)
+
+    return xy[ConvexHull(xy).vertices]
+
+
+def hull_row_intervals(hull, y_range):
+    """ Intersects every row of the raster with the convex hull. As the hull is convex each row crosses it at most
+    once, so a single [xmin, xmax] interval per row describes all cells that are inside the hull.
+
+    :param hull: Numpy array containing the hull vertices as [[x, y], ...]
+    :param y_range: Numpy array containing the y coordinate of every row
+    :return: Tuple of two numpy arrays with the xmin and xmax per row, rows outside the hull get xmin > xmax
+    """
+    x0 = hull[:, 0]
+    y0 = hull[:, 1]
+    x1 = np.roll(x0, -1)
+    y1 = np.roll(y0, -1)
+
+    ys = np.asarray(y_range, dtype=np.float64)[:, None]
+
+    sloped = y0 != y1
+    crosses = sloped & (ys >= np.minimum(y0, y1)) & (ys <= np.maximum(y0, y1))
+
+    t = (ys - y0) / np.where(sloped, y1 - y0, 1)
+    xs = x0 + t * (x1 - x0)
+
+    row_min = np.where(crosses, xs, np.inf).min(axis=1) - HULL_TOLERANCE
+    row_max = np.where(crosses, xs, -np.inf).max(axis=1) + HULL_TOLERANCE
+
+    return row_min, row_max
+
+
+def in_convex_hull(hull, xy):
+    """ Tests which points are inside a convex hull (or on its boundary), for all points at once. A point is inside if
+    it is on the left of every edge of the counter-clockwise hull.
+
+    :param hull: Numpy array containing the hull vertices as [[x, y], ...] in counter-clockwise order
+    :param xy: Numpy array containing the points to test as [[x, y], ...]
+    :return: Boolean numpy array, True for the points inside the hull
+    """
+    xy = np.asarray(xy, dtype=np.float64)
+    inside = np.ones(len(xy), dtype=bool)
+
+    for start, end in zip(hull, np.roll(hull, -1, axis=0)):
+        cross = (end[0] - start[0]) * (xy[:, 1] - start[1]) - (end[1] - start[1]) * (xy[:, 0] - start[0])
+        inside &= cross >= -HULL_TOLERANCE
+
+    return inside
+
+
+def circumcircles(vertices, triangles):
+    """ Computes the circumcircle of every triangle, relative to its first vertex for precision.
+
+    :param vertices: Numpy array containing the vertices as [[x, y], ...]
+    :param triangles: Numpy array containing the vertex indices of every triangle as [[a, b, c], ...]
+    :return: Tuple of two numpy arrays with the centres as [[x, y], ...] and the radii
+    """
+    a = vertices[triangles[:, 0]]
+    b = vertices[triangles[:, 1]] - a
+    c = vertices[triangles[:, 2]] - a
+
+    d = 2 * (b[:, 0] * c[:, 1] - b[:, 1] * c[:, 0])
+    b2 = (b * b).sum(axis=1)
+    c2 = (c * c).sum(axis=1)
+
+    ux = (c[:, 1] * b2 - b[:, 1] * c2) / d
+    uy = (b[:, 0] * c2 - c[:, 0] * b2) / d
+
+    return a + np.column_stack([ux, uy]), np.hypot(ux, uy)
+
+
+def extent_triangles(vertices, triangles, extent):
+    """ Selects the triangles of a TIN that the Laplace interpolant within an extent depends on. The natural neighbours
+    of a location are the vertices of the triangles whose circumcircle contains it, so these are the triangles whose
+    circumcircle reaches the extent. Their neighbours are selected as well, they decide where the cavity of a location
+    ends.
+
+    :param vertices: Numpy array containing the vertices as [[x, y], ...]
+    :param triangles: Numpy array containing the vertex indices of every triangle as [[a, b, c], ...]
+    :param extent: List representing the extent as [minx, miny, maxx, maxy]
+    :return: Tuple of the centres [[x, y], ...] and radii of the circumcircles of the selected triangles, and the
+    edges on the convex hull of the triangles that reach the extent as [[a, b, c], ...], c being the third vertex of
+    their triangle
+    """
+    centres, radii = circumcircles(vertices, triangles)
+
+    dx = np.maximum(np.maximum(extent[0] - centres[:, 0], centres[:, 0] - extent[2]), 0)
+    dy = np.maximum(np.maximum(extent[1] - centres[:, 1], centres[:, 1] - extent[3]), 0)
+    reaches = dx * dx + dy * dy <= radii * radii
+
+    # Every edge as a sorted pair of vertices, shared by two triangles or on the hull if it is in a single triangle
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    opposite = np.concatenate([triangles[:, 2], triangles[:, 0], triangles[:, 1]])
+    owners = np.tile(np.arange(len(triangles)), 3)
+
+    pairs = np.sort(edges, axis=1).astype(np.int64)
+    _, inverse, counts = np.unique(pairs[:, 0] * len(vertices) + pairs[:, 1], return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)  # Some numpy versions return the inverse with an extra axis
+
+    touched = np.zeros(len(counts), dtype=bool)
+    touched[inverse[reaches[owners]]] = True
+
+    selected = np.zeros(len(triangles), dtype=bool)
+    selected[owners[touched[inverse]]] = True
+
+    hull = reaches[owners] & (counts[inverse] == 1)
+
+    return centres[selected], radii[selected], np.column_stack([edges[hull], opposite[hull]])
+
+
+def laplace_grid(tin, x_range, y_range, hull):
+    """ Evaluates the Laplace interpolant for a grid (or a band of rows of a grid) of cells in one call.
+
+    Cells outside of the convex hull are set to NO_DATA without calling startin. The cells inside the hull are visited
+    in a serpentine order (left to right, then right to left on the next row), because startin starts walking from
+    the last triangle it visited, every point location becomes a walk of a few triangles. Unlike the cell-by-cell loop
+    every point is located only once, by interpolate_laplace itself.
+
+    :param tin: startin.DT() object containing the points to interpolate from
+    :param x_range: Numpy array containing the x coordinate of every column
+    :param y_range: Numpy array containing the y coordinate of every row (top row first)
+    :param hull: Numpy array containing the convex hull of the points in the TIN, see convex_hull_ring()
+    :return: Numpy array of shape (len(y_range), len(x_range)) containing the interpolated values
+    """
+    raster = np.full((len(y_range), len(x_range)), NO_DATA, dtype=np.float64)
+
+    x_range = np.asarray(x_range, dtype=np.float64)
+    xs = x_range.tolist()  # Python floats are cheaper to hand over to startin than numpy scalars
+    row_min, row_max = hull_row_intervals(hull, y_range)
+
+    interpolate = tin.interpolate_laplace
+
+    for yi, y in enumerate(np.asarray(y_range, dtype=np.float64).tolist()):
+        first = np.searchsorted(x_range, row_min[yi], side="left")
+        last = np.searchsorted(x_range, row_max[yi], side="right")
+
+        if first >= last:
+            continue
+
+        columns = range(first, last) if yi % 2 == 0 else range(last - 1, first - 1, -1)
+        row = raster[yi]
+
+        for xi in columns:
+            try:
+                row[xi] = interpolate(xs[xi], y)
+
+            except OSError:  # Cell is on the hull boundary and still ends up outside the CH
+                pass
+
+    return raster
+
+
+def laplace_grid_loop(tin, x_range, y_range):
+    """ Reference implementation that locates and interpolates every cell separately. Kept to be able to benchmark
+    and validate laplace_grid() against.
+
+    :param tin: startin.DT() object containing the points to interpolate from
+    :param x_range: Numpy array containing the x coordinate of every column
+    :param y_range: Numpy array containing the y coordinate of every row (top row first)
+    :return: Numpy array of shape (len(y_range), len(x_range)) containing the interpolated values
+    """
+    raster = np.zeros([len(y_range), len(x_range)])
+
+    yi = 0
+
+    for y in y_range:
+        xi = 0
+
+        for x in x_range:
+            tri = tin.locate(x, y)
+
+            if tri != [] and 0 not in tri:
+                try:
+                    raster[yi, xi] = tin.interpolate_laplace(x, y)
+
+                except Exception as e:
+                    print(e)
+
+            else:
+                raster[yi, xi] = NO_DATA
+
+            xi += 1
+        yi += 1
+
+    return raster
@@ -0,0 +1,312 @@
+import itertools
+
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+NO_DATA = -9999
+
+START_RK = 1  # Radius of the first search
+INCR_RK = 3  # Radius increment for every following search
+MAX_ITER = 2  # Number of searches before a cell is given up on
+MIN_P = 1  # Minimum number of points per quadrant
+POWER = 2  # Power of the inverse distance weights
+TOLERANCE = 2  # Minkowski p-norm used for the searches (Euclidean)
+
+BLOCK_ROWS = 64  # Number of raster rows that are queried at once by the batch engine
+BLOCK_CELLS = 65536  # Number of scattered cells that are queried at once by the batch engine
+
+
+class KDTreeNeighbours:
+    def __init__(self, points, workers: int = -1):
+        """ Neighbour search backend for the batch Quad-IDW engine based on scipy's cKDTree.
+
+        :param points: Numpy array containing the points as [[x, y, z], ...]
+        :param workers: Number of workers cKDTree may use for a query, -1 uses all cores
+        """
+        self._tree = cKDTree(points[:, :2])
+        self._workers = workers
+
+    def query(self, qx, qy, radius):
+        """ Finds all points within radius of every query location in a single call.
+
+        :param qx: Numpy array containing the x coordinates of the query locations
+        :param qy: Numpy array containing the y coordinates of the query locations
+        :param radius: Float representing the search radius
+        :return: Tuple of two flat numpy arrays; the query each neighbour belongs to and the index of the neighbour
+        """
+        balls = self._tree.query_ball_point(
+            np.column_stack((qx, qy)), radius, p=TOLERANCE, workers=self._workers, return_sorted=False
+        )
+
+        counts = np.fromiter(map(len, balls), dtype=np.intp, count=len(balls))
+        index = np.fromiter(itertools.chain.from_iterable(balls), dtype=np.intp, count=counts.sum())
+        owner = np.repeat(np.arange(len(balls)), counts)
+
+        return owner, index
+
+
+class GridBucketNeighbours:
+    def __init__(self, points, cell_size: float, origin=(0, 0)):
+        """ Neighbour search backend for the batch Quad-IDW engine based on a uniform grid of buckets that is aligned to
+        the raster grid. The points are sorted by bucket once and the start of every bucket is stored in an offsets
+        array (CSR layout), so a row of neighbouring buckets is a single contiguous slice of the sorted points.
+
+        :param points: Numpy array containing the points as [[x, y, z], ...]
+        :param cell_size: Float representing the bucket size, should be a multiple of the raster cell size
+        :param origin: Any corner of the raster grid, used to align the buckets with the raster cells
+        """
+        self._cell_size = cell_size
+
+        if len(points) == 0:
+            self._min = (origin[0], origin[1])
+            self._shape = (0, 0)
+            self._order = np.zeros(0, dtype=np.intp)
+            self._offsets = np.zeros(1, dtype=np.intp)
+            self._x = self._y = np.zeros(0, dtype=np.float64)
+            return
+
+        # Snap the lower left corner of the bucket grid to the raster grid
+        self._min = (
+            origin[0] + np.floor((points[:, 0].min() - origin[0]) / cell_size) * cell_size,
+            origin[1] + np.floor((points[:, 1].min() - origin[1]) / cell_size) * cell_size
+        )
+
+        ix = ((points[:, 0] - self._min[0]) // cell_size).astype(np.intp)
+        iy = ((points[:, 1] - self._min[1]) // cell_size).astype(np.intp)
+
+        self._shape = (int(iy.max()) + 1, int(ix.max()) + 1)
+
+        bucket = iy * self._shape[1] + ix
+
+        self._order = np.argsort(bucket, kind="stable")
+        self._offsets = np.zeros(self._shape[0] * self._shape[1] + 1, dtype=np.intp)
+        np.cumsum(np.bincount(bucket, minlength=self._shape[0] * self._shape[1]), out=self._offsets[1:])
+
+        self._x = np.ascontiguousarray(points[self._order, 0], dtype=np.float64)
+        self._y = np.ascontiguousarray(points[self._order, 1], dtype=np.float64)
+
+    def query(self, qx, qy, radius):
+        """ Finds all points within radius of every query location in a single call. For every query the candidate
+        points are gathered as one slice per row of buckets that intersects the search circle.
+
+        :param qx: Numpy array containing the x coordinates of the query locations
+        :param qy: Numpy array containing the y coordinates of the query locations
+        :param radius: Float representing the search radius
+        :return: Tuple of two flat numpy arrays; the query each neighbour belongs to and the index of the neighbour
+        """
+        rows, cols = self._shape
+        n = len(qx)
+
+        if n == 0 or rows == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+        ix0 = np.maximum(np.floor((qx - radius - self._min[0]) / self._cell_size).astype(np.intp), 0)
+        ix1 = np.minimum(np.floor((qx + radius - self._min[0]) / self._cell_size).astype(np.intp), cols - 1)
+        iy0 = np.floor((qy - radius - self._min[1]) / self._cell_size).astype(np.intp)
+        iy1 = np.floor((qy + radius - self._min[1]) / self._cell_size).astype(np.intp)
+
+        # Every query spans at most this many bucket rows
+        span = int(np.ceil(2 * radius / self._cell_size)) + 1
+
+        iy = iy0[:, None] + np.arange(span)
+        valid = (iy <= iy1[:, None]) & (iy >= 0) & (iy < rows) & (ix0 <= ix1)[:, None]
+        iy = np.clip(iy, 0, rows - 1)
+
+        # Queries entirely left or right of the buckets have no valid rows, but still need an index within the grid
+        ix0 = np.minimum(ix0, cols - 1)
+        ix1 = np.maximum(ix1, 0)
+
+        start = self._offsets[iy * cols + ix0[:, None]]
+        end = self._offsets[iy * cols + ix1[:, None] + 1]
+
+        lengths = np.where(valid, end - start, 0).ravel()
+        start = start.ravel()
+
+        # Expand every (query, bucket row) slice into the positions it covers
+        first = np.cumsum(lengths) - lengths
+        position = np.repeat(start - first, lengths) + np.arange(lengths.sum())
+        owner = np.repeat(np.repeat(np.arange(n), span), lengths)
+
+        inside = (self._x[position] - qx[owner]) ** 2 + (self._y[position] - qy[owner]) ** 2 <= radius ** 2
+
+        return owner[inside], self._order[position[inside]]
+
+
+def quad_idw(points, neighbours, qx, qy):
+    """ Quadrant-based IDW for a batch of query locations. Every search round queries all cells that are still
+    pending at once, classifies the neighbours into quadrants and computes the weights as reductions over the flat
+    neighbour arrays. Only the cells that failed the quadrant test are searched again with a larger radius.
+
+    Gives the same result as the cell-by-cell loop in quad_idw_loop().
+
+    :param points: Numpy array containing the points as [[x, y, z], ...]
+    :param neighbours: Neighbour search backend, KDTreeNeighbours or GridBucketNeighbours
+    :param qx: Numpy array containing the x coordinates of the query locations
+    :param qy: Numpy array containing the y coordinates of the query locations
+    :return: Numpy array containing the interpolated value (or NO_DATA) for every query location
+    """
+    values = np.full(len(qx), NO_DATA, dtype=np.float64)
+    pending = np.arange(len(qx))
+
+    for iteration in range(MAX_ITER):
+        if pending.size == 0:
+            break
+
+        px = qx[pending]
+        py = qy[pending]
+        n = pending.size
+
+        owner, index = neighbours.query(px, py, START_RK + iteration * INCR_RK)
+
+        dx = points[index, 0] - px[owner]
+        dy = points[index, 1] - py[owner]
+
+        done = np.bincount(owner, minlength=n) >= 4 * MIN_P
+
+        for quadrant in [(dx < 0) & (dy < 0), (dx > 0) & (dy < 0), (dx < 0) & (dy > 0), (dx > 0) & (dy > 0)]:
+            done &= np.bincount(owner[quadrant], minlength=n) >= MIN_P
+
+        used = done[owner]
+        owner = owner[used]
+
+        dst = np.sqrt(dx[used] ** 2 + dy[used] ** 2)
+        weights = np.zeros_like(dst)
+        weights[dst > 0] = 1 / dst[dst > 0] ** POWER
+
+        a_sum = np.bincount(owner, weights * points[index[used], 2], minlength=n)[done]
+        b_sum = np.bincount(owner, weights, minlength=n)[done]
+
+        values[pending[done]] = np.where(b_sum > 0, a_sum / np.where(b_sum > 0, b_sum, 1), NO_DATA)
+
+        pending = pending[~done]
+
+    return values
+
+
+def quad_idw_grid(points, neighbours, x_range, y_range, block_rows: int = BLOCK_ROWS):
+    """ Runs the batch Quad-IDW engine over a grid, one block of rows at a time to bound the size of the neighbour
+    arrays.
+
+    :param points: Numpy array containing the points as [[x, y, z], ...]
+    :param neighbours: Neighbour search backend, KDTreeNeighbours or GridBucketNeighbours
+    :param x_range: Numpy array containing the x coordinate of every column
+    :param y_range: Numpy array containing the y coordinate of every row (top row first)
+    :param block_rows: Number of rows to query at once
+    :return: Numpy array of shape (len(y_range), len(x_range)) containing the interpolated values
+    """
+    x_range = np.asarray(x_range, dtype=np.float64)
+    y_range = np.asarray(y_range, dtype=np.float64)
+
+    raster = np.empty((len(y_range), len(x_range)), dtype=np.float64)
+
+    for row in range(0, len(y_range), block_rows):
+        ys = y_range[row:row + block_rows]
+
+        values = quad_idw(
+            points=points,
+            neighbours=neighbours,
+            qx=np.tile(x_range, len(ys)),
+            qy=np.repeat(ys, len(x_range))
+        )
+
+        raster[row:row + len(ys)] = values.reshape(len(ys), len(x_range))
+
+    return raster
+
+
+def quad_idw_cells(points, neighbours, qx, qy, block_cells: int = BLOCK_CELLS):
+    """ Runs the batch Quad-IDW engine for an arbitrary set of cells, e.g. the cells that are left empty after binning,
+    a block of cells at a time to bound the size of the neighbour arrays.
+
+    :param points: Numpy array containing the points as [[x, y, z], ...]
+    :param neighbours: Neighbour search backend, KDTreeNeighbours or GridBucketNeighbours
+    :param qx: Numpy array containing the x coordinates of the cells
+    :param qy: Numpy array containing the y coordinates of the cells
+    :param block_cells: Number of cells to query at once
+    :return: Numpy array containing the interpolated value (or NO_DATA) for every cell
+    """
+    values = np.empty(len(qx), dtype=np.float64)
+
+    for start in range(0, len(qx), block_cells):
+        values[start:start + block_cells] = quad_idw(
+            points=points,
+            neighbours=neighbours,
+            qx=qx[start:start + block_cells],
+            qy=qy[start:start + block_cells]
+        )
+
+    return values
+
+
+def quad_idw_loop(points, x_range, y_range):
+    """ Reference implementation that searches and weighs the neighbours of every cell separately. Kept to be able to
+    benchmark and validate the batch engine against.
+
+    :param points: Numpy array containing the points as [[x, y, z], ...]
+    :param x_range: Numpy array containing the x coordinate of every column
+    :param y_range: Numpy array containing the y coordinate of every row (top row first)
+    :return: Numpy array of shape (len(y_range), len(x_range)) containing the interpolated values
+    """
+    ras = np.zeros([len(y_range), len(x_range)])
+    tree = cKDTree(np.array([points[:, 0], points[:, 1]]).transpose())
+
+    yi = 0
+
+    for y in y_range:
+        xi = 0
+
+        for x in x_range:
+            done = False
+            i = 0
+            rk = START_RK
+            xyp = []
+
+            while done is False:
+                ix = tree.query_ball_point([x, y], rk, TOLERANCE)
+
+                if len(ix) >= 4 * MIN_P:  # Need at least MIN_P points per quadrant
+
+                    xyp = points[ix]
+
+                    qs = [
+                        xyp[(xyp[:, 0] < x) & (xyp[:, 1] < y)],
+                        xyp[(xyp[:, 0] > x) & (xyp[:, 1] < y)],
+                        xyp[(xyp[:, 0] < x) & (xyp[:, 1] > y)],
+                        xyp[(xyp[:, 0] > x) & (xyp[:, 1] > y)]
+                    ]
+
+                    if min(qs[0].size, qs[1].size, qs[2].size, qs[3].size) >= MIN_P:
+                        done = True
+
+                if i >= MAX_ITER:
+                    ras[yi, xi] = NO_DATA
+                    break
+
+                rk += INCR_RK
+                i += 1
+
+            else:
+                a_sum = 0
+                b_sum = 0
+
+                for pt in xyp:
+                    dst = np.sqrt((x - pt[0]) ** 2 + (y - pt[1]) ** 2)
+
+                    if dst > 0:
+                        u = pt[2]
+                        w = 1 / dst ** POWER
+
+                        a_sum += u * w
+                        b_sum += w
+
+                if b_sum > 0:
+                    ras[yi, xi] = a_sum / b_sum
+
+                else:
+                    ras[yi, xi] = NO_DATA
+
+            xi += 1
+        yi += 1
+
+    return ras
@@ -5,7 +5,10 @@ import multiprocessing
 import queue
 import time
 
+from src.subtiling.region import Region
 from src.task import Task
+from src.utils.catalog import HeaderCatalog
+from src.utils.footprints import FootprintProvider
 from src.utils.indexing import get_tile_connectivity
 
 SPACING_INTERVAL = 1.0
@@ -13,10 +16,12 @@ WAIT_TIME_INTERVAL = 60
 
 
 class MainProcessor:
-    def __init__(self, tiles):
+    def __init__(self, tiles, region_mode: bool = False):
         """ Initializes the main processing class with a list of tile names for which the data should be processed.
 
         :param tiles: List containing strings representing names of tiles (e.g. ['36FN2', '31AZ1', ..]
+        :param region_mode: Boolean, process the area from the region section of the config as one continuous subtile
+        grid instead of the tiles
         """
         self._processes = []
         self._processing = True
@@ -25,13 +30,31 @@ class MainProcessor:
 
         self._tile_connectivity = get_tile_connectivity()
 
+        if config["tile_parameters"].get("header_catalog", "false") == "true":
+            HeaderCatalog().refresh()  # Once before processing, so the processes only read the catalog
+
         self._unprocessed_tiles = list(self._tile_connectivity.keys())
 
+        if region_mode:
+            self._region = Region(connectivity=self._tile_connectivity)
+            self._unprocessed_subtiles = self._region.create_subtiles()
+
+            # Once for the whole region, as its subtiles are split separately
+            footprints = FootprintProvider()
+
+            if footprints.prefetches():
+                footprints.prefetch(bounds=list(self._region.get_tile().get_geometry().bounds))
+        else:
+            self._region = None
+
         self.task_queue = multiprocessing.Queue()
         self.in_progress_queue = multiprocessing.Queue()
 
         self._completed_dtm = multiprocessing.Manager().dict()
         self._completed_dsm = multiprocessing.Manager().dict()
+
+        # Number of subtiles per tile, known once a tile is split as it can differ per tile (quadtree subdivision)
+        self._expected_subtiles = multiprocessing.Manager().dict()
         self.lock = multiprocessing.Lock()
 
     def create_new_split_tile_tasks(self):
@@ -40,6 +63,10 @@ class MainProcessor:
 
         :return: None
         """
+        if self._region is not None:
+            self._create_region_subtile_tasks()
+            return
+
         count = 0
         for parent_tile in self._target_tiles:
             if parent_tile in self._unprocessed_tiles:  # Dict would be faster here
@@ -47,13 +74,29 @@ class MainProcessor:
                 if count >= number_of_processing_threads:
                     break
 
-                arguments = [self._tile_connectivity[parent_tile], self._tile_connectivity]
+                arguments = [self._tile_connectivity[parent_tile], self._tile_connectivity, self._target_tiles]
                 new_task = Task(task="split_ahn3_tile", arguments=arguments)
                 self.task_queue.put(new_task)
 
                 self._unprocessed_tiles.remove(parent_tile)
                 count += 1
 
+    def _create_region_subtile_tasks(self):
+        """ Creates the split tasks for all subtiles of the region at once. Every subtile is split separately, as its
+        points come from several tiles.
+
+        :return: None
+        """
+        if len(self._unprocessed_subtiles) == 0:
+            return
+
+        self._expected_subtiles[self._region.get_tile().get_tile_name()] = len(self._unprocessed_subtiles)
+
+        for subtile in self._unprocessed_subtiles:
+            self.task_queue.put(Task(task="split_region_subtile", arguments=[subtile, self._tile_connectivity]))
+
+        self._unprocessed_subtiles = []
+
     def _create_merge_task_for_tile(self, completed_tile_name: str, interpolation_type: str):
         """ Creates a merge rasters task used the supplied tile name and interpolation type. Relies on both these
         parameters because the completed_tiles variable contains both DTM and DSM data
@@ -87,6 +130,10 @@ class MainProcessor:
 
         if parent_tile is not None:
             arguments = [parent_tile.get_parent_tile(), successfully_interpolated_tiles]
+
+            if self._region is not None and self._region.get_output() == "sheets":
+                arguments.append(self._region.get_sheets())
+
             self.task_queue.put(Task(task="merge_rasters", arguments=arguments))
 
     def start_processing_loop(self):
@@ -97,7 +144,10 @@ class MainProcessor:
             process = multiprocessing.Process(
                 name="Process-{0:02d}".format(process_id + 1),  # Pretty name for process for printing to commandline
                 target=get_next_task,
-                args=(self.task_queue, self.in_progress_queue, self._completed_dtm, self._completed_dsm, self.lock),
+                args=(
+                    self.task_queue, self.in_progress_queue, self._completed_dtm, self._completed_dsm,
+                    self._expected_subtiles, self.lock
+                ),
                 daemon=True,
             )
 
@@ -118,19 +168,39 @@ class MainProcessor:
                 self._last_insertion = time.time()
 
             for tile_name in self._completed_dtm.keys():
-                if len(self._completed_dtm[tile_name]) == num_cols_in_tile * num_rows_in_tile:
+                if len(self._completed_dtm[tile_name]) == self._expected_subtiles.get(tile_name):
                     print("All interpolations completed for:", tile_name, "with type dtm")
                     self._create_merge_task_for_tile(tile_name, "dtm")
 
             for tile_name in self._completed_dsm.keys():
-                if len(self._completed_dsm[tile_name]) == num_cols_in_tile * num_rows_in_tile:
+                if len(self._completed_dsm[tile_name]) == self._expected_subtiles.get(tile_name):
                     print("All interpolations completed for:", tile_name, "with type dsm")
                     self._create_merge_task_for_tile(tile_name, "dsm")
 
             time.sleep(WAIT_TIME_INTERVAL)
 
 
-def get_next_task(task_queue, in_progress_queue, completed_dtm, completed_dsm, lock):
+def add_completed_tile(tile, interpolation_type, completed_dtm, completed_dsm, lock):
+    """ Registers a subtile as completed for an interpolation type, merging starts once all subtiles of a tile are in
+
+    :return: None
+    """
+    tile_name = tile.get_tile_name().split("_")[0]
+
+    with lock:
+        if interpolation_type == "dsm":
+            if tile_name not in completed_dsm.keys():
+                completed_dsm[tile_name] = [tile]
+            else:
+                completed_dsm[tile_name] += [tile]
+        else:
+            if tile_name not in completed_dtm.keys():
+                completed_dtm[tile_name] = [tile]
+            else:
+                completed_dtm[tile_name] += [tile]
+
+
+def get_next_task(task_queue, in_progress_queue, completed_dtm, completed_dsm, expected_subtiles, lock):
     """ Retrieves a new task from the queue if there is one, otherwise idles until task is available or killed
     :return: None
     """
@@ -156,33 +226,33 @@ def get_next_task(task_queue, in_progress_queue, completed_dtm, completed_dsm, l
         ))
 
         if result is not None:
-            if task.get_task_type() == "split_ahn3_tile":
+            if task.get_task_type() in ["split_ahn3_tile", "split_region_subtile"]:
+                # The subtiles of a region are split one by one, their number is known when the tasks are created
+                if task.get_task_type() == "split_ahn3_tile" and len(result) > 0:
+                    expected_subtiles[result[0].get_tile_name().split("_")[0]] = len(result)
+
                 for tile in result:
-                    task_queue.put(Task(task="interpolation", arguments=[tile, "dtm"]))
-                    task_queue.put(Task(task="interpolation", arguments=[tile, "dsm"]))
+                    if tile.point_count == 0:  # Nothing to interpolate, still counts as completed for merging
+                        tile.interpolated = True
 
-            elif task.get_task_type() == "interpolation":
+                        for interpolation_type in ["dtm", "dsm"]:
+                            add_completed_tile(tile, interpolation_type, completed_dtm, completed_dsm, lock)
 
-                tile = result[0]
-                interpolation_type = result[1]
+                        continue
 
-                tile_name = tile.get_tile_name().split("_")[0]
+                    # Single task for both products, so outliers are only filtered once per subtile
+                    task_queue.put(Task(task="interpolation", arguments=[tile, ["dtm", "dsm"]]))
 
-                with lock:
-                    if interpolation_type == "dsm":
-                        if tile_name not in completed_dsm.keys():
-                            completed_dsm[tile_name] = [tile]
-                        else:
-                            completed_dsm[tile_name] += [tile]
-                    else:
-                        if tile_name not in completed_dtm.keys():
-                            completed_dtm[tile_name] = [tile]
-                        else:
-                            completed_dtm[tile_name] += [tile]
+            elif task.get_task_type() == "interpolation":
+
+                for tile, interpolation_type in result:
+                    add_completed_tile(tile, interpolation_type, completed_dtm, completed_dsm, lock)
 
             elif task.get_task_type() == "merge_rasters":
 
-                task_queue.put(Task(task="downsampling", arguments=[result]))
+                # A merged region is cut into one raster per tile
+                for raster in (result if isinstance(result, list) else [result]):
+                    task_queue.put(Task(task="downsampling", arguments=[raster]))
 
         # Ensure queue counter is subtracted again
         in_progress_queue.get()
@@ -197,7 +267,7 @@ def get_next_task(task_queue, in_progress_queue, completed_dtm, completed_dsm, l
         time.sleep(WAIT_TIME_INTERVAL)
 
     finally:
-        get_next_task(task_queue, in_progress_queue, completed_dtm, completed_dsm, lock)
+        get_next_task(task_queue, in_progress_queue, completed_dtm, completed_dsm, expected_subtiles, lock)
 
 
 if __name__ == "__main__":
@@ -212,19 +282,25 @@ if __name__ == "__main__":
 
     number_of_processing_threads = int(config["global"]["number_of_processing_threads"])
 
-    num_cols_in_tile = int(config["tile_parameters"]["subtile_column_count"])
-    num_rows_in_tile = int(config["tile_parameters"]["subtile_row_count"])
+    # tiles: process the tiles in tiles_to_process one by one, region: process the area from the region section
+    region_mode = config.has_section("region") and config["region"].get("mode", "tiles") == "region"
+
+    if region_mode:
+        target_tiles = []
+
+        print("Target region:", config["region"].get("name", "REGION"))
 
-    tile_path = config["folder_paths"]["tiles_to_process"]
+    else:
+        tile_path = config["folder_paths"]["tiles_to_process"]
 
-    # Assuming format C_37HN1.LAZ, so splitting to 37HN1
-    target_tiles = [f.split(".")[0].split("_")[1] for f in os.listdir(tile_path) if ".LAZ" in f or ".laz" in f]
+        # Assuming format C_37HN1.LAZ, so splitting to 37HN1
+        target_tiles = [f.split(".")[0].split("_")[1] for f in os.listdir(tile_path) if ".LAZ" in f or ".laz" in f]
 
-    if len(target_tiles) == 0:
-        raise Exception("Could not find any LAZ files with expected format in the specified folder! (C_37EN1.LAZ")
+        if len(target_tiles) == 0:
+            raise Exception("Could not find any LAZ files with expected format in the specified folder! (C_37EN1.LAZ")
 
-    print("Target tiles:", target_tiles)
+        print("Target tiles:", target_tiles)
 
-    processor = MainProcessor(tiles=target_tiles)
+    processor = MainProcessor(tiles=target_tiles, region_mode=region_mode)
 
     processor.start_processing_loop()
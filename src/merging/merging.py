@@ -1,8 +1,15 @@
 import configparser
+import multiprocessing
 import os
 import rasterio
+import time
 
+import numpy as np
+
+from rasterio.errors import WindowError
 from rasterio.merge import merge
+from rasterio.transform import from_origin
+from rasterio.windows import Window, from_bounds
 
 from src.tile import Tile
 from src.utils.helpers import create_path_if_not_exists, Stages
@@ -10,9 +17,17 @@ from src.utils.helpers import create_path_if_not_exists, Stages
 PRECISION = 5
 NO_DATA = -9999
 
+WRITERS = ["windowed", "merge"]
+
 
 class Merging:
-    def __init__(self, tile: Tile, input_rasters: list):
+    def __init__(self, tile: Tile, input_rasters: list, writer: str = None):
+        """ Merges the rasters of the subtiles of a tile into a single raster.
+
+        :param tile: Tile object of the parent tile, its bounds are the bounds of the merged raster
+        :param input_rasters: List containing the Raster objects of the subtiles
+        :param writer: String representing the writer to use (windowed or merge), the one from the config if None
+        """
         self._parent_tile = tile
         self._raster_list = input_rasters
 
@@ -27,10 +42,20 @@ class Merging:
 
         self._finished_path = config["folder_paths"]["finished"]
 
-    def _get_save_location(self, stage):
+        # windowed (copies every subtile into its window of a tiled GeoTIFF) or merge (rasterio merge in memory)
+        self._writer = writer or config.get("merging", "writer", fallback="windowed")
+        self._block_size = int(config.get("merging", "block_size", fallback="256"))
+        self._compress = config.get("merging", "compress", fallback="none")
+        self._cache_size = int(config.get("merging", "cache_in_mb", fallback="64"))
+
+        if self._writer not in WRITERS:
+            raise ValueError("Unknown merging writer '{0}', expected one of {1}".format(self._writer, WRITERS))
+
+    def _get_save_location(self, stage, tile_name: str = None):
         """ Uses the stage this raster is at (dsm or dtm) to apply the correct prefix for the output file
 
         :param stage: String representing stage (dsm or dtm)
+        :param tile_name: String representing the name of the output, the name of the parent tile if None
         :return: String with full filepath to output file
         """
         path = os.path.join(
@@ -46,7 +71,7 @@ class Merging:
 
         return os.path.join(
             path,
-            prefix + self._parent_tile.get_tile_name() + ".TIF"
+            prefix + (tile_name or self._parent_tile.get_tile_name()) + ".TIF"
         )
 
     def save(self, stage):
@@ -57,6 +82,11 @@ class Merging:
         """
         save_name = self._get_save_location(stage)
 
+        if self._out_image is None:  # Windowed writer, the subtiles are copied into the file one by one
+            self._write_mosaic(save_name)
+
+            return self._parent_tile.get_tile_name(), save_name
+
         with rasterio.Env():
             with rasterio.open(save_name, "w", **self._out_meta) as dest:
                 dest.write(self._out_image)
@@ -70,6 +100,17 @@ class Merging:
 
         :return: None
         """
+        if self._writer == "windowed":
+            self._out_meta = self._get_mosaic_profile()
+
+            if self._out_meta is not None:  # Written by save, one subtile at a time
+                return
+
+            print('\n{0}: Subtiles of {1} are not on a common grid, merging them in memory'.format(
+                multiprocessing.current_process().name,
+                self._parent_tile.get_tile_name()
+            ))
+
         input_rasters = []
         for raster in self._raster_list:
             input_rasters.append(raster.open())  # Load rasters into memory
@@ -98,3 +139,137 @@ class Merging:
         for raster in self._raster_list:
             raster.close()  # Clear rasters from memory
 
+    def _get_mosaic_profile(self):
+        """ Determines the grid of the mosaic from the bounds of the parent tile and the cell size of the subtiles, and
+        checks that every subtile lies on that grid, so it can be copied into the mosaic without resampling.
+
+        :return: Dictionary containing the rasterio profile of the mosaic, None if a subtile is not on the grid
+        """
+        minx, miny, maxx, maxy = self._parent_tile.get_geometry().bounds
+
+        profile = None
+
+        for raster in self._raster_list:
+            with rasterio.open(raster.filepath) as source:
+                if profile is None:
+                    cell_size = source.transform.a
+                    profile = source.profile
+
+                if not np.isclose(source.transform.a, cell_size) or not np.isclose(-source.transform.e, cell_size):
+                    return None
+
+                offsets = [(source.transform.c - minx) / cell_size, (maxy - source.transform.f) / cell_size]
+
+                if not np.allclose(offsets, np.round(offsets), atol=10 ** -PRECISION):
+                    return None
+
+        if profile is None:
+            return None
+
+        profile.update({
+            "driver": "GTiff",
+            "height": int(round((maxy - miny) / cell_size)),
+            "width": int(round((maxx - minx) / cell_size)),
+            "transform": from_origin(minx, maxy, cell_size, cell_size),
+            "nodata": NO_DATA,
+            "tiled": True,
+            "blockxsize": self._block_size,
+            "blockysize": self._block_size,
+        })
+
+        if self._compress != "none":
+            profile["compress"] = self._compress
+
+        return profile
+
+    def _write_mosaic(self, save_name: str):
+        """ Writes the mosaic as a tiled GeoTIFF by copying the cells of every subtile into its window of the mosaic,
+        one subtile at a time. Parts of the mosaic without a subtile get no data. Like the merge, where subtiles
+        overlap the cells of the first subtile with data are kept.
+
+        :param save_name: String representing the path of the mosaic
+        :return: None
+        """
+        start_time = time.time()
+
+        mosaic_window = Window(0, 0, self._out_meta["width"], self._out_meta["height"])
+        written = []
+
+        # The block cache of GDAL holds the written blocks until they are flushed, it bounds the memory of the writer
+        with rasterio.Env(GDAL_CACHEMAX=self._cache_size):
+            with rasterio.open(save_name, "w+", **self._out_meta) as dest:
+                for raster in self._raster_list:
+                    source = raster.open()  # Opens only the clipped window of the subtile
+
+                    window = from_bounds(*source.bounds, transform=dest.transform).round_offsets().round_lengths()
+                    window = Window(int(window.col_off), int(window.row_off), int(window.width), int(window.height))
+
+                    try:
+                        target = window.intersection(mosaic_window)
+
+                    except WindowError:  # Subtile is completely outside of the mosaic
+                        raster.close()
+                        continue
+
+                    source_window = Window(
+                        target.col_off - window.col_off, target.row_off - window.row_off, target.width, target.height
+                    )
+
+                    image = source.read(window=source_window)
+
+                    raster.close()
+
+                    if any(self._overlaps(target, other) for other in written):
+                        existing = dest.read(window=target)
+
+                        image = np.where(existing != NO_DATA, existing, image)
+
+                    dest.write(image, window=target)
+                    written.append(target)
+
+        print('\n{0}: Wrote mosaic of {1} subtiles ({2}x{3} cells, {4:.1f} MB) in {5} seconds'.format(
+            multiprocessing.current_process().name,
+            len(written),
+            self._out_meta["width"],
+            self._out_meta["height"],
+            os.path.getsize(save_name) / 1024 ** 2,
+            str(round(time.time() - start_time, 2))
+        ))
+
+    @staticmethod
+    def _overlaps(window: Window, other: Window):
+        return (window.col_off < other.col_off + other.width and other.col_off < window.col_off + window.width and
+                window.row_off < other.row_off + other.height and other.row_off < window.row_off + window.height)
+
+    def cut_into_sheets(self, filepath: str, sheets: list, stage):
+        """ Cuts a merged raster back into rasters per AHN3 sheet, named like the rasters of the sheets themselves. Parts
+        of a sheet outside the merged raster get no data.
+
+        :param filepath: String representing the path of the merged raster
+        :param sheets: List containing the Tile objects of the sheets
+        :param stage: String representing stage (dsm or dtm)
+        :return: List containing tuples of the name and path of the raster of every sheet
+        """
+        outputs = []
+
+        with rasterio.open(filepath) as mosaic:
+            for sheet in sheets:
+                window = from_bounds(*sheet.get_geometry().bounds, transform=mosaic.transform)
+                window = window.round_offsets().round_lengths()
+
+                out_meta = mosaic.meta.copy()
+                out_meta.update({
+                    "driver": "GTiff",
+                    "height": window.height,
+                    "width": window.width,
+                    "transform": mosaic.window_transform(window),
+                })
+
+                save_name = self._get_save_location(stage, tile_name=sheet.get_tile_name())
+
+                with rasterio.open(save_name, "w", **out_meta) as dest:
+                    dest.write(mosaic.read(window=window, boundless=True, fill_value=NO_DATA))
+
+                outputs.append((sheet.get_tile_name(), save_name))
+
+        return outputs
@@ -1,20 +1,25 @@
 import configparser
+import multiprocessing
 import os
-import fiona
 import rasterio
+import time
 
 import numpy as np
 
 from rasterio import MemoryFile
+from rasterio.features import rasterize
 from rasterio.mask import mask
 from rasterio.merge import merge
-from shapely.geometry import box, Polygon
+from rasterio.windows import Window, from_bounds
+from shapely.geometry import box, shape
 
 from src.tile import Tile
 from src.utils.helpers import Stages
+from src.utils.polygon_store import get_polygon_store, query_geopackage
 
 
 NO_DATA = -9999
+HOMOGENIZE_ROWS = 512  # Number of raster rows that are homogenized at once
 
 
 class Raster:
@@ -23,6 +28,10 @@ class Raster:
         self._raster = None
         self._stage = stage
 
+        # Part of the file that belongs to the raster, as (col_off, row_off, width, height), None for the whole file
+        self._window = None
+        self._memfile = None
+
         self.filepath = filepath
 
         directory = os.path.dirname(os.path.realpath(__file__))
@@ -39,6 +48,12 @@ class Raster:
         polygon_paths = os.path.join(config["folder_paths"]["flattening_polygons"], 'homogenization')
         self._polygons = [os.path.join(polygon_paths, f) for f in os.listdir(polygon_paths) if ".shp" in f]
 
+        # Pre-tiled polygons, used instead of the shapefiles if set
+        self._polygon_geopackage = config["folder_paths"].get("polygon_geopackage", "")
+
+        # zonal (all polygons at once, single write) or per_polygon (rewrites the raster for every polygon)
+        self._homogenization = config.get("flattening", "homogenization", fallback="zonal")
+
     def get_raster_name(self):
         return self._raster_name
 
@@ -46,12 +61,41 @@ class Raster:
         return self._stage
 
     def open(self):
-        self._raster = rasterio.open(self.filepath)
+        """ Opens the raster. If the raster is clipped to a window of its file, only that window is read, into an
+        in-memory GeoTIFF; the file itself is never rewritten.
+
+        :return: Opened rasterio dataset
+        """
+        if self._window is None:
+            self._raster = rasterio.open(self.filepath)
+            return self._raster
+
+        window = Window(*self._window)
+
+        with rasterio.open(self.filepath) as source:
+            profile = source.profile
+            profile.update({
+                "driver": "GTiff",
+                "height": window.height,
+                "width": window.width,
+                "transform": source.window_transform(window),
+            })
+
+            self._memfile = MemoryFile()
+
+            with self._memfile.open(**profile) as dest:
+                dest.write(source.read(window=window))
+
+        self._raster = self._memfile.open()
         return self._raster
 
     def close(self):
         self._raster.close()
 
+        if self._memfile is not None:
+            self._memfile.close()
+            self._memfile = None
+
     def get_downsampled_save_location(self):
         if self._stage in Stages.INTERPOLATED_DTM:
             prefix = "M5_"
@@ -64,43 +108,35 @@ class Raster:
         )
 
     def clip(self, tile: Tile):
-        """ Clips this raster according to the size of original geometry of the tile provided
+        """ Clips this raster according to the size of original geometry of the tile provided. The clip is only a
+        window on the grid of the file, which is applied when the raster is opened (e.g. for merging), and is skipped
+        when the file already has the extents of the tile, as the interpolation writes the unbuffered extents.
+
         :param tile: Tile element corresponding with this raster
-        :return: None
+        :return: True if the raster could be clipped, False otherwise
         """
         try:
-            self.open()
-
-        except Exception:
-            return False
-
-        clip_geom = tile.get_unbuffered_geometry()
-        clip_height = clip_geom.bounds[3] - clip_geom.bounds[1]  # maxy - miny
-        clip_width = clip_geom.bounds[2] - clip_geom.bounds[0]  # maxx - minx
-
-        try:
-            print(self._raster_name, clip_geom)
-            out_image, out_transform = mask(dataset=self._raster, shapes=[clip_geom], crop=True)
+            with rasterio.open(self.filepath) as source:
+                window = from_bounds(*tile.get_unbuffered_geometry().bounds, transform=source.transform)
+                window = window.round_offsets().round_lengths().intersection(Window(0, 0, source.width, source.height))
 
-            out_meta = self._raster.meta.copy()
+                if (window.col_off, window.row_off, window.width, window.height) == (0, 0, source.width, source.height):
+                    self._window = None
 
-            self.close()
-
-            out_meta.update({
-                "driver": "GTiff",
-                "height": clip_height / self._base_raster_cell_size,
-                "width": clip_width / self._base_raster_cell_size,
-                "transform": out_transform,
-            })
-
-            with rasterio.Env():
-                with rasterio.open(self.filepath, "w", **out_meta) as dest:
-                    dest.write(out_image)
+                else:
+                    self._window = (int(window.col_off), int(window.row_off), int(window.width), int(window.height))
 
         except Exception as e:
-            print(e)
+            print('\n{0}: Could not clip {1}: {2}'.format(
+                multiprocessing.current_process().name,
+                self._raster_name,
+                str(e)
+            ))
+
             return False
 
+        return True
+
     def homogenize_patchwork(self):
         """ Uses a complete water polygon for all water bodies to fix the patched water bodies from the subtiles.
         Each subtile will interpolate its own value for the water, creating distinct lines, this function will take
@@ -111,35 +147,109 @@ class Raster:
         """
         raster = rasterio.open(self.filepath)
         bbox = raster.bounds
-
-        print(bbox)
+        raster.close()
 
         bbox = box(minx=bbox[0], miny=bbox[1], maxx=bbox[2], maxy=bbox[3])
 
-        print(bbox)
-
         poly_list = []
 
-        for shapefile in self._polygons:
-            # find out which shapes intersect the bbox
-            with fiona.open(shapefile) as src_water:
+        if self._polygon_geopackage != "":
+            poly_list = query_geopackage(
+                filepath=self._polygon_geopackage, layer="homogenization", bounds=list(bbox.bounds), clip=False
+            )
+
+        else:
+            for shapefile in self._polygons:
+                # find out which shapes intersect the bbox (so if we need to do something)
+                for feature in get_polygon_store(shapefile).intersecting(bbox):
+                    poly_list.append(feature["geometry"])
+
+        if len(poly_list) == 0:
+            return
+
+        if self._homogenization == "per_polygon":
+            self._homogenize_per_polygon(poly_list)
+
+        else:
+            self._homogenize_zonal(poly_list)
+
+    def _homogenize_zonal(self, poly_list):
+        """ Homogenizes all polygons in two passes over strips of rows, so only one strip of the raster is in memory,
+        also for the mosaic of a region. In every strip the polygons are rasterized into a label array (cells whose
+        center is inside a polygon, like the mask of the per polygon mode). The first pass sums the cells per polygon
+        with one grouped sum per strip, the second sets the cells to the mean of their polygon and writes the strip
+        back in place. A cell covered by overlapping polygons belongs to the last of them.
+
+        :param poly_list: List containing the polygons as shapely geometries or GeoJSON dictionaries
+        :return: None
+        """
+        start_time = time.time()
 
-                for feature in src_water:
+        polygon_bounds = np.array([shape(polygon).bounds for polygon in poly_list])
 
-                    coord = feature['geometry']['coordinates']
+        sums = np.zeros(len(poly_list) + 1, dtype=np.float64)
+        counts = np.zeros(len(poly_list) + 1, dtype=np.int64)
 
-                    if len(coord) > 1:
-                        poly = Polygon(coord[0], coord[1:])
+        with rasterio.open(self.filepath, "r+") as dest:
+            for assign in [False, True]:
+                if assign:
+                    means = np.zeros(len(sums), dtype=np.float64)
+                    np.divide(sums, counts, out=means, where=counts > 0)
 
-                    else:
-                        poly = Polygon(coord[0])
+                for row in range(0, dest.height, HOMOGENIZE_ROWS):
+                    window = Window(0, row, dest.width, min(HOMOGENIZE_ROWS, dest.height - row))
+                    minx, miny, maxx, maxy = dest.window_bounds(window)
 
-                    # check if intersects with this tile (so if we need to do something)
-                    if poly.intersects(bbox):
-                        poly_list.append(feature["geometry"])
+                    # Labels of the polygons that overlap the strip, in their original order
+                    labels = np.nonzero(
+                        (polygon_bounds[:, 0] < maxx) & (polygon_bounds[:, 2] > minx) &
+                        (polygon_bounds[:, 1] < maxy) & (polygon_bounds[:, 3] > miny)
+                    )[0] + 1
 
-        print(len(poly_list))
+                    if len(labels) == 0:
+                        continue
 
+                    image = dest.read(window=window)
+
+                    strip_labels = rasterize(
+                        [(poly_list[label - 1], int(label)) for label in labels],
+                        out_shape=(window.height, window.width),
+                        transform=dest.window_transform(window),
+                        fill=0,
+                        dtype=np.int32,
+                    )
+
+                    strip_labels = np.broadcast_to(strip_labels, image.shape)
+                    cells = (strip_labels > 0) & (image != NO_DATA)
+
+                    cell_labels = strip_labels[cells]
+
+                    if not assign:
+                        sums += np.bincount(cell_labels, weights=image[cells], minlength=len(sums))
+                        counts += np.bincount(cell_labels, minlength=len(counts))
+                        continue
+
+                    if len(cell_labels) == 0:
+                        continue
+
+                    image[cells] = means[cell_labels]
+
+                    dest.write(image, window=window)
+
+        print('\n{0}: Homogenized {1} polygons ({2} with data) in {3} seconds'.format(
+            multiprocessing.current_process().name,
+            len(poly_list),
+            int(np.count_nonzero(counts[1:])),
+            str(round(time.time() - start_time, 2))
+        ))
+
+    def _homogenize_per_polygon(self, poly_list):
+        """ Homogenizes the polygons one by one, every polygon is masked out of the raster, set to its mean and merged
+        back into the raster, which is then written to disk.
+
+        :param poly_list: List containing the polygons as shapely geometries or GeoJSON dictionaries
+        :return: None
+        """
         for polygon in poly_list:
             original = rasterio.open(self.filepath)
 
@@ -0,0 +1,78 @@
+import numpy as np
+
+from src.subtiling.splitter import CHUNK_SIZE, read_records
+
+
+def point_density(filepath: str, origin: list, cell_size: float, shape: tuple):
+    """ Counts the points of a file per cell of a coarse grid, in a single pass over the file.
+
+    :param filepath: String representing the path of the LAS/LAZ file
+    :param origin: List containing the coordinates of the lower left corner of the grid
+    :param cell_size: Float representing the size of the grid cells
+    :param shape: Tuple representing the shape of the grid (rows, columns), the first row is the bottom row
+    :return: Numpy array of the given shape containing the number of points per cell
+    """
+    counts = np.zeros(shape[0] * shape[1], dtype=np.int64)
+
+    las_file, records, (scale, offset) = read_records(filepath)
+
+    try:
+        for start in range(0, len(records), CHUNK_SIZE):
+            x = records["point"]["X"][start:start + CHUNK_SIZE] * scale[0] + offset[0]
+            y = records["point"]["Y"][start:start + CHUNK_SIZE] * scale[1] + offset[1]
+
+            cols = np.clip(((x - origin[0]) // cell_size).astype(np.intp), 0, shape[1] - 1)
+            rows = np.clip(((y - origin[1]) // cell_size).astype(np.intp), 0, shape[0] - 1)
+
+            counts += np.bincount(rows * shape[1] + cols, minlength=counts.size)
+
+    finally:
+        las_file.close()
+
+    return counts.reshape(shape)
+
+
+def subdivide(counts, budget: int, buffer_cells: int = 0):
+    """ Recursively splits a grid of point counts into quadrants until every quadrant, including the cells within its
+    buffer, has at most budget points. Quadrants of a single cell wide are only split in the other direction, a single
+    cell is never split.
+
+    :param counts: Numpy array containing the number of points per cell, the first row is the bottom row
+    :param budget: Maximum number of points per quadrant
+    :param buffer_cells: Number of cells around a quadrant that count towards its points
+    :return: List containing the quadrants as cell ranges [first column, first row, last column, last row], where
+    the last column and row are exclusive
+    """
+    rows, cols = counts.shape
+
+    # Summed area table, so the points in any range of cells are counted with four lookups
+    summed = np.zeros((rows + 1, cols + 1), dtype=np.int64)
+    summed[1:, 1:] = counts.cumsum(axis=0).cumsum(axis=1)
+
+    def count(col0, row0, col1, row1):
+        col0, row0 = max(col0 - buffer_cells, 0), max(row0 - buffer_cells, 0)
+        col1, row1 = min(col1 + buffer_cells, cols), min(row1 + buffer_cells, rows)
+
+        return summed[row1, col1] - summed[row0, col1] - summed[row1, col0] + summed[row0, col0]
+
+    leaves = []
+    stack = [[0, 0, cols, rows]]
+
+    while len(stack) > 0:
+        col0, row0, col1, row1 = stack.pop()
+
+        if count(col0, row0, col1, row1) <= budget or (col1 - col0 == 1 and row1 - row0 == 1):
+            leaves.append([col0, row0, col1, row1])
+            continue
+
+        col_splits = [col0, col0 + (col1 - col0) // 2, col1] if col1 - col0 > 1 else [col0, col1]
+        row_splits = [row0, row0 + (row1 - row0) // 2, row1] if row1 - row0 > 1 else [row0, row1]
+
+        # Pushed in reverse, so the leaves come out from the bottom left to the top right
+        for row_index in reversed(range(len(row_splits) - 1)):
+            for col_index in reversed(range(len(col_splits) - 1)):
+                stack.append([
+                    col_splits[col_index], row_splits[row_index], col_splits[col_index + 1], row_splits[row_index + 1]
+                ])
+
+    return leaves
@@ -0,0 +1,195 @@
+import configparser
+import math
+import multiprocessing
+import os
+import time
+
+from shapely import wkt
+from shapely.geometry import box
+
+from src.tile import Tile, TileTypes
+from src.utils import intermediate
+from src.utils.catalog import HeaderCatalog
+from src.utils.helpers import Stages
+from src.utils.point_source import PointSource
+
+
+class Region:
+    def __init__(self, connectivity: dict):
+        """ Processes an area as a whole instead of sheet by sheet. One continuous subtile grid, aligned to multiples of
+        the subtile size, is laid over all AHN3 sheets that intersect the area. The points of a subtile are read from
+        every sheet that intersects its buffered extent, so sheet borders are no longer buffered and interpolated
+        twice. The interpolated subtiles are merged into a single mosaic, that is optionally cut back into the sheets.
+
+        :param connectivity: Dictionary containing all Tile objects and their respective connectivity
+        """
+        self._connectivity = connectivity
+
+        directory = os.path.dirname(os.path.realpath(__file__))
+
+        config = configparser.ConfigParser()
+        config.read(os.path.join(directory, "..", "config.ini"))
+
+        self._name = config["region"].get("name", "REGION").upper()
+        self._subtile_size = float(config["region"].get("subtile_size_in_m", "1000"))
+        self._output = config["region"].get("output", "sheets")
+
+        self._buffer = int(config["tile_parameters"]["buffer_in_m"])
+        self._to_overwrite = True if config["global"]["overwrite_existing_files"] == "true" else False
+
+        if "_" in self._name:  # Subtiles are named REGION_ID and grouped by the part before the underscore
+            raise ValueError("Region name '{0}' cannot contain underscores".format(self._name))
+
+        base = float(config["global"]["base_raster_cell_size"])
+
+        if self._subtile_size % base != 0:
+            raise ValueError("subtile_size_in_m should be a multiple of base_raster_cell_size")
+
+        polygon = config["region"].get("polygon", "")
+
+        if polygon != "":
+            with open(polygon, "r") as polygon_file:
+                self._geometry = wkt.loads(polygon_file.read())
+
+        else:
+            self._geometry = box(*[float(value) for value in config["region"]["bounds"].split(",")])
+
+        # The grid starts at a multiple of the subtile size, so the subtiles of any region line up with each other and
+        # with the raster cells
+        minx, miny, maxx, maxy = self._geometry.bounds
+        size = self._subtile_size
+
+        self._grid_bounds = [
+            math.floor(minx / size) * size,
+            math.floor(miny / size) * size,
+            math.ceil(maxx / size) * size,
+            math.ceil(maxy / size) * size
+        ]
+
+        self._tile = Tile(tile_name=self._name, geometry=box(*self._grid_bounds))
+
+        if config["tile_parameters"].get("header_catalog", "false") == "true":
+            self._catalog = HeaderCatalog()
+        else:
+            self._catalog = None
+
+        # Every sheet is read by all subtiles that intersect it, without a spatial index each of them would decompress
+        # the whole sheet, so region mode builds .lax files if no index is configured
+        self._point_source = PointSource()
+
+        if self._point_source.get_index() == "none":
+            self._point_source = PointSource(index="lax")
+
+    def get_tile(self):
+        return self._tile
+
+    def get_output(self):
+        return self._output
+
+    def get_sheets(self):
+        """ Returns the AHN3 sheets that intersect the area.
+
+        :return: List containing the Tile objects of the sheets
+        """
+        return [
+            sheet for sheet in self._connectivity.values()
+            if sheet.get_geometry().intersection(self._geometry).area > 0
+        ]
+
+    def create_subtiles(self):
+        """ Creates the Tile objects of all subtiles of the grid that intersect the area. The subtiles have no points
+        yet, they are read with split_subtile().
+
+        :return: List containing the Tile objects of the subtiles
+        """
+        minx, miny, maxx, maxy = self._grid_bounds
+        size = self._subtile_size
+
+        subtiles = []
+
+        for row in range(int(round((maxy - miny) / size))):
+            for col in range(int(round((maxx - minx) / size))):
+                unbuffered = [minx + col * size, miny + row * size, minx + (col + 1) * size, miny + (row + 1) * size]
+
+                if box(*unbuffered).intersection(self._geometry).area == 0:
+                    continue
+
+                subtiles.append(Tile(
+                    tile_name=self._name + "_" + str(len(subtiles) + 1),
+                    geometry=box(
+                        unbuffered[0] - self._buffer,
+                        unbuffered[1] - self._buffer,
+                        unbuffered[2] + self._buffer,
+                        unbuffered[3] + self._buffer
+                    ),
+                    tile_type=TileTypes.SUBTILE,
+                    unbuffered_geometry=box(*unbuffered),
+                    parent_tile=self._tile
+                ))
+
+        return subtiles
+
+    def split_subtile(self, subtile: Tile):
+        """ Extracts the points within the buffered extent of a subtile from all sheets it intersects.
+
+        :param subtile: Tile object of the subtile, as created by create_subtiles()
+        :return: List containing the Tile object of the subtile, with its point count set
+        """
+        save_name = self._tile.get_save_path(
+            stage=Stages.SUBTILING,
+            subtile_id=subtile.get_tile_name().split("_")[1],
+            extension=self._tile.get_intermediate_extension()
+        )
+        bounds = list(subtile.get_geometry().bounds)
+
+        if os.path.exists(save_name) and self._to_overwrite or not os.path.exists(save_name):
+            inputs = self._get_inputs_for_box(bounds)
+
+            if len(inputs) == 0:  # No sheet has points in this subtile
+                if os.path.exists(save_name):
+                    intermediate.remove(save_name)
+
+                subtile.point_count = 0
+
+                return [subtile]
+
+            start_time = time.time()
+            unbuffered = [int(bound) for bound in subtile.get_unbuffered_geometry().bounds]
+
+            self._point_source.extract(
+                filepaths=inputs, bounds=bounds, save_name=save_name, origin=[unbuffered[0], unbuffered[3]]
+            )
+            print('{0}: Split subtile "{1}" from {2} sheets in {3} seconds.'.format(
+                multiprocessing.current_process().name,
+                subtile.get_tile_name(),
+                len(inputs),
+                str(round(time.time() - start_time, 2))
+            ))
+
+        subtile.point_count = intermediate.count_points(save_name)
+
+        return [subtile]
+
+    def _get_inputs_for_box(self, bounds: list):
+        """ Determines which sheets have points within an extent. Uses the bounds of the points from the header catalog
+        if available, otherwise the geometry of the sheets.
+
+        :param bounds: List representing the extent as [minx, miny, maxx, maxy]
+        :return: List containing the filepaths of the sheets that exist
+        """
+        extent = box(*bounds)
+
+        inputs = []
+
+        for sheet in self._connectivity.values():
+            if sheet.filepath is None or not os.path.exists(sheet.filepath):
+                continue
+
+            if self._catalog is not None:
+                if self._catalog.intersects(sheet.filepath, bounds):
+                    inputs.append(sheet.filepath)
+
+            elif extent.intersection(sheet.get_geometry()).area > 0:
+                inputs.append(sheet.filepath)
+
+        return inputs
@@ -0,0 +1,184 @@
+import concurrent.futures
+import os
+
+import numpy as np
+
+from laspy.file import File
+
+from src.utils.intermediate import convert, is_arrays, is_laz
+
+CHUNK_SIZE = 5000000  # Number of points routed at once, bounds the size of the temporary coordinate arrays
+
+
+def read_records(filepath: str, bounds: list = None):
+    """ Opens a LAS/LAZ file and returns its raw point records. laspy decompresses LAZ files with laszip in a separate
+    process, so several files can be decompressed in parallel from threads.
+
+    :param filepath: String representing the path of the file
+    :param bounds: List representing the area to keep as [minx, miny, maxx, maxy], or None to keep all points
+    :return: Tuple of the open laspy File, the numpy array of its point records and the scale and offset of its
+    coordinates. If bounds are given the records within the bounds are copied and the file is already closed
+    """
+    las_file = File(filepath, mode="r")
+    records = las_file.points
+    scaling = (list(las_file.header.scale), list(las_file.header.offset))
+
+    if bounds is None:
+        return las_file, records, scaling
+
+    records = records[route(records, scaling, [bounds])[0]]
+
+    las_file.close()
+
+    return las_file, records, scaling
+
+
+def route(records, scaling, boxes: list):
+    """ Determines for every box which points fall inside it, one chunk of points at a time. A point can fall in
+    several boxes when they overlap. Boxes are half-open like las2las -keep_xy: min <= x < max.
+
+    :param records: Numpy array containing the raw point records
+    :param scaling: Tuple containing the scale and offset of the coordinates of the records
+    :param boxes: List containing boxes as [minx, miny, maxx, maxy]
+    :return: List containing a numpy array of point indices per box
+    """
+    indices = [[] for _ in boxes]
+    scale, offset = scaling
+
+    raw_x = records["point"]["X"]
+    raw_y = records["point"]["Y"]
+
+    for start in range(0, len(records), CHUNK_SIZE):
+        x = raw_x[start:start + CHUNK_SIZE] * scale[0] + offset[0]
+        y = raw_y[start:start + CHUNK_SIZE] * scale[1] + offset[1]
+
+        for box_index, box in enumerate(boxes):
+            inside = np.nonzero((x >= box[0]) & (x < box[2]) & (y >= box[1]) & (y < box[3]))[0]
+
+            if inside.size > 0:
+                indices[box_index].append(inside + start)
+
+    return [np.concatenate(index) if len(index) > 0 else np.zeros(0, dtype=np.intp) for index in indices]
+
+
+def rescale(records, scaling, target_scaling):
+    """ Converts the raw coordinates of records to the scale and offset of another file, so the records of both files
+    can be written to the same output. Records are changed in place.
+
+    :param records: Numpy array containing the raw point records
+    :param scaling: Tuple containing the scale and offset of the coordinates of the records
+    :param target_scaling: Tuple containing the scale and offset of the file the records are written to
+    :return: The same records
+    """
+    if scaling == target_scaling:
+        return records
+
+    for axis, dimension in enumerate(["X", "Y", "Z"]):
+        value = records["point"][dimension] * scaling[0][axis] + scaling[1][axis]
+
+        records["point"][dimension] = np.round(
+            (value - target_scaling[1][axis]) / target_scaling[0][axis]
+        ).astype(np.int32)
+
+    return records
+
+
+def write_records(save_name: str, header, records, origin=None):
+    """ Writes raw point records to a new file, with the header of the file they were read from. laspy only writes
+    uncompressed LAS, so LAZ files and arrays directories are converted from a temporary LAS file.
+
+    :param save_name: String representing the path of the output LAS/LAZ file or arrays directory
+    :param header: laspy header to copy
+    :param records: Numpy array containing the raw point records
+    :param origin: List containing the x and y coordinate of the local origin the arrays are stored relative to
+    :return: Integer representing the number of points written
+    """
+    if is_arrays(save_name) or is_laz(save_name):
+        las_name = "{0}.{1}.tmp.las".format(save_name, os.getpid())
+
+        count = write_records(las_name, header, records)
+        convert(las_name, save_name, origin=origin)
+
+        return count
+
+    out_file = File(save_name, mode="w", header=header.copy())
+
+    if len(records) > 0:
+        out_file.points = records
+        out_file.header.update_min_max()
+
+    out_file.close()
+
+    return len(records)
+
+
+def split_files(
+        filepath: str, neighbour_filepaths: list, boxes: list, save_names: list, threads: int = 4, origins: list = None
+):
+    """ Splits a tile into (buffered) boxes in a single pass. The tile and its neighbours are read once, in parallel,
+    only the part of the neighbours within the boxes is kept. Every point is then routed to all boxes it falls in and
+    the boxes are written concurrently.
+
+    laspy 1.x decompresses a LAZ file completely into a single array, it cannot read a file in chunks. The peak memory
+    is therefore the complete tile plus up to threads complete neighbours that are being cropped at the same time,
+    and the records of the boxes that are being written. Fewer threads, or the strip cache (neighbours are then read
+    from small LAS files with only their buffer strips), lower the peak.
+
+    :param filepath: String representing the path of the tile
+    :param neighbour_filepaths: List containing the paths of the neighbouring tiles that the buffers extend into
+    :param boxes: List containing the buffered boxes as [minx, miny, maxx, maxy]
+    :param save_names: List containing the output path for every box
+    :param threads: Number of files that are read or written at the same time
+    :param origins: List containing the local origin per box, used if the boxes are stored as arrays
+    :return: List containing the number of points written per box
+    """
+    bounds = [
+        min(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    ]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        tile_future = executor.submit(read_records, filepath)
+        neighbour_futures = [
+            executor.submit(read_records, neighbour_filepath, bounds) for neighbour_filepath in neighbour_filepaths
+        ]
+
+        tile_file, tile_records, tile_scaling = tile_future.result()
+
+        try:
+            # All records are converted to the scale and offset of the tile, which is used for the output
+            sources = [tile_records]
+
+            for neighbour_filepath, future in zip(neighbour_filepaths, neighbour_futures):
+                _, records, scaling = future.result()
+
+                if records.dtype != tile_records.dtype:
+                    raise ValueError("Point format of {0} differs from {1}".format(neighbour_filepath, filepath))
+
+                sources.append(rescale(records, scaling, tile_scaling))
+
+            indices = [route(records, tile_scaling, boxes) for records in sources]
+
+            def write(box_index):
+                parts = [(records, index[box_index]) for records, index in zip(sources, indices)]
+                parts = [(records, index) for records, index in parts if index.size > 0]
+
+                if len(parts) == 1:  # Only the tile (or a single neighbour), no need to copy the records twice
+                    box_records = parts[0][0][parts[0][1]]
+
+                else:
+                    box_records = np.concatenate([records[index] for records, index in parts] or [tile_records[:0]])
+
+                return write_records(
+                    save_name=save_names[box_index],
+                    header=tile_file.header,
+                    records=box_records,
+                    origin=None if origins is None else origins[box_index]
+                )
+
+            return list(executor.map(write, range(len(boxes))))
+
+        finally:
+            tile_file.close()
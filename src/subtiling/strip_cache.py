@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import shutil
+import time
+
+from src.subtiling.splitter import read_records, route, write_records
+from src.tile import Tile
+from src.utils.helpers import Stages
+
+# The strip on a side of a tile is needed by the neighbour on that side, which sees the tile on the opposite side
+OPPOSITE_SIDES = {
+    "left": "right", "right": "left", "top": "bottom", "bottom": "top",
+    "top_left": "bottom_right", "top_right": "bottom_left", "bottom_left": "top_right", "bottom_right": "top_left"
+}
+
+
+class StripCache:
+    def __init__(self, buffer: float):
+        """ Cache of the edge and corner strips of tiles, so the buffers of subtiles can be read from small uncompressed
+        files instead of from the complete neighbouring tiles. The strips of a tile are extracted in a single read of
+        the tile and stored in the processing folder of the tile, per buffer width.
+
+        :param buffer: Float representing the width of the strips, the buffer of the subtiles
+        """
+        self._buffer = buffer
+        self._stage = "{0}_{1}".format(Stages.STRIPS, int(buffer))
+
+    def get_strip_for(self, neighbour: Tile, side: str):
+        """ Returns the strip of a neighbour that lies within the buffer of the tile it is a neighbour of, extracting
+        the strips of the neighbour first if they are not cached yet.
+
+        :param neighbour: Tile object of the neighbouring main tile
+        :param side: String representing on which side of the tile the neighbour is (e.g. left, top_right)
+        :return: String representing the path of the strip
+        """
+        strip_side = OPPOSITE_SIDES[side]
+
+        if not os.path.exists(self._get_strip_name(neighbour, strip_side)):
+            self.extract(neighbour)
+
+        return self._get_strip_name(neighbour, strip_side)
+
+    def extract(self, tile: Tile):
+        """ Reads a tile once and writes all its edge and corner strips. Every strip is written under a temporary name
+        and renamed when complete, so processes that extract the same tile at the same time do not see partial files.
+
+        :param tile: Tile object of the main tile
+        :return: None
+        """
+        start_time = time.time()
+
+        strips = self._get_strip_boxes(tile)
+
+        las_file, records, scaling = read_records(tile.filepath)
+
+        try:
+            indices = route(records, scaling, list(strips.values()))
+
+            for side, index in zip(strips.keys(), indices):
+                save_name = self._get_strip_name(tile, side)
+                temporary_name = "{0}.{1}.tmp".format(save_name, os.getpid())
+
+                write_records(save_name=temporary_name, header=las_file.header, records=records[index])
+
+                os.replace(temporary_name, save_name)
+
+        finally:
+            las_file.close()
+
+        print('{0}: Extracted buffer strips of tile "{1}" in {2} seconds.'.format(
+            multiprocessing.current_process().name,
+            tile.get_tile_name(),
+            str(round(time.time() - start_time, 2))
+        ))
+
+    def consume(self, tile: Tile, consumer: str, consumers: list):
+        """ Marks the strips of a tile as used by one of its neighbours. The strips are evicted once every neighbour
+        that needs them has used them.
+
+        :param tile: Tile object of the main tile the strips belong to
+        :param consumer: String representing the name of the tile that used the strips
+        :param consumers: List containing the names of all tiles that use the strips
+        :return: None
+        """
+        open(self._get_marker_name(tile, consumer), "w").close()
+
+        if all(os.path.exists(self._get_marker_name(tile, name)) for name in consumers):
+            self.evict(tile)
+
+    def evict(self, tile: Tile):
+        """ Removes all cached strips of a tile.
+
+        :param tile: Tile object of the main tile
+        :return: None
+        """
+        directory = os.path.dirname(self._get_strip_name(tile, "left"))
+
+        shutil.rmtree(directory, ignore_errors=True)
+
+        print('{0}: Evicted buffer strips of tile "{1}"'.format(
+            multiprocessing.current_process().name,
+            tile.get_tile_name()
+        ))
+
+    def _get_strip_boxes(self, tile: Tile):
+        """ Determines the extents of the strips along every edge and corner of a tile. The strips extend past the tile
+        by the buffer as well, so points on the boundary of the tile are always included.
+
+        :param tile: Tile object of the main tile
+        :return: Dictionary containing the side as key and the strip as [minx, miny, maxx, maxy] as value
+        """
+        minx, miny, maxx, maxy = tile.get_geometry().bounds
+        b = self._buffer
+
+        return {
+            "left": [minx - b, miny - b, minx + b, maxy + b],
+            "right": [maxx - b, miny - b, maxx + b, maxy + b],
+            "top": [minx - b, maxy - b, maxx + b, maxy + b],
+            "bottom": [minx - b, miny - b, maxx + b, miny + b],
+            "top_left": [minx - b, maxy - b, minx + b, maxy + b],
+            "top_right": [maxx - b, maxy - b, maxx + b, maxy + b],
+            "bottom_left": [minx - b, miny - b, minx + b, miny + b],
+            "bottom_right": [maxx - b, miny - b, maxx + b, miny + b],
+        }
+
+    def _get_strip_name(self, tile: Tile, side: str):
+        return tile.get_save_path(stage=self._stage, subtile_id=side, extension="LAS")
+
+    def _get_marker_name(self, tile: Tile, consumer: str):
+        return tile.get_save_path(stage=self._stage, subtile_id="consumed_" + consumer, extension="txt")
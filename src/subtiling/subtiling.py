@@ -1,25 +1,37 @@
 import configparser
+import json
 import math
 import multiprocessing
 import os
-import subprocess
 import time
 
+import numpy as np
+
 from shapely.geometry import box
 
+from src.ground_filtering.ground_filtering import GroundFiltering
+from src.subtiling.quadtree import point_density, subdivide
+from src.subtiling.splitter import split_files
+from src.subtiling.strip_cache import StripCache
 from src.tile import Tile, TileTypes
+from src.utils import intermediate
+from src.utils.catalog import HeaderCatalog
 from src.utils.helpers import Stages
+from src.utils.point_source import PointSource
 
 
 class Subtiling:
-    def __init__(self, tile: Tile, connectivity: dict):
+    def __init__(self, tile: Tile, connectivity: dict, target_tiles: list = None):
         """ Helper class that orchestrates subdivision of a single tile into subtiles.
 
         :param tile: Tile object for the tile that is to be subdivided
         :param connectivity: Dictionary containing all Tile objects and their respective connectivity
+        :param target_tiles: List containing the names of all tiles that are processed, used to know when the cached
+        strips of a tile are no longer needed. Cached strips are never evicted if None
         """
         self._parent_tile = tile
         self._connectivity = connectivity
+        self._target_tiles = None if target_tiles is None else [name.upper() for name in target_tiles]
 
         self._subtiles = []
 
@@ -35,9 +47,33 @@ class Subtiling:
         self._num_cols = int(config["tile_parameters"]["subtile_column_count"])
         self._buffer = int(config["tile_parameters"]["buffer_in_m"])
         self._to_overwrite = True if config["global"]["overwrite_existing_files"] == "true" else False
+        self._filter_per_main_tile = config["tile_parameters"].get("filter_per_main_tile", "false") == "true"
+
+        # las2las: one las2las process per subtile, laspy: read every file once and split in a single pass
+        self._splitter = config["tile_parameters"].get("splitter", "las2las")
+        self._splitter_threads = int(config["tile_parameters"].get("splitter_threads", "4"))
+
+        # Use the header catalog to pick the files that intersect a subtile and to know the point counts of files
+        if config["tile_parameters"].get("header_catalog", "false") == "true":
+            self._catalog = HeaderCatalog()
+        else:
+            self._catalog = None
+
+        # Read the buffers from cached strips of the neighbours instead of from the complete neighbouring tiles
+        if config["tile_parameters"].get("strip_cache", "false") == "true":
+            self._strip_cache = StripCache(buffer=self._buffer)
+        else:
+            self._strip_cache = None
+
+        # grid: fixed grid of subtile_column_count x subtile_row_count, quadtree: split until under the point budget
+        self._subdivision = config["tile_parameters"].get("subdivision", "grid")
+        self._point_budget = int(config["tile_parameters"].get("subtile_point_budget", "20000000"))
+        self._density_cell_size = float(config["tile_parameters"].get("density_cell_in_m", "50"))
 
         self._base_raster_cell_size = float(config["global"]["base_raster_cell_size"])
 
+        self._point_source = PointSource()
+
     def set_tile_extents(self):
         """ The bounds of the tile geometry to retrieve the bounding box of the point cloud.
         Stores this information in the class variables _min_coord and _max_coord.
@@ -61,6 +97,10 @@ class Subtiling:
 
         :return: None
         """
+        if self._subdivision == "quadtree":
+            self._subdivide_quadtree()
+            return
+
         min_x = self._min_coord[0]
         min_y = self._min_coord[1]
 
@@ -87,103 +127,407 @@ class Subtiling:
                 if maxy >= self._max_coord[1]:
                     maxy = round(self._max_coord[1])
 
-                self._subtiles.append(
-                    {
-                        "buffered": [minx - self._buffer, miny - self._buffer, maxx + self._buffer, maxy + self._buffer],
-                        "unbuffered": [minx, miny, maxx, maxy]
-                    }
-                )
+                self._add_subtile(minx, miny, maxx, maxy)
 
-    def clip_tile_by_subtiles(self):
-        """ Uses las2las from LAStools in a subprocess to clip the provided main tile (self._tile) into the determined
-        subtile grid.
+    def _subdivide_quadtree(self):
+        """ Creates subtiles that adapt to the point density, so dense areas get small subtiles and sparse areas large
+        ones. The points of the main tile are counted per cell of a coarse grid, then the tile is split into quadrants
+        recursively until every quadrant, including its buffer, has at most subtile_point_budget points. Splits are
+        made on the coarse grid, which is a multiple of the raster cell size, so the subtiles stay aligned to the
+        raster cells. Points in the neighbouring tiles are not counted.
 
-        Has checks to determine which other tiles should be included in the las2las command. This prevents the
-        unnecessary merging of extra AHN3 tiles. Creates as many subprocesses as there are subtiles and waits for them
-        all to complete before closing the function.
+        The quadrants are stored in the subtiling folder, so the density pass is only done once per tile.
 
         :return: None
         """
-        for subtile_id in range(1, len(self._subtiles) + 1):
-            save_name = self._parent_tile.get_save_path(stage=Stages.SUBTILING, subtile_id=str(subtile_id), extension="LAS")
+        min_x, min_y = round(self._min_coord[0]), round(self._min_coord[1])
+        max_x, max_y = round(self._max_coord[0]), round(self._max_coord[1])
 
-            subtile = self._subtiles[subtile_id - 1]
+        # Coarse cells must consist of complete raster cells
+        base = self._base_raster_cell_size
+        cell_size = base * max(1, round(self._density_cell_size / base))
 
-            tile_name = self._parent_tile.get_tile_name()
-            subtile_name = tile_name + "_" + str(subtile_id)
+        shape = (math.ceil((max_y - min_y) / cell_size), math.ceil((max_x - min_x) / cell_size))
 
-            buffered_geometry = box(
-                minx=subtile["buffered"][0],
-                miny=subtile["buffered"][1],
-                maxx=subtile["buffered"][2],
-                maxy=subtile["buffered"][3]
-            )
+        save_name = self._parent_tile.get_save_path(stage=Stages.SUBTILING, subtile_id="quadtree", extension="json")
+        parameters = {"budget": self._point_budget, "cell_size": cell_size, "buffer": self._buffer}
+
+        leaves = None
+
+        if os.path.exists(save_name) and not self._to_overwrite:
+            with open(save_name, "r") as quadtree_file:
+                stored = json.load(quadtree_file)
+
+            if stored["parameters"] == parameters:
+                leaves = stored["leaves"]
 
-            unbuffered_geometry = box(
-                minx=subtile["unbuffered"][0],
-                miny=subtile["unbuffered"][1],
-                maxx=subtile["unbuffered"][2],
-                maxy=subtile["unbuffered"][3]
+        if leaves is None:
+            start_time = time.time()
+
+            counts = point_density(self._parent_tile.filepath, origin=[min_x, min_y], cell_size=cell_size, shape=shape)
+            leaves = subdivide(counts, self._point_budget, buffer_cells=math.ceil(self._buffer / cell_size))
+
+            print('{0}: Subdivided tile "{1}" into {2} subtiles of at most {3} points in {4} seconds.'.format(
+                multiprocessing.current_process().name,
+                self._parent_tile.get_tile_name(),
+                len(leaves),
+                self._point_budget,
+                str(round(time.time() - start_time, 2))
+            ))
+
+            with open(save_name, "w") as quadtree_file:
+                json.dump({"parameters": parameters, "leaves": leaves}, quadtree_file)
+
+        for col0, row0, col1, row1 in leaves:
+            self._add_subtile(
+                min_x + col0 * cell_size,
+                min_y + row0 * cell_size,
+                min(min_x + col1 * cell_size, max_x),
+                min(min_y + row1 * cell_size, max_y)
             )
 
-            if os.path.exists(save_name) and self._to_overwrite or not os.path.exists(save_name):
+    def _add_subtile(self, minx, miny, maxx, maxy):
+        """ Stores the unbuffered and buffered extents of a subtile in the class variable _subtiles.
+
+        :return: None
+        """
+        self._subtiles.append(
+            {
+                "buffered": [minx - self._buffer, miny - self._buffer, maxx + self._buffer, maxy + self._buffer],
+                "unbuffered": [minx, miny, maxx, maxy]
+            }
+        )
 
-                command = ['las2las', '-i', self._parent_tile.filepath]
-                
-                if subtile_id == 1:  # Bottom left
-                    command.extend(self._connectivity[tile_name].get_bottom_left())
+    def clip_tile_by_subtiles(self):
+        """ Clips the provided main tile (self._tile) into the determined subtile grid with the splitter chosen in the
+        config. Falls back to las2las if the single pass splitter fails.
 
-                elif subtile_id == self._num_rows:  # Top left
-                    command.extend(self._connectivity[tile_name].get_top_left())
+        :return: None
+        """
+        start_time = time.time()
+        splitter = self._splitter
 
-                elif subtile_id == self._num_rows * self._num_cols:  # Top right
-                    command.extend(self._connectivity[tile_name].get_top_right())
+        if splitter == "laspy":
+            try:
+                self._split_in_single_pass()
 
-                elif subtile_id == (self._num_rows * self._num_cols) - self._num_rows + 1:  # Bottom right
-                    command.extend(self._connectivity[tile_name].get_bottom_right())
+            except Exception as e:
+                print('{0}: Single pass splitting failed with error: {1}, falling back to las2las'.format(
+                    multiprocessing.current_process().name,
+                    str(e)
+                ))
 
-                elif self._num_rows > subtile_id > 1:  # Left side
-                    command.extend(self._connectivity[tile_name].get_left())
+                splitter = "las2las"
 
-                elif self._num_rows * self._num_cols > subtile_id > (self._num_rows * self._num_cols) - self._num_rows + 1:  # Right side
-                    command.extend(self._connectivity[tile_name].get_right())
+        if splitter != "laspy":
+            self._split_with_las2las()
 
-                elif subtile_id % self._num_rows == 0:  # Top
-                    command.extend(self._connectivity[tile_name].get_top())
+        written = sum(
+            intermediate.get_size(self._get_subtile_save_path(subtile_id))
+            for subtile_id in range(1, len(self._subtiles) + 1)
+        )
 
-                elif subtile_id % self._num_rows == 1:  # Bottom (works as long as grid is relatively square
-                    command.extend(self._connectivity[tile_name].get_bottom())
+        print('{0}: Split tile "{1}" into {2} subtiles with {3} in {4} seconds, {5} MB of {6}.'.format(
+            multiprocessing.current_process().name,
+            self._parent_tile.get_tile_name(),
+            len(self._subtiles),
+            splitter,
+            str(round(time.time() - start_time, 2)),
+            str(round(written / 1024 ** 2, 2)),
+            self._parent_tile.get_intermediate_extension()
+        ))
 
-                command.extend(
-                    ['-merged', '-o', save_name, '-keep_xy',
-                     str(subtile["buffered"][0]),
-                     str(subtile["buffered"][1]),
-                     str(subtile["buffered"][2]),
-                     str(subtile["buffered"][3])]
-                )
+        self._release_strips()
 
-                print(command)
+        for subtile_id in range(1, len(self._subtiles) + 1):
+            self._subtiles[subtile_id - 1] = self._create_subtile(subtile_id)
 
-                process = subprocess.Popen(
-                    args=command,
-                )
+    def _split_in_single_pass(self):
+        """ Splits the main tile with the single pass splitter. The main tile and all its neighbours are read only once
+        (instead of once per subtile), then the points are routed to every buffered subtile they fall in and the
+        subtiles are written concurrently.
+
+        :return: None
+        """
+        to_split = [
+            subtile_id for subtile_id in range(1, len(self._subtiles) + 1)
+            if self._to_overwrite or not os.path.exists(
+                self._get_subtile_save_path(subtile_id)
+            )
+        ]
+
+        if len(to_split) == 0:
+            return
+
+        boxes = [self._subtiles[subtile_id - 1]["buffered"] for subtile_id in to_split]
+
+        bounds = [
+            min(box[0] for box in boxes),
+            min(box[1] for box in boxes),
+            max(box[2] for box in boxes),
+            max(box[3] for box in boxes),
+        ]
+
+        split_files(
+            filepath=self._parent_tile.filepath,
+            neighbour_filepaths=self._get_neighbour_filepaths(self._get_sides_for_box(bounds)),
+            boxes=boxes,
+            save_names=[
+                self._get_subtile_save_path(subtile_id)
+                for subtile_id in to_split
+            ],
+            threads=self._splitter_threads,
+            origins=[self._get_subtile_origin(subtile_id) for subtile_id in to_split]
+        )
+
+    def _split_with_las2las(self):
+        """ Uses las2las from LAStools in a subprocess to clip the provided main tile (self._tile) into the determined
+        subtile grid. With a spatial index (point_source in the config) only the indexed chunks that intersect a
+        subtile are read.
+
+        Only the files that intersect the buffered extent of a subtile are included in the las2las command. This
+        prevents the unnecessary merging of extra AHN3 tiles. Creates as many subprocesses as there are subtiles and
+        waits for them all to complete before closing the function.
+
+        :return: None
+        """
+        for subtile_id in range(1, len(self._subtiles) + 1):
+            save_name = self._get_subtile_save_path(subtile_id)
+
+            subtile = self._subtiles[subtile_id - 1]
+
+            tile_name = self._parent_tile.get_tile_name()
+            subtile_name = tile_name + "_" + str(subtile_id)
+
+            if os.path.exists(save_name) and self._to_overwrite or not os.path.exists(save_name):
+
+                inputs = self._get_inputs_for_box(subtile["buffered"])
+
+                if len(inputs) == 0:  # No file has points in this subtile
+                    if os.path.exists(save_name):
+                        intermediate.remove(save_name)
+
+                    print('{0}: No input files for subtile "{1}", not splitting'.format(
+                        multiprocessing.current_process().name,
+                        subtile_name
+                    ))
+
+                    continue
 
                 start_time = time.time()
-                process.communicate()
-                process.wait()
+                self._point_source.extract(
+                    filepaths=inputs,
+                    bounds=subtile["buffered"],
+                    save_name=save_name,
+                    origin=self._get_subtile_origin(subtile_id)
+                )
                 print('{0}: Split tile "{1}" in {2} seconds.'.format(
                     multiprocessing.current_process().name,
                     subtile_name,
                     str(round(time.time() - start_time, 2))
                 ))
 
-            self._subtiles[subtile_id - 1] = Tile(
-                tile_name=subtile_name,
-                geometry=buffered_geometry,
-                tile_type=TileTypes.SUBTILE,
-                unbuffered_geometry=unbuffered_geometry,
-                parent_tile=self._parent_tile
-            )
+    def filter_and_partition(self):
+        """ Alternative to clip_tile_by_subtiles() that runs the outlier filtering once over the whole main tile plus
+        the buffer strips of its neighbours, then partitions the filtered points in memory into the buffered subtile
+        extents. Every point is filtered once instead of once per subtile it falls in. The points of every subtile
+        are stored in the filtered stage, where the interpolation picks them up instead of filtering again.
+
+        :return: None
+        """
+        tile_name = self._parent_tile.get_tile_name()
+
+        save_names = [
+            self._parent_tile.get_save_path(stage=Stages.FILTERED, subtile_id=str(subtile_id), extension="npy")
+            for subtile_id in range(1, len(self._subtiles) + 1)
+        ]
+
+        if self._to_overwrite or not all(os.path.exists(save_name) for save_name in save_names):
+            bounds = [
+                min(subtile["buffered"][0] for subtile in self._subtiles),
+                min(subtile["buffered"][1] for subtile in self._subtiles),
+                max(subtile["buffered"][2] for subtile in self._subtiles),
+                max(subtile["buffered"][3] for subtile in self._subtiles),
+            ]
+
+            filepaths = [self._parent_tile.filepath] + self._get_neighbour_filepaths(self._get_sides_for_box(bounds))
+
+            start_time = time.time()
+
+            ground_filtering = GroundFiltering(input_tile=self._parent_tile)
+            points = ground_filtering.remove_outliers_in_area(filepaths=filepaths, bounds=bounds)
+
+            print('{0}: Filtered tile "{1}" ({2} points) in {3} seconds.'.format(
+                multiprocessing.current_process().name,
+                tile_name,
+                len(points),
+                str(round(time.time() - start_time, 2))
+            ))
+
+            for subtile, save_name in zip(self._subtiles, save_names):
+                np.save(save_name, points.crop(subtile["buffered"]).to_structured())
+
+        self._release_strips()
+
+        for subtile_id in range(1, len(self._subtiles) + 1):
+            self._subtiles[subtile_id - 1] = self._create_subtile(subtile_id)
+
+    def _get_inputs_for_box(self, bounds: list):
+        """ Returns the files to read to get all points within a buffered extent: the main tile and the neighbours it
+        extends into. With the header catalog, files without points within the extent are left out.
+
+        :param bounds: List representing the buffered extent as [minx, miny, maxx, maxy]
+        :return: List containing the filepaths
+        """
+        inputs = []
+
+        if self._catalog is None or self._catalog.intersects(self._parent_tile.filepath, bounds):
+            inputs.append(self._parent_tile.filepath)
+
+        return inputs + self._get_neighbour_filepaths(self._get_sides_for_box(bounds))
+
+    def _get_sides_for_box(self, bounds: list):
+        """ Determines which neighbours of the main tile an extent extends into. Uses the bounds of the points from the
+        header catalog if available, otherwise the geometry of the neighbouring tiles.
+
+        :param bounds: List representing the extent as [minx, miny, maxx, maxy]
+        :return: List containing the sides of the main tile (e.g. left, top_right)
+        """
+        neighbours = self._connectivity[self._parent_tile.get_tile_name()].get_neighbours_by_side()
+        extent = box(*bounds)
+
+        sides = []
+
+        for side, neighbour in neighbours.items():
+            if self._catalog is not None and neighbour.filepath is not None:
+                if self._catalog.intersects(neighbour.filepath, bounds):
+                    sides.append(side)
+
+            elif extent.intersection(neighbour.get_geometry()).area > 0:
+                sides.append(side)
+
+        return sides
+
+    def _get_neighbour_filepaths(self, sides: list = None):
+        """ Returns the files to read the buffers from that extend into the neighbouring tiles. These are the cached
+        strips of the neighbours if the strip cache is used, otherwise the complete neighbouring tiles.
+
+        :param sides: List containing the sides of the tile to get the neighbours of (e.g. left, top_right), or None for
+        all sides
+        :return: List containing the filepaths of the neighbours that exist
+        """
+        neighbours = self._connectivity[self._parent_tile.get_tile_name()].get_neighbours_by_side()
+
+        filepaths = []
+
+        for side, neighbour in neighbours.items():
+            if sides is not None and side not in sides:
+                continue
+
+            if neighbour.filepath is None or not os.path.exists(neighbour.filepath):
+                continue
+
+            if self._strip_cache is not None:
+                filepaths.append(self._strip_cache.get_strip_for(neighbour, side))
+            else:
+                filepaths.append(neighbour.filepath)
+
+        return filepaths
+
+    def _release_strips(self):
+        """ Tells the strip cache that this tile is split and no longer needs the strips of its neighbours. The strips of
+        a neighbour are evicted once all processed tiles around it are split.
+
+        :return: None
+        """
+        if self._strip_cache is None or self._target_tiles is None:
+            return
+
+        for neighbour in self._connectivity[self._parent_tile.get_tile_name()].get_neighbours():
+            consumers = [
+                tile.get_tile_name() for tile in self._connectivity[neighbour.get_tile_name()].get_neighbours()
+                if tile.get_tile_name() in self._target_tiles
+            ]
+
+            self._strip_cache.consume(neighbour, self._parent_tile.get_tile_name(), consumers)
+
+    def _create_subtile(self, subtile_id: int):
+        """ Creates the Tile object for a subtile from the extents determined by subdivide_tile()
+
+        :param subtile_id: Integer representing the sequence id of the subtile (starts at 1)
+        :return: Tile object of the subtile
+        """
+        subtile = self._subtiles[subtile_id - 1]
+
+        buffered_geometry = box(
+            minx=subtile["buffered"][0],
+            miny=subtile["buffered"][1],
+            maxx=subtile["buffered"][2],
+            maxy=subtile["buffered"][3]
+        )
+
+        unbuffered_geometry = box(
+            minx=subtile["unbuffered"][0],
+            miny=subtile["unbuffered"][1],
+            maxx=subtile["unbuffered"][2],
+            maxy=subtile["unbuffered"][3]
+        )
+
+        tile = Tile(
+            tile_name=self._parent_tile.get_tile_name() + "_" + str(subtile_id),
+            geometry=buffered_geometry,
+            tile_type=TileTypes.SUBTILE,
+            unbuffered_geometry=unbuffered_geometry,
+            parent_tile=self._parent_tile
+        )
+
+        tile.point_count = self._count_points(subtile_id, tile)
+
+        return tile
+
+    def _get_subtile_save_path(self, subtile_id: int):
+        """ Returns the path of the file of a subtile, in the intermediate format chosen in the config.
+
+        :param subtile_id: Integer representing the sequence id of the subtile (starts at 1)
+        :return: String representing the path of the LAS/LAZ file or arrays directory
+        """
+        return self._parent_tile.get_save_path(
+            stage=Stages.SUBTILING,
+            subtile_id=str(subtile_id),
+            extension=self._parent_tile.get_intermediate_extension()
+        )
+
+    def _get_subtile_origin(self, subtile_id: int):
+        """ Returns the local origin of the points of a subtile, the top left corner of the unbuffered subtile like
+        GroundFiltering.get_origin(), so stored arrays can be memory-mapped without moving them to another origin.
+
+        :param subtile_id: Integer representing the sequence id of the subtile (starts at 1)
+        :return: List containing the x and y coordinate of the origin
+        """
+        bounds = [int(bound) for bound in self._subtiles[subtile_id - 1]["unbuffered"]]
+
+        return [bounds[0], bounds[3]]
+
+    def _count_points(self, subtile_id: int, tile: Tile):
+        """ Counts the points of a subtile from the header of its file, or from its filtered points if the subtile was
+        partitioned in memory.
+
+        :param subtile_id: Integer representing the sequence id of the subtile (starts at 1)
+        :param tile: Tile object of the subtile
+        :return: Integer representing the number of points, 0 if the subtile has no file
+        """
+        if self._filter_per_main_tile:
+            filtered = self._parent_tile.get_save_path(stage=Stages.FILTERED, subtile_id=str(subtile_id), extension="npy")
+
+            return np.load(filtered, mmap_mode="r").shape[0] if os.path.exists(filtered) else 0
+
+        if tile.filepath is not None:
+            return intermediate.count_points(tile.filepath)
+
+        return 0
+
+    def filters_per_main_tile(self):
+        return self._filter_per_main_tile
 
     def get_created_subtiles(self):
         """ Returns the list of subtile names, determined by appending _NUM to the original tile name, where NUM is the
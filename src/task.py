@@ -1,10 +1,15 @@
+import copy
 import multiprocessing
+import os
 
 from src.downsampling.downsampling import DownSampling
+from src.ground_filtering.ground_filtering import GroundFiltering
 from src.interpolation.interpolation import Interpolation
 from src.merging.merging import Merging
 from src.raster import Raster
+from src.subtiling.region import Region
 from src.subtiling.subtiling import Subtiling
+from src.utils.footprints import FootprintProvider
 
 
 # TODO: Add TaskTypes
@@ -24,6 +29,7 @@ class Task:
         # FIXME: Improve this "ENUM"
         self._task_types = {
             "split_ahn3_tile": self._split_ahn3_tile,
+            "split_region_subtile": self._split_region_subtile,
             "interpolation": self._interpolation,
             "merge_rasters": self._merge_rasters,
             "downsampling": self._downsampling,
@@ -43,33 +49,96 @@ class Task:
         """ Function that creates a Subtiling class, gets extents, divides the tile, and creates and stores child tiles.
         Also creates new tasks for subsequent step (ground filtering)
 
-        :param input_arguments: List containing the tile object as element 0 and the tile connectivity as element 1
+        :param input_arguments: List containing the tile object as element 0, the tile connectivity as element 1 and
+        optionally the names of all target tiles as element 2
         :return: None
         """
-        subtiling = Subtiling(tile=input_arguments[0], connectivity=input_arguments[1])
+        subtiling = Subtiling(
+            tile=input_arguments[0],
+            connectivity=input_arguments[1],
+            target_tiles=input_arguments[2] if len(input_arguments) > 2 else None
+        )
 
         subtiling.set_tile_extents()
         subtiling.subdivide_tile()
-        subtiling.clip_tile_by_subtiles()
+
+        # The buildings of the whole tile are fetched at once, its subtiles read them from the cache
+        footprints = FootprintProvider()
+
+        if footprints.prefetches():
+            footprints.prefetch(bounds=list(input_arguments[0].get_geometry().bounds))
+
+        if subtiling.filters_per_main_tile():
+            subtiling.filter_and_partition()
+
+        else:
+            subtiling.clip_tile_by_subtiles()
 
         return subtiling.get_created_subtiles()
 
+    @staticmethod
+    def _split_region_subtile(input_arguments: list):
+        """ Function that reads the points of a single subtile of a region from all AHN3 sheets it intersects.
+
+        :param input_arguments: List containing the Tile object of the subtile as element 0 and the tile connectivity as
+        element 1
+        :return: List containing the Tile object of the subtile
+        """
+        region = Region(connectivity=input_arguments[1])
+
+        return region.split_subtile(subtile=input_arguments[0])
+
     @staticmethod
     def _interpolation(input_arguments: list):
-        """ Function that creates an Interpolation class and runs the interpolation pipeline in the chosen format.
-        Also runs a ground filtering step as part of the pipeline.
+        """ Function that creates an Interpolation class per result type and runs the interpolation pipeline in the
+        chosen formats. The outlier filtering runs once for all result types, after which the points for each product
+        (ground for DTM, everything but noise for DSM) are selected from the same filtered array.
 
-        :param input_arguments: List containing Tile object as 0th element and interpolation result type as 1st element
-        :return: Tile object of completed tile, string representing type of interpolation that has been completed
+        :param input_arguments: List containing Tile object as 0th element and interpolation result type, or list of
+        result types, as 1st element
+        :return: List containing tuples of Tile object of completed tile and string representing type of interpolation
         """
         subtile = input_arguments[0]
-        interpolation_type = input_arguments[1]
+        interpolation_types = input_arguments[1]
+
+        if isinstance(interpolation_types, str):
+            interpolation_types = [interpolation_types]
 
-        interpolation = Interpolation(input_tile=subtile, result_type=interpolation_type)
+        # Every result type gets its own copy of the tile to store its raster in
+        interpolations = [
+            Interpolation(input_tile=copy.copy(subtile), result_type=interpolation_type)
+            for interpolation_type in interpolation_types
+        ]
 
-        interpolation.interpolate()
+        to_filter = [
+            interpolation for interpolation in interpolations
+            if interpolation.needs_points() and not interpolation.has_filtered_points()
+        ]
 
-        return subtile, interpolation_type
+        if len(to_filter) > 1:
+            try:
+                ground_filtering = GroundFiltering(input_tile=subtile)
+
+                points = ground_filtering.remove_outliers()
+
+                for interpolation in to_filter:
+                    interpolation.set_points(ground_filtering.select_points(points, interpolation.get_stage()))
+
+                del points
+
+            except Exception as e:  # Each interpolation falls back to filtering on its own
+                print('\n{0}: Shared outlier filtering failed with error: {1}'.format(
+                    multiprocessing.current_process().name,
+                    str(e)
+                ))
+
+        for interpolation in interpolations:
+            interpolation.interpolate()  # Releases its TIN, raster and points before the next product is interpolated
+
+        return [
+            (interpolation.get_tile(), interpolation_type)
+            for interpolation, interpolation_type in zip(interpolations, interpolation_types)
+        ]
 
     @staticmethod
     def _merge_rasters(input_arguments: list):
@@ -77,8 +146,9 @@ class Task:
         to disk in the 'finished' folder from the config.
 
         :param input_arguments: List containing Tile object as 0th element which represents the parent tile, 1st element
-        is which child tiles were successfully interpolated
-        :return: None
+        is which child tiles were successfully interpolated, optional 2nd element is a list of AHN3 sheets (Tile
+        objects) to cut the merged raster into, used for regions
+        :return: Raster object of the merged raster, or list of Raster objects of the sheets
         """
         input_tile = input_arguments[0]
         tiles_to_merge = input_arguments[1]
@@ -95,7 +165,7 @@ class Task:
                 # Failed to clip raster, remove from merge list
                 indexes_to_remove.append(subtile_index)
 
-        for index in indexes_to_remove:
+        for index in reversed(indexes_to_remove):  # From the back, so the other indexes stay valid
             del tiles_to_merge[index]
 
         rasters_to_merge = [subtile.related_raster for subtile in tiles_to_merge]
@@ -111,6 +181,16 @@ class Task:
 
             output_raster.homogenize_patchwork()
 
+            if len(input_arguments) > 2 and input_arguments[2] is not None:
+                sheets = merging.cut_into_sheets(output_filepath, input_arguments[2], stage=raster.get_stage())
+
+                os.remove(output_filepath)  # Only the sheets are kept
+
+                return [
+                    Raster(raster_name=sheet_name, filepath=sheet_filepath, stage=raster.get_stage())
+                    for sheet_name, sheet_filepath in sheets
+                ]
+
             return output_raster
 
         except Exception as e:
@@ -5,6 +5,7 @@ from laspy.file import File
 from shapely.geometry import Polygon
 
 from src.utils.helpers import create_path_if_not_exists, Stages
+from src.utils.intermediate import EXTENSIONS
 
 
 class TileTypes:
@@ -36,6 +37,7 @@ class Tile:
 
         self.related_raster = None
         self.interpolated = False
+        self.point_count = None  # Known for subtiles once they are split
 
         self._top_left = None
         self._top = None
@@ -56,6 +58,9 @@ class Tile:
         self._base_path = config["folder_paths"]["ahn3_tiles"]
         self._processing_path = config["folder_paths"]["processing"]
 
+        # LAS, LAZ or npy (directory of raw arrays that can be memory-mapped)
+        self._intermediate_format = config["tile_parameters"].get("intermediate_format", "LAS")
+
         self._file = None
 
         self.filepath = None
@@ -76,6 +81,13 @@ class Tile:
     def get_tile_name(self):
         return self._tile_name
 
+    def get_intermediate_extension(self):
+        """ Returns the extension of the subtile files, depending on the intermediate format in the config
+
+        :return: String representing the extension (LAS, LAZ or arrays)
+        """
+        return EXTENSIONS[self._intermediate_format]
+
     def open(self):
         self._file = File(self.filepath, mode='r')
         return self._file
@@ -97,7 +109,14 @@ class Tile:
             tile_name = self._tile_name
 
         # Provides full path for tile based on name
-        tile_file = [f for f in os.listdir(tile_path) if tile_name == f.split(".")[0] or tile_name.lower() == f.split(".")[0]]
+        if self._tile_type == TileTypes.SUBTILE:  # Subtiles are always in the intermediate format of the config
+            tile_file = []
+
+        elif os.path.isdir(tile_path):
+            tile_file = [f for f in os.listdir(tile_path) if tile_name == f.split(".")[0] or tile_name.lower() == f.split(".")[0]]
+
+        else:
+            tile_file = []
 
         if len(tile_file) > 0:  # Found a file that matches this tile name in the folder, so using that
             self.filepath = os.path.join(tile_path, tile_file[0])
@@ -107,7 +126,7 @@ class Tile:
             # print("Could not find specified tile in the expected folder!", self._tile_name, tile_path)
 
         elif self._tile_type == TileTypes.SUBTILE:
-            self.filepath = os.path.join(tile_path, tile_name + ".LAS")
+            self.filepath = os.path.join(tile_path, tile_name + "." + self.get_intermediate_extension())
 
         else:
             print("Something went wrong, couldn't find tile specified", tile_path, tile_name)
@@ -142,6 +161,31 @@ class Tile:
             subtile_id + "." + extension
         )
 
+    def get_neighbours(self):
+        """ Gets all known tiles around this tile, including the ones that only touch a corner.
+
+        :return: List of all adjacent Tile objects, or empty list if no adjacent exists
+        """
+        return [
+            neighbor for neighbor in [
+                self._top_left, self._top, self._top_right, self._right,
+                self._bottom_right, self._bottom, self._bottom_left, self._left
+            ] if neighbor is not None
+        ]
+
+    def get_neighbours_by_side(self):
+        """ Gets all known tiles around this tile by the side of this tile they are on.
+
+        :return: Dictionary containing the side (e.g. left, top_right) as key and the adjacent Tile object as value
+        """
+        sides = {
+            "top_left": self._top_left, "top": self._top, "top_right": self._top_right, "right": self._right,
+            "bottom_right": self._bottom_right, "bottom": self._bottom, "bottom_left": self._bottom_left,
+            "left": self._left
+        }
+
+        return {side: neighbor for side, neighbor in sides.items() if neighbor is not None}
+
     def get_bottom_left(self):
         """ Gets all known filepaths for tiles in the left bottom. So: left, left-bottom, and bottom as these are all
         needed to get overlap for this corner.
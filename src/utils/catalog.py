@@ -0,0 +1,154 @@
+import configparser
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from laspy.file import File
+
+from src.utils.helpers import create_path_if_not_exists
+
+CATALOG_NAME = "catalog.json"
+
+
+def read_header(filepath: str):
+    """ Reads the bounds and point count from the public header block of a LAS/LAZ file. The header of a LAZ file is
+    not compressed, so this only reads the first few hundred bytes of the file.
+
+    :param filepath: String representing the path of the file
+    :return: Dictionary containing the bounds as [minx, miny, maxx, maxy] and the point count
+    """
+    with open(filepath, "rb") as las_file:
+        header = las_file.read(375)
+
+    if len(header) < 227 or header[:4] != b"LASF":
+        raise ValueError("{0} is not a LAS/LAZ file".format(filepath))
+
+    version_minor = header[25]
+
+    max_x, min_x, max_y, min_y = struct.unpack_from("<4d", header, 179)
+    point_count = struct.unpack_from("<I", header, 107)[0]
+
+    if version_minor >= 4 and len(header) >= 255:  # LAS 1.4 stores the point count as 64 bit integer as well
+        point_count = max(point_count, struct.unpack_from("<Q", header, 247)[0])
+
+    return {
+        "bounds": [min_x, min_y, max_x, max_y],
+        "point_count": point_count,
+    }
+
+
+def count_classes(filepath: str):
+    """ Counts the points per classification. Unlike the header, this has to decompress the whole file.
+
+    :param filepath: String representing the path of the file
+    :return: Dictionary containing the classification (as string) as key and the number of points as value
+    """
+    las_file = File(filepath, mode="r")
+    counts = np.bincount(las_file.classification)
+    las_file.close()
+
+    return {str(classification): int(count) for classification, count in enumerate(counts) if count > 0}
+
+
+class HeaderCatalog:
+    def __init__(self):
+        """ Persistent catalog of the headers of all AHN3 files: their bounds, point count and optionally the number of
+        points per classification. Stored as JSON in the processing folder and refreshed incrementally; only files
+        that are new or changed (size or modification time) are read again.
+        """
+        directory = os.path.dirname(os.path.realpath(__file__))
+
+        config = configparser.ConfigParser()
+        config.read(os.path.join(directory, "..", "config.ini"))
+
+        self._tile_path = config["folder_paths"]["ahn3_tiles"]
+        self._processing_path = config["folder_paths"]["processing"]
+        self._with_class_counts = config["tile_parameters"].get("catalog_class_counts", "false") == "true"
+
+        self._path = os.path.join(self._processing_path, CATALOG_NAME)
+
+        self._entries = {}
+
+        if os.path.exists(self._path):
+            with open(self._path, "r") as catalog_file:
+                self._entries = json.load(catalog_file)
+
+    def refresh(self):
+        """ Adds all new and changed LAS/LAZ files in the AHN3 folder to the catalog, removes files that no longer
+        exist and stores the catalog.
+
+        :return: None
+        """
+        start_time = time.time()
+
+        filenames = [f for f in os.listdir(self._tile_path) if f.lower().endswith((".laz", ".las"))]
+        updated = 0
+
+        for filename in filenames:
+            filepath = os.path.join(self._tile_path, filename)
+            stat = os.stat(filepath)
+
+            entry = self._entries.get(filename)
+
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                continue
+
+            entry = read_header(filepath)
+            entry["size"] = stat.st_size
+            entry["mtime"] = stat.st_mtime
+
+            if self._with_class_counts:
+                entry["class_counts"] = count_classes(filepath)
+
+            self._entries[filename] = entry
+            updated += 1
+
+        for filename in set(self._entries.keys()) - set(filenames):
+            del self._entries[filename]
+
+        create_path_if_not_exists(self._processing_path)
+
+        # Written under a temporary name first, so processes that read the catalog never see a partial file
+        temporary_path = "{0}.{1}.tmp".format(self._path, os.getpid())
+
+        with open(temporary_path, "w") as catalog_file:
+            json.dump(self._entries, catalog_file)
+
+        os.replace(temporary_path, self._path)
+
+        print("Refreshed header catalog: {0} files, {1} read, in {2} seconds".format(
+            len(self._entries),
+            updated,
+            str(round(time.time() - start_time, 2))
+        ))
+
+    def get_entry(self, filepath: str):
+        """ Returns the catalog entry of a file.
+
+        :param filepath: String representing the path of the file
+        :return: Dictionary containing the bounds, point count (and class counts) of the file, or None if unknown
+        """
+        return self._entries.get(os.path.basename(filepath))
+
+    def intersects(self, filepath: str, bounds: list):
+        """ Checks if the points of a file can fall within a box, based on the bounds in its header. Boxes are half-open
+        like las2las -keep_xy: min <= x < max.
+
+        :param filepath: String representing the path of the file
+        :param bounds: List representing the box as [minx, miny, maxx, maxy]
+        :return: True if the file may have points in the box, also if the file is not in the catalog
+        """
+        entry = self.get_entry(filepath)
+
+        if entry is None:
+            return True
+
+        if entry["point_count"] == 0:
+            return False
+
+        minx, miny, maxx, maxy = entry["bounds"]
+
+        return minx < bounds[2] and maxx >= bounds[0] and miny < bounds[3] and maxy >= bounds[1]
@@ -0,0 +1,255 @@
+import configparser
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import time
+
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from shapely.geometry import box, shape
+from urllib3.util.retry import Retry
+
+from src.utils.helpers import create_path_if_not_exists
+from src.utils.polygon_store import clip_polygons
+
+# Sessions per (url, number of connections), kept for the lifetime of the (worker) process so connections are reused
+_sessions = {}
+
+# Cache names of the blocks that could not be fetched, kept for the lifetime of the (worker) process so a service that is
+# down is only waited for once per block, not again by every subtile that needs the block
+_failed_blocks = set()
+
+
+def get_session(url: str, connections: int, retries: int):
+    """ Returns the pooled HTTP session of a service. Failed requests and server errors are retried with a backoff.
+
+    :param url: String representing the url of the service
+    :param connections: Integer representing the number of connections to keep open to the service
+    :param retries: Integer representing the number of times a request is retried
+    :return: requests.Session object
+    """
+    session = _sessions.get((url, connections))
+
+    if session is None:
+        retry = Retry(total=retries, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=connections, pool_maxsize=connections, max_retries=retry)
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        _sessions[(url, connections)] = session
+
+    return session
+
+
+def to_2d(coordinates):
+    """ Drops the z value of every vertex in the (nested) coordinates of a GeoJSON geometry.
+
+    :param coordinates: List containing the coordinates of a GeoJSON geometry
+    :return: List containing the coordinates with only x and y
+    """
+    if len(coordinates) > 0 and isinstance(coordinates[0], (int, float)):
+        return coordinates[:2]
+
+    return [to_2d(part) for part in coordinates]
+
+
+class FootprintProvider:
+    def __init__(self):
+        """ Provides the building footprints of the 3D BAG WFS service. The footprints are requested in blocks on a
+        fixed grid and every block is stored as JSON in the cache folder, keyed by the service, layer and bounds of the
+        block. A main tile (or region) fetches its blocks once, concurrently over a pooled session, after which its
+        subtiles are served from the cache. Blocks that are not in the cache yet are fetched when a subtile needs them.
+        """
+        directory = os.path.dirname(os.path.realpath(__file__))
+
+        config = configparser.ConfigParser()
+        config.read(os.path.join(directory, "..", "config.ini"))
+
+        self._url = config.get("footprints", "url", fallback="http://3dbag.bk.tudelft.nl/data/wfs")
+        self._layer = config.get("footprints", "layer", fallback="BAG3D:pand3d")
+
+        self._cache_path = config.get("footprints", "cache", fallback="")
+
+        if self._cache_path == "":
+            self._cache_path = os.path.join(config["folder_paths"]["processing"], "footprints")
+
+        self._block_size = float(config.get("footprints", "block_size_in_m", fallback="1000"))
+        self._page_size = int(config.get("footprints", "page_size", fallback="10000"))
+        self._timeout = float(config.get("footprints", "timeout_in_s", fallback="60"))
+        self._retries = int(config.get("footprints", "retries", fallback="3"))
+        self._connections = int(config.get("footprints", "connections", fallback="4"))
+
+        self._prefetch = config.get("footprints", "prefetch", fallback="true") == "true"
+
+        # Subtiles extend into the buffer around the tile
+        self._buffer = float(config["tile_parameters"]["buffer_in_m"])
+
+    def prefetches(self):
+        return self._prefetch
+
+    def prefetch(self, bounds: list):
+        """ Fetches all blocks within an area (plus the subtile buffer) that are not in the cache yet, concurrently.
+        Blocks that fail are left out of the cache and are not requested again by this process.
+
+        :param bounds: List representing the area of the main tile or region as [minx, miny, maxx, maxy]
+        :return: Integer representing the number of blocks that were fetched
+        """
+        start_time = time.time()
+
+        buffered = [bounds[0] - self._buffer, bounds[1] - self._buffer, bounds[2] + self._buffer,
+                    bounds[3] + self._buffer]
+
+        missing = [block for block in self._get_blocks(buffered) if not os.path.exists(self._get_cache_name(block))]
+
+        if len(missing) == 0:
+            return 0
+
+        fetched = 0
+
+        with ThreadPoolExecutor(max_workers=self._connections) as executor:
+            for block, error in zip(missing, executor.map(self._try_load_block, missing)):
+                if error is None:
+                    fetched += 1
+                    continue
+
+                print('\n{0}: Could not prefetch the buildings of block {1}: {2}'.format(
+                    multiprocessing.current_process().name,
+                    block,
+                    error
+                ))
+
+        print('\n{0}: Prefetched the buildings of {1} of {2} blocks in {3} seconds'.format(
+            multiprocessing.current_process().name,
+            fetched,
+            len(missing),
+            str(round(time.time() - start_time, 2))
+        ))
+
+        return fetched
+
+    def get(self, bbox):
+        """ Returns the building footprints within a bounding box, clipped to the bounding box. Served from the cache,
+        missing blocks are fetched first. Raises an exception if the service does not respond within the timeout or
+        returns an error, or if a block failed before in this process.
+
+        :param bbox: List representing the bounding box [[xmin, xmax], [ymin, ymax]]
+        :return: List containing shapely Polygons
+        """
+        bounds = [bbox[0][0], bbox[1][0], bbox[0][1], bbox[1][1]]
+        extent = box(*bounds)
+
+        features = {}
+
+        for block in self._get_blocks(bounds):
+            for feature in self._load_block(block):
+                # Buildings on the border of blocks are in both blocks
+                key = feature.get("id") or json.dumps(feature["geometry"], sort_keys=True)
+                features[key] = feature
+
+        geometries = [shape(feature["geometry"]) for feature in features.values() if feature["geometry"] is not None]
+
+        return clip_polygons([geometry for geometry in geometries if geometry.intersects(extent)], bounds)
+
+    def _get_blocks(self, bounds: list):
+        """ Determines the blocks of the grid that intersect an area.
+
+        :param bounds: List representing the area as [minx, miny, maxx, maxy]
+        :return: List containing the bounds of the blocks as tuples (minx, miny, maxx, maxy)
+        """
+        size = self._block_size
+
+        columns = range(int(math.floor(bounds[0] / size)), int(math.ceil(bounds[2] / size)))
+        rows = range(int(math.floor(bounds[1] / size)), int(math.ceil(bounds[3] / size)))
+
+        return [(column * size, row * size, (column + 1) * size, (row + 1) * size) for row in rows for column in columns]
+
+    def _get_cache_name(self, block: tuple):
+        key = "{0}|{1}|{2}".format(self._url, self._layer, ",".join(str(bound) for bound in block))
+
+        return os.path.join(
+            self._cache_path,
+            "{0}_{1}.json".format(self._layer.replace(":", "-"), hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+        )
+
+    def _try_load_block(self, block: tuple):
+        try:
+            self._load_block(block)
+
+        except Exception as e:
+            return e
+
+    def _load_block(self, block: tuple):
+        """ Reads the footprints of a block from the cache, or fetches and caches them if the block is not cached. A
+        block that failed to fetch is remembered, and raises an exception right away when it is needed again.
+
+        :param block: Tuple representing the bounds of the block (minx, miny, maxx, maxy)
+        :return: List containing the features as GeoJSON dictionaries
+        """
+        cache_name = self._get_cache_name(block)
+
+        if os.path.exists(cache_name):
+            with open(cache_name, "r") as cache_file:
+                return json.load(cache_file)["features"]
+
+        if cache_name in _failed_blocks:
+            raise RuntimeError("Fetching the buildings of block {0} failed earlier in this process".format(block))
+
+        try:
+            features = self._fetch(block)
+
+        except Exception:
+            _failed_blocks.add(cache_name)
+            raise
+
+        create_path_if_not_exists(self._cache_path)
+
+        # Written under a temporary name first, so processes that read the block never see a partial file
+        temporary_name = "{0}.{1}.tmp".format(cache_name, os.getpid())
+
+        with open(temporary_name, "w") as cache_file:
+            json.dump({"url": self._url, "layer": self._layer, "bounds": block, "features": features}, cache_file)
+
+        os.replace(temporary_name, cache_name)
+
+        return features
+
+    def _fetch(self, block: tuple):
+        """ Requests all features within a block from the WFS service, page by page.
+
+        :param block: Tuple representing the bounds of the block (minx, miny, maxx, maxy)
+        :return: List containing the features as GeoJSON dictionaries, with 2D geometries
+        """
+        session = get_session(self._url, self._connections, self._retries)
+
+        features = []
+
+        while True:
+            response = session.get(self._url, timeout=self._timeout, params={
+                "service": "WFS",
+                "version": "2.0.0",
+                "request": "GetFeature",
+                "typeNames": self._layer,
+                "bbox": ",".join(str(bound) for bound in block),
+                "outputFormat": "json",
+                "count": self._page_size,
+                "startIndex": len(features),
+            })
+
+            response.raise_for_status()
+
+            page = response.json()["features"]
+
+            for feature in page:
+                if feature.get("geometry") is not None:
+                    feature["geometry"]["coordinates"] = to_2d(feature["geometry"]["coordinates"])
+
+                features.append(feature)
+
+            if len(page) < self._page_size:
+                return features
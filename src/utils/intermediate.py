@@ -0,0 +1,98 @@
+import os
+import shutil
+import subprocess
+
+from src.utils.catalog import read_header
+from src.utils.points import PointBuffer
+
+# Extension of the subtile files per intermediate format. The arrays format is a directory of raw numpy arrays
+EXTENSIONS = {
+    "LAS": "LAS",
+    "LAZ": "LAZ",
+    "npy": "arrays",
+}
+
+ARRAYS_EXTENSION = EXTENSIONS["npy"]
+
+
+def is_arrays(filepath: str):
+    return filepath.endswith("." + ARRAYS_EXTENSION)
+
+
+def is_laz(filepath: str):
+    return filepath.lower().endswith(".laz")
+
+
+def count_points(filepath: str):
+    """ Counts the points of an intermediate file without reading the points.
+
+    :param filepath: String representing the path of the LAS/LAZ file or arrays directory
+    :return: Integer representing the number of points, 0 if the file does not exist
+    """
+    if not os.path.exists(filepath):
+        return 0
+
+    if is_arrays(filepath):
+        return len(PointBuffer.load(filepath))
+
+    return read_header(filepath)["point_count"]
+
+
+def read_points(filepath: str, origin=None):
+    """ Reads the points of an intermediate file. Arrays directories are memory-mapped instead of read.
+
+    :param filepath: String representing the path of the LAS/LAZ file or arrays directory
+    :param origin: List containing the x and y coordinate of the local origin of the points
+    :return: PointBuffer object
+    """
+    if is_arrays(filepath):
+        return PointBuffer.load(filepath, origin=origin)
+
+    return PointBuffer.from_files([filepath], origin=origin)
+
+
+def remove(filepath: str):
+    """ Removes an intermediate file or arrays directory if it exists.
+
+    :param filepath: String representing the path of the LAS/LAZ file or arrays directory
+    :return: None
+    """
+    if os.path.isdir(filepath):
+        shutil.rmtree(filepath)
+
+    elif os.path.exists(filepath):
+        os.remove(filepath)
+
+
+def convert(las_name: str, save_name: str, origin=None):
+    """ Converts an uncompressed LAS file to the intermediate format of save_name and removes the LAS file. Used by the
+    writers that can only write LAS (laspy, and las2las for arrays).
+
+    :param las_name: String representing the path of the LAS file
+    :param save_name: String representing the path of the LAZ file or arrays directory
+    :param origin: List containing the x and y coordinate of the local origin the arrays are stored relative to
+    :return: None
+    """
+    if is_arrays(save_name):
+        PointBuffer.from_files([las_name], origin=origin).save(save_name)
+
+    elif is_laz(save_name):
+        subprocess.run(["laszip", "-i", las_name, "-o", save_name], check=True)
+
+    else:
+        os.replace(las_name, save_name)
+        return
+
+    os.remove(las_name)
+
+
+def get_size(filepath: str):
+    """ Returns the number of bytes an intermediate file or arrays directory takes on disk.
+
+    :param filepath: String representing the path of the LAS/LAZ file or arrays directory
+    :return: Integer representing the number of bytes, 0 if it does not exist
+    """
+    if os.path.isdir(filepath):
+        return sum(os.path.getsize(os.path.join(filepath, name)) for name in os.listdir(filepath))
+
+    return os.path.getsize(filepath) if os.path.exists(filepath) else 0
@@ -0,0 +1,296 @@
+import configparser
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+import pdal
+
+from src.utils.helpers import create_path_if_not_exists
+from src.utils.intermediate import convert, is_arrays, is_laz
+from src.utils.points import PointBuffer
+
+INDEXES = ["none", "lax", "copc"]
+
+LOCK_TIMEOUT = 3600  # Seconds after which the lock of a process that is building the same index is taken over
+
+
+class PointSource:
+    def __init__(self, index: str = None):
+        """ Reads the points of an area from the AHN3 files, using a spatial index so that only the parts of the files
+        that intersect the area are decompressed:
+
+        - none: no index, the whole files are read and cropped
+        - lax: LAStools .lax sidecar files created with lasindex, used by las2las -inside
+        - copc: a one-time conversion of every file to a Cloud Optimized Point Cloud, read with readers.copc
+
+        The indexes are created the first time a file is read.
+
+        :param index: String representing the spatial index to use, the one from the config if None
+        """
+        directory = os.path.dirname(os.path.realpath(__file__))
+
+        config = configparser.ConfigParser()
+        config.read(os.path.join(directory, "..", "config.ini"))
+
+        self._index = index or config.get("point_source", "index", fallback="none")
+        self._copc_path = os.path.join(config["folder_paths"]["processing"], "copc")
+
+        if self._index not in INDEXES:
+            raise ValueError("Unknown spatial index '{0}', expected one of {1}".format(self._index, INDEXES))
+
+    def get_index(self):
+        return self._index
+
+    def prepare(self, filepath: str):
+        """ Creates the spatial index of a file if it does not exist or is older than the file.
+
+        :param filepath: String representing the path of the LAS/LAZ file
+        :return: String representing the path to read the file from (the COPC file for copc)
+        """
+        if self._index == "lax":
+            index_path = os.path.splitext(filepath)[0] + ".lax"
+
+            if not self._is_up_to_date(index_path, filepath):
+                self._build_locked(
+                    index_path, filepath, lambda: subprocess.run(["lasindex", "-i", filepath], check=True)
+                )
+
+            return filepath
+
+        if self._index == "copc":
+            create_path_if_not_exists(self._copc_path)
+
+            index_path = os.path.join(self._copc_path, os.path.splitext(os.path.basename(filepath))[0] + ".copc.laz")
+
+            if not self._is_up_to_date(index_path, filepath):
+                self._build_locked(index_path, filepath, lambda: self._convert_to_copc(filepath, index_path))
+
+            return index_path
+
+        return filepath
+
+    def get_readers(self, filepaths: list, bounds: list):
+        """ Creates the PDAL reader stages for the points of several files within an area. Every stage is tagged, so they
+        can be merged with filters.merge with the tags as inputs. PDAL cannot use .lax files, so with lax the files
+        are cropped after reading like without index. Points on the minimum boundary are included, points on the
+        maximum boundary are not, like las2las -keep_xy.
+
+        :param filepaths: List containing the paths of the LAS/LAZ files
+        :param bounds: List representing the area as [minx, miny, maxx, maxy]
+        :return: Tuple of the list of PDAL stages and the list of tags of the last stage per file
+        """
+        # The bounds of readers.copc and filters.crop include the maximum boundary, filters.range can exclude it
+        limits = "X[{0}:{2}),Y[{1}:{3})".format(*bounds)
+
+        stages = []
+        tags = []
+
+        for index, filepath in enumerate(filepaths):
+            if self._index == "copc":
+                stages.append({
+                    "type": "readers.copc",
+                    "filename": self.prepare(filepath),
+                    "bounds": "([{0}, {2}], [{1}, {3}])".format(*bounds),
+                    "tag": "reader_{0}".format(index)
+                })
+
+            else:
+                stages.append({
+                    "type": "readers.las",
+                    "filename": filepath,
+                    "tag": "reader_{0}".format(index)
+                })
+
+            stages.append({
+                "type": "filters.range",
+                "inputs": ["reader_{0}".format(index)],
+                "limits": limits,
+                "tag": "crop_{0}".format(index)
+            })
+
+            tags.append("crop_{0}".format(index))
+
+        return stages, tags
+
+    def extract(self, filepaths: list, bounds: list, save_name: str, origin=None):
+        """ Writes the points of several files within an area to a single file in the intermediate format given by the
+        extension of save_name (LAS, LAZ or arrays). Points on the minimum boundary are included, points on the maximum
+        boundary are not, like las2las -keep_xy.
+
+        :param filepaths: List containing the paths of the LAS/LAZ files
+        :param bounds: List representing the area as [minx, miny, maxx, maxy]
+        :param save_name: String representing the path of the output LAS/LAZ file or arrays directory
+        :param origin: List containing the x and y coordinate of the local origin the arrays are stored relative to
+        :return: None
+        """
+        if is_arrays(save_name):
+            if self._index == "copc":
+                self.read(filepaths, bounds, origin=origin).save(save_name)
+
+            else:
+                las_name = "{0}.{1}.tmp.las".format(save_name, os.getpid())
+
+                self.extract(filepaths, bounds, las_name)
+                convert(las_name, save_name, origin=origin)
+
+            return
+
+        if self._index == "copc":
+            stages, tags = self.get_readers(filepaths, bounds)
+
+            # Forwards the header of the inputs, so the points keep the scale (0.001 for AHN3) and offset instead of the
+            # default scale of PDAL (0.01)
+            writer = {"type": "writers.las", "filename": save_name, "forward": "all"}
+
+            if is_laz(save_name):
+                writer["compression"] = "laszip"
+
+            stages.append({"type": "filters.merge", "inputs": tags})
+            stages.append(writer)
+
+            pdal.Pipeline(json.dumps(stages)).execute()
+
+            return
+
+        # -inside restricts reading to the area and uses the .lax file of an input when it exists, -keep_xy only
+        # filters the points after reading them
+        window = "-inside" if self._index == "lax" else "-keep_xy"
+
+        for filepath in filepaths:
+            self.prepare(filepath)
+
+        command = ['las2las', '-i'] + filepaths + ['-merged', '-o', save_name, window] + [str(bound) for bound in bounds]
+
+        print(command)
+
+        process = subprocess.Popen(
+            args=command,
+        )
+
+        process.communicate()
+        process.wait()
+
+    def read(self, filepaths: list, bounds: list, origin=None):
+        """ Reads the points of several files within an area into a PointBuffer. Points on the minimum boundary are
+        included, points on the maximum boundary are not, like las2las -keep_xy.
+
+        :param filepaths: List containing the paths of the LAS/LAZ files
+        :param bounds: List representing the area as [minx, miny, maxx, maxy]
+        :param origin: List containing the x and y coordinate of the local origin of the points
+        :return: PointBuffer object
+        """
+        if self._index == "none":
+            return PointBuffer.from_files(filepaths, bounds=bounds, origin=origin)
+
+        if self._index == "copc":
+            stages, tags = self.get_readers(filepaths, bounds)
+            stages.append({"type": "filters.merge", "inputs": tags})
+
+            pipeline = pdal.Pipeline(json.dumps(stages))
+            pipeline.execute()
+
+            return PointBuffer.from_structured(pipeline.arrays[0], origin=origin)
+
+        with tempfile.TemporaryDirectory() as directory:
+            window_name = os.path.join(directory, "window.las")
+
+            self.extract(filepaths, bounds, window_name)
+
+            return PointBuffer.from_files([window_name], bounds=bounds, origin=origin)
+
+    @staticmethod
+    def _is_up_to_date(index_path: str, filepath: str):
+        return os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(filepath)
+
+    @classmethod
+    def _build_locked(cls, index_path: str, filepath: str, build):
+        """ Builds an index while holding a lock file, so processes that need the same index do not build it at the
+        same time. A process that finds the lock waits until the lock is released and builds the index itself if it
+        is still missing, e.g. because the other process failed. A stale lock, left by a process that was killed, is
+        taken over.
+
+        :param index_path: String representing the path of the index
+        :param filepath: String representing the path of the LAS/LAZ file the index is built for
+        :param build: Function that builds the index
+        :return: None
+        """
+        lock_path = index_path + ".lock"
+
+        while not cls._is_up_to_date(index_path, filepath):
+            try:
+                lock = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+
+            except FileExistsError:
+                if cls._is_stale(lock_path):
+                    print("Taking over the stale lock {0}".format(lock_path))
+
+                    try:
+                        os.remove(lock_path)
+
+                    except FileNotFoundError:  # Taken over by another process
+                        pass
+
+                else:
+                    time.sleep(1)
+
+                continue
+
+            try:
+                os.write(lock, str(os.getpid()).encode("utf-8"))
+
+                build()
+
+            finally:
+                os.close(lock)
+                os.remove(lock_path)
+
+            return
+
+    @staticmethod
+    def _is_stale(lock_path: str):
+        """ Checks if a lock is older than LOCK_TIMEOUT, or if the process that holds it no longer runs. The process
+        is only checked on POSIX, where os.kill with signal 0 does not end it, and assumes the processes run on the
+        same machine.
+
+        :param lock_path: String representing the path of the lock file, which contains the process id of its holder
+        :return: True if the lock can be taken over
+        """
+        try:
+            age = time.time() - os.path.getmtime(lock_path)
+
+            with open(lock_path, "r") as lock_file:
+                pid = lock_file.read().strip()
+
+        except FileNotFoundError:  # Released in the meantime
+            return False
+
+        if age > LOCK_TIMEOUT:
+            return True
+
+        if os.name == "posix" and pid.isdigit():
+            try:
+                os.kill(int(pid), 0)
+
+            except ProcessLookupError:
+                return True
+
+            except PermissionError:  # Runs as another user
+                return False
+
+        return False
+
+    @staticmethod
+    def _convert_to_copc(filepath: str, index_path: str):
+        temporary_path = "{0}.{1}.tmp.copc.laz".format(os.path.splitext(index_path)[0], os.getpid())
+
+        pdal.Pipeline(json.dumps([
+            filepath,
+            {
+                "type": "writers.copc",
+                "filename": temporary_path
+            }
+        ])).execute()
+
+        os.replace(temporary_path, index_path)
@@ -0,0 +1,229 @@
+import os
+import shutil
+
+import numpy as np
+
+from laspy.file import File
+
+# Interchange format of points with absolute coordinates, e.g. the filtered points stored per subtile. Same order as
+# PDAL so the first three fields are X, Y and Z
+POINT_DTYPE = [("X", np.float64), ("Y", np.float64), ("Z", np.float64), ("Classification", np.uint8)]
+
+
+class PointBuffer:
+    def __init__(self, xyz, classification, origin):
+        """ Compact point cloud that is passed from ground filtering to interpolation and flattening. Only the
+        dimensions that are used are kept: the coordinates as a single float32 array relative to a local origin and
+        the classification as uint8. The relative x and y stay small enough for float32 to keep sub-millimetre
+        precision, while the absolute heights fit float32 as well.
+
+        :param xyz: Numpy float32 array of shape (n, 3) containing [[x, y, z], ...], x and y relative to the origin
+        :param classification: Numpy uint8 array containing the classification of every point
+        :param origin: List containing the x and y coordinate of the local origin
+        """
+        self.xyz = xyz
+        self.classification = classification
+        self.origin = (float(origin[0]), float(origin[1]))
+
+    def __len__(self):
+        return len(self.classification)
+
+    @property
+    def xy(self):
+        """ View on the x and y columns, without copying """
+        return self.xyz[:, :2]
+
+    @property
+    def z(self):
+        """ View on the z column, without copying """
+        return self.xyz[:, 2]
+
+    @classmethod
+    def from_arrays(cls, x, y, z, classification, origin=None):
+        """ Creates a buffer from absolute coordinates. The coordinates are written straight into the float32 array,
+        no intermediate float64 array of all points is created.
+
+        :param x: Numpy array containing the absolute x coordinates
+        :param y: Numpy array containing the absolute y coordinates
+        :param z: Numpy array containing the heights
+        :param classification: Numpy array containing the classifications
+        :param origin: List containing the x and y coordinate of the local origin, or None for the lower left corner
+        :return: PointBuffer object
+        """
+        if origin is None:
+            origin = (np.floor(x.min()), np.floor(y.min())) if len(x) > 0 else (0, 0)
+
+        xyz = np.empty((len(x), 3), dtype=np.float32)
+        np.subtract(x, origin[0], out=xyz[:, 0], casting="unsafe")
+        np.subtract(y, origin[1], out=xyz[:, 1], casting="unsafe")
+        xyz[:, 2] = z
+
+        return cls(xyz, np.asarray(classification, dtype=np.uint8), origin)
+
+    @classmethod
+    def from_structured(cls, points, origin=None):
+        """ Creates a buffer from a structured numpy array, e.g. the output of a PDAL pipeline. Only X, Y, Z and
+        Classification are read, all other dimensions are dropped.
+
+        :param points: Structured numpy array containing at least X, Y, Z and Classification
+        :param origin: List containing the x and y coordinate of the local origin, or None for the lower left corner
+        :return: PointBuffer object
+        """
+        return cls.from_arrays(points["X"], points["Y"], points["Z"], points["Classification"], origin=origin)
+
+    @classmethod
+    def from_files(cls, filepaths: list, bounds: list = None, origin=None):
+        """ Reads the points of LAS/LAZ files with laspy. Only X, Y, Z and Classification are read.
+
+        :param filepaths: List containing the paths of the files to read
+        :param bounds: List representing the area to keep as [minx, miny, maxx, maxy], the maximum boundary excluded like
+        las2las -keep_xy, or None to keep all points
+        :param origin: List containing the x and y coordinate of the local origin, or None for the lower left corner
+        :return: PointBuffer object
+        """
+        if origin is None and bounds is not None:
+            origin = (bounds[0], bounds[1])
+
+        buffers = []
+
+        for filepath in filepaths:
+            las_file = File(filepath, mode="r")
+
+            x = las_file.x
+            y = las_file.y
+
+            if bounds is not None:
+                keep = (x >= bounds[0]) & (x < bounds[2]) & (y >= bounds[1]) & (y < bounds[3])
+
+                buffer = cls.from_arrays(
+                    x[keep], y[keep], las_file.z[keep], las_file.classification[keep], origin=origin
+                )
+
+            else:
+                buffer = cls.from_arrays(x, y, las_file.z, las_file.classification, origin=origin)
+
+            las_file.close()
+
+            # All files share the origin of the first one
+            origin = buffer.origin
+
+            buffers.append(buffer)
+
+        return cls.concatenate(buffers, origin=origin)
+
+    @classmethod
+    def load(cls, path: str, origin=None):
+        """ Memory-maps a buffer stored with save(), nothing is parsed or copied until the points are used. The
+        classification is mapped copy-on-write, so it can still be changed in memory, e.g. by the outlier filters.
+
+        :param path: String representing the path of the directory containing the arrays
+        :param origin: List containing the x and y coordinate of the local origin, or None to keep the stored origin.
+        Converting to another origin copies the coordinates
+        :return: PointBuffer object
+        """
+        buffer = cls(
+            np.load(os.path.join(path, "xyz.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "classification.npy"), mmap_mode="c"),
+            np.load(os.path.join(path, "origin.npy"))
+        )
+
+        return buffer if origin is None else buffer.with_origin(origin)
+
+    def save(self, path: str):
+        """ Stores the buffer as raw arrays in a directory (xyz.npy, classification.npy and origin.npy), that can be
+        memory-mapped again with load(). The directory is written under a temporary name first, so
+        readers never see a partial buffer.
+
+        :param path: String representing the path of the directory
+        :return: None
+        """
+        temporary_path = "{0}.{1}.tmp".format(path, os.getpid())
+
+        os.makedirs(temporary_path, exist_ok=True)
+
+        np.save(os.path.join(temporary_path, "xyz.npy"), np.ascontiguousarray(self.xyz, dtype=np.float32))
+        np.save(os.path.join(temporary_path, "classification.npy"), np.asarray(self.classification, dtype=np.uint8))
+        np.save(os.path.join(temporary_path, "origin.npy"), np.array(self.origin, dtype=np.float64))
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def concatenate(cls, buffers: list, origin=None):
+        """ Concatenates buffers into one, all buffers are moved to the origin of the first one.
+
+        :param buffers: List containing PointBuffer objects
+        :param origin: List containing the origin to use if there are no buffers
+        :return: PointBuffer object
+        """
+        if len(buffers) == 0:
+            return cls(np.zeros((0, 3), dtype=np.float32), np.zeros(0, dtype=np.uint8), origin or (0, 0))
+
+        origin = buffers[0].origin
+
+        return cls(
+            np.concatenate([buffer.with_origin(origin).xyz for buffer in buffers]),
+            np.concatenate([buffer.classification for buffer in buffers]),
+            origin
+        )
+
+    def with_origin(self, origin):
+        """ Returns the points relative to another origin. Returns the buffer itself if the origin is the same.
+
+        :param origin: List containing the x and y coordinate of the new origin
+        :return: PointBuffer object
+        """
+        if (float(origin[0]), float(origin[1])) == self.origin:
+            return self
+
+        xyz = self.xyz.copy()
+        xyz[:, 0] += np.float32(self.origin[0] - origin[0])
+        xyz[:, 1] += np.float32(self.origin[1] - origin[1])
+
+        return PointBuffer(xyz, self.classification, origin)
+
+    def select(self, selection):
+        """ Selects points with a boolean mask, an index array or a slice. Slices return views.
+
+        :param selection: Boolean numpy array, numpy array of indices or slice
+        :return: PointBuffer object with the same origin
+        """
+        return PointBuffer(self.xyz[selection], self.classification[selection], self.origin)
+
+    def crop(self, bounds: list):
+        """ Selects the points within bounds. Points on the minimum boundary are included, points on the maximum
+        boundary are not, like las2las -keep_xy.
+
+        :param bounds: List representing the area as [minx, miny, maxx, maxy] in absolute coordinates
+        :return: PointBuffer object with the same origin
+        """
+        x = self.xyz[:, 0].astype(np.float64) + self.origin[0]
+        y = self.xyz[:, 1].astype(np.float64) + self.origin[1]
+
+        return self.select((x >= bounds[0]) & (x < bounds[2]) & (y >= bounds[1]) & (y < bounds[3]))
+
+    def to_local(self, x, y):
+        """ Converts absolute coordinates to coordinates relative to the origin of this buffer.
+
+        :param x: Float or numpy array containing absolute x coordinates
+        :param y: Float or numpy array containing absolute y coordinates
+        :return: Tuple containing the relative x and y
+        """
+        return x - self.origin[0], y - self.origin[1]
+
+    def to_structured(self):
+        """ Converts the buffer to a structured numpy array with absolute coordinates, e.g. to store it.
+
+        :return: Structured numpy array of POINT_DTYPE
+        """
+        points = np.empty(len(self), dtype=POINT_DTYPE)
+        points["X"] = self.xyz[:, 0]
+        points["X"] += self.origin[0]
+        points["Y"] = self.xyz[:, 1]
+        points["Y"] += self.origin[1]
+        points["Z"] = self.xyz[:, 2]
+        points["Classification"] = self.classification
+
+        return points
@@ -0,0 +1,190 @@
+import os
+
+import fiona
+import numpy as np
+
+from shapely.geometry import mapping, shape
+from shapely.ops import clip_by_rect, unary_union
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+try:  # Shapely 2.x clips an array of geometries in one call
+    from shapely import clip_by_rect as clip_array_by_rect
+except ImportError:
+    clip_array_by_rect = None
+
+# Stores per polygon file, kept for the lifetime of the (worker) process
+_stores = {}
+
+
+def get_polygon_store(filepath: str):
+    """ Returns the store of a polygon file. Every process loads a file only once, and again when it changed on disk
+    (modification time or size).
+
+    :param filepath: String representing the path of the polygon file (e.g. shapefile)
+    :return: PolygonStore object
+    """
+    stat = os.stat(filepath)
+    version = (stat.st_mtime, stat.st_size)
+
+    store = _stores.get(filepath)
+
+    if store is None or store.version != version:
+        store = PolygonStore(filepath, version)
+        _stores[filepath] = store
+
+    return store
+
+
+def clip_polygons(geometries, bounds):
+    """ Clips polygons to a rectangle, keeping their holes. All polygons are clipped at once with the rectangle
+    clipping of GEOS, which is vectorized with Shapely 2.x and a loop over the polygons with Shapely 1.x. Polygons that
+    lie within the rectangle come back unchanged, polygons that do not intersect it are dropped. The rectangle clipping
+    does not check its input, so invalid polygons are repaired first.
+
+    :param geometries: List containing shapely Polygons or MultiPolygons
+    :param bounds: List representing the rectangle as [minx, miny, maxx, maxy]
+    :return: List containing shapely Polygons, in the order of the geometries they were clipped from
+    """
+    minx, miny, maxx, maxy = bounds
+
+    geometries = [geometry if geometry.is_valid else geometry.buffer(0) for geometry in geometries]
+
+    if clip_array_by_rect is not None:
+        array = np.empty(len(geometries), dtype=object)
+        array[:] = geometries
+
+        clipped = clip_array_by_rect(array, minx, miny, maxx, maxy)
+
+    else:
+        clipped = [clip_by_rect(geometry, minx, miny, maxx, maxy) for geometry in geometries]
+
+    polygons = []
+
+    for geometry in clipped:
+        parts = getattr(geometry, "geoms", [geometry])  # Only keep the polygons of a collection
+
+        polygons.extend(part for part in parts if part.geom_type == "Polygon" and part.area > 0)
+
+    return polygons
+
+
+def query_geopackage(filepath: str, layer: str, bounds: list, clip: bool = True):
+    """ Reads the polygons within bounds from a GeoPackage built with tools/Python/build_polygon_geopackage.py, through
+    the R-tree index of the layer. The GeoPackage stores every source polygon cut into pieces per AHN3 sheet, the
+    pieces of a polygon that fall within the bounds are joined again, so a polygon that crosses a sheet border is not
+    split. Pieces that are flagged as invalid are repaired first.
+
+    :param filepath: String representing the path of the GeoPackage
+    :param layer: String representing the layer (flattening or homogenization)
+    :param bounds: List representing the area as [minx, miny, maxx, maxy]
+    :param clip: Boolean, clip the polygons to the bounds
+    :return: List containing shapely Polygons
+    """
+    pieces = {}
+
+    with fiona.open(filepath, layer=layer) as source:
+        for feature in source.filter(bbox=tuple(bounds)):
+            geometry = shape(feature["geometry"])
+
+            if not feature["properties"]["valid"]:
+                geometry = geometry.buffer(0)
+
+            key = (feature["properties"]["source"], feature["properties"]["source_fid"])
+            pieces.setdefault(key, []).append(geometry)
+
+    # In the order of the source files
+    geometries = [unary_union(pieces[key]) for key in sorted(pieces.keys())]
+
+    if clip:
+        return clip_polygons(geometries, bounds)
+
+    polygons = []
+
+    for geometry in geometries:
+        parts = getattr(geometry, "geoms", [geometry])  # Only keep the polygons of a collection
+
+        polygons.extend(part for part in parts if part.geom_type == "Polygon" and part.area > 0)
+
+    return polygons
+
+
+class PolygonStore:
+    def __init__(self, filepath: str, version: tuple = None):
+        """ Keeps all features of a polygon file in memory with an STRtree over their geometries and prepared
+        geometries for exact intersection tests, so a query only touches the features near the queried area. Works
+        with the STRtree of Shapely 1.x (returns geometries) and 2.x (returns indices).
+
+        :param filepath: String representing the path of the polygon file
+        :param version: Tuple containing the modification time and size of the file when it was read
+        """
+        self.filepath = filepath
+        self.version = version
+
+        self._features = []
+        self._geometries = []
+
+        with fiona.open(filepath) as source:
+            for feature in source:
+                if feature["geometry"] is None:
+                    continue
+
+                geometry = shape(feature["geometry"])
+
+                self._features.append({"geometry": mapping(geometry), "properties": dict(feature["properties"])})
+                self._geometries.append(geometry)
+
+        self._prepared = [prep(geometry) for geometry in self._geometries]
+        self._tree = STRtree(self._geometries) if len(self._geometries) > 0 else None
+
+        # Shapely 1.x returns the geometries themselves from a query
+        self._index_by_id = {id(geometry): index for index, geometry in enumerate(self._geometries)}
+
+    def __len__(self):
+        return len(self._features)
+
+    def query(self, geometry):
+        """ Returns the features whose bounding box intersects a geometry, in the order of the file. The features are
+        copies, so they can be changed by the caller.
+
+        :param geometry: Shapely geometry to query with
+        :return: List containing the features as dictionaries with a geometry and properties
+        """
+        return [self._copy(index) for index in self._query(geometry)]
+
+    def query_geometries(self, geometry):
+        """ Returns the geometries of the features whose bounding box intersects a geometry, in the order of the file.
+        The geometries are shared with the store and must not be changed.
+
+        :param geometry: Shapely geometry to query with
+        :return: List containing shapely geometries
+        """
+        return [self._geometries[index] for index in self._query(geometry)]
+
+    def intersecting(self, geometry):
+        """ Returns the features that intersect a geometry, in the order of the file. The features are copies, so they
+        can be changed by the caller.
+
+        :param geometry: Shapely geometry to query with
+        :return: List containing the features as dictionaries with a geometry and properties
+        """
+        return [self._copy(index) for index in self._query(geometry) if self._prepared[index].intersects(geometry)]
+
+    def _query(self, geometry):
+        if self._tree is None:
+            return []
+
+        result = self._tree.query(geometry)
+
+        if len(result) == 0:
+            return []
+
+        if hasattr(result, "dtype") and result.dtype.kind in "iu":  # Shapely 2.x
+            return sorted(int(index) for index in result)
+
+        return sorted(self._index_by_id[id(candidate)] for candidate in result)
+
+    def _copy(self, index):
+        feature = self._features[index]
+
+        return {"geometry": dict(feature["geometry"]), "properties": dict(feature["properties"])}
@@ -0,0 +1,43 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", ".."))
+
+from src.subtiling.splitter import read_records, write_records
+from src.utils.intermediate import EXTENSIONS, get_size, read_points
+
+# Writes the points of a (sub)tile in every intermediate format and reads them back, and reports the size on disk and
+# the write and read time of each format. Reading includes touching every coordinate, so memory-mapped arrays are
+# actually loaded from disk.
+# Usage: python benchmark_intermediate_format.py path/to/subtile.LAS
+
+parser = argparse.ArgumentParser()
+parser.add_argument("filepath", help="LAS/LAZ file to write in every format")
+args = parser.parse_args()
+
+las_file, records, scaling = read_records(args.filepath)
+origin = [int(scaling[1][0]), int(scaling[1][1])]
+
+with tempfile.TemporaryDirectory() as directory:
+    for intermediate_format, extension in EXTENSIONS.items():
+        save_name = os.path.join(directory, "subtile." + extension)
+
+        start_time = time.time()
+        write_records(save_name, header=las_file.header, records=records, origin=origin)
+        write_time = time.time() - start_time
+
+        start_time = time.time()
+        points = read_points(save_name, origin=origin)
+        points.xyz.sum(axis=0)
+        read_time = time.time() - start_time
+
+        print("{0}: {1} points, {2:.2f} MB, written in {3:.2f} seconds, read in {4:.2f} seconds".format(
+            intermediate_format, len(points), get_size(save_name) / 1024 ** 2, write_time, read_time
+        ))
+
+        del points
+
+las_file.close()
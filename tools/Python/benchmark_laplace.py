@@ -0,0 +1,51 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import startin
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", ".."))
+
+from src.interpolation.laplace import NO_DATA, convex_hull_ring, laplace_grid, laplace_grid_loop
+
+# Benchmarks the batched Laplace grid evaluation against the cell-by-cell loop on a synthetic terrain.
+# Usage: python benchmark_laplace.py --size 250 --density 10 --cell-size 0.5
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--size", type=float, default=250, help="width and height of the test area in meters")
+parser.add_argument("--density", type=float, default=10, help="points per square meter")
+parser.add_argument("--cell-size", type=float, default=0.5, help="raster cell size in meters")
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+rng = np.random.default_rng(args.seed)
+
+n = int(args.size * args.size * args.density)
+xy = rng.uniform(0, args.size, size=(n, 2))
+z = np.sin(xy[:, 0] / 20) * 2 + np.cos(xy[:, 1] / 35) * 3 + rng.normal(0, 0.05, n)
+points = np.column_stack((xy, z))
+
+tin = startin.DT()
+tin.insert(points)
+
+resolution = int(args.size // args.cell_size)
+x_range = np.arange(0, resolution * args.cell_size, args.cell_size)
+y_range = np.arange(0, resolution * args.cell_size, args.cell_size)[::-1]
+
+print("points:", n, "cells:", resolution * resolution)
+
+start_time = time.time()
+reference = laplace_grid_loop(tin=tin, x_range=x_range, y_range=y_range)
+loop_time = time.time() - start_time
+print("loop:  {0:.2f} seconds".format(loop_time))
+
+start_time = time.time()
+result = laplace_grid(tin=tin, x_range=x_range, y_range=y_range, hull=convex_hull_ring(points))
+batch_time = time.time() - start_time
+print("batch: {0:.2f} seconds ({1:.1f}x)".format(batch_time, loop_time / batch_time))
+
+valid = (reference != NO_DATA) & (result != NO_DATA)
+print("cells with data (loop / batch):", int((reference != NO_DATA).sum()), "/", int((result != NO_DATA).sum()))
+print("max absolute difference:", float(np.abs(reference[valid] - result[valid]).max()) if valid.any() else 0.0)
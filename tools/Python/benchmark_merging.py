@@ -0,0 +1,111 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+
+from rasterio.transform import from_origin
+from shapely.geometry import box
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", ".."))
+
+from src.merging.merging import Merging, NO_DATA, WRITERS
+from src.tile import Tile
+
+# Writes a grid of synthetic subtile rasters of a tile on the same grid, and merges them with every merging writer.
+# Reports the time, the peak memory of the process and the size of the mosaic of every writer. Every writer runs in its
+# own process, so the peak memory of one does not count for the other.
+# Usage: python benchmark_merging.py --width 6250 --height 5000 --columns 4 --rows 5
+
+
+class SubtileRaster:
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._raster = None
+
+    def open(self):
+        self._raster = rasterio.open(self.filepath)
+        return self._raster
+
+    def close(self):
+        self._raster.close()
+
+
+class BenchmarkMerging(Merging):
+    def __init__(self, tile, input_rasters, writer, directory):
+        super().__init__(tile=tile, input_rasters=input_rasters, writer=writer)
+
+        self._directory = directory
+
+    def _get_save_location(self, stage, tile_name=None):
+        return os.path.join(self._directory, "mosaic_{0}.TIF".format(self._writer))
+
+
+def run_writer(writer, tile, filepaths, directory, results):
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.time()
+
+    merging = BenchmarkMerging(tile, [SubtileRaster(filepath) for filepath in filepaths], writer, directory)
+    merging.merge_rasters()
+    _, save_name = merging.save(stage="interpolated_dtm")
+
+    results[writer] = (
+        time.time() - start_time,
+        (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss) / 1024,
+        os.path.getsize(save_name) / 1024 ** 2,
+    )
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--width", type=float, default=6250, help="width of the tile in m")
+parser.add_argument("--height", type=float, default=5000, help="height of the tile in m")
+parser.add_argument("--columns", type=int, default=4)
+parser.add_argument("--rows", type=int, default=5)
+parser.add_argument("--cell-size", type=float, default=0.5)
+args = parser.parse_args()
+
+tile = Tile(tile_name="BENCHMARK", geometry=box(0, 0, args.width, args.height))
+
+subtile_width = args.width / args.columns
+subtile_height = args.height / args.rows
+
+random = np.random.RandomState(0)
+
+with tempfile.TemporaryDirectory() as directory:
+    filepaths = []
+
+    for column in range(args.columns):
+        for row in range(args.rows):
+            width = int(round(subtile_width / args.cell_size))
+            height = int(round(subtile_height / args.cell_size))
+
+            image = random.uniform(0, 10, (1, height, width)).astype(np.float32)
+            image[0, random.rand(height, width) < 0.05] = NO_DATA
+
+            filepath = os.path.join(directory, "subtile_{0}_{1}.TIF".format(column, row))
+            filepaths.append(filepath)
+
+            with rasterio.open(filepath, "w", driver="GTiff", height=height, width=width, count=1, dtype="float32",
+                               crs="EPSG:28992", nodata=NO_DATA, transform=from_origin(
+                                   column * subtile_width, args.height - row * subtile_height, args.cell_size,
+                                   args.cell_size)) as dest:
+                dest.write(image)
+
+    results = multiprocessing.Manager().dict()
+
+    for writer in WRITERS:
+        process = multiprocessing.Process(target=run_writer, args=(writer, tile, filepaths, directory, results))
+        process.start()
+        process.join()
+
+    for writer in WRITERS:
+        print("{0}: {1:.2f} seconds, {2:.0f} MB peak memory, {3:.1f} MB mosaic".format(writer, *results[writer]))
+
+    with rasterio.open(os.path.join(directory, "mosaic_windowed.TIF")) as windowed, \
+            rasterio.open(os.path.join(directory, "mosaic_merge.TIF")) as merged:
+        print("Mosaics are identical:", np.array_equal(windowed.read(), merged.read()))
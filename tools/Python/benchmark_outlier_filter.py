@@ -0,0 +1,57 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pdal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", ".."))
+
+from src.ground_filtering.ground_filtering import OUTLIER_FILTERING, GroundFiltering
+from src.ground_filtering.outliers import NOISE, classify_outliers
+from src.utils.points import PointBuffer
+
+# Compares the native outlier filtering with the PDAL filters.elm + filters.outlier pipeline on a LAS/LAZ file, e.g. a
+# subtile from the processing folder. Reports the run time of both and how well the noise classifications agree.
+# Usage: python benchmark_outlier_filter.py path/to/subtile.LAS
+
+parser = argparse.ArgumentParser()
+parser.add_argument("filepath", help="LAS/LAZ file to filter")
+parser.add_argument("--workers", type=int, default=-1, help="number of workers for the native kNN searches")
+args = parser.parse_args()
+
+start_time = time.time()
+pipeline = pdal.Pipeline(json.dumps([args.filepath] + OUTLIER_FILTERING))
+pipeline.execute()
+reference = PointBuffer.from_structured(pipeline.arrays[0])
+pdal_time = time.time() - start_time
+print("pdal:   {0:.2f} seconds, {1} points".format(pdal_time, len(reference)))
+
+start_time = time.time()
+read = PointBuffer.from_files([args.filepath], origin=reference.origin)
+read_time = time.time() - start_time
+result = classify_outliers(read, workers=args.workers)
+native_time = time.time() - start_time
+print("native: {0:.2f} seconds ({1:.2f} reading), {2} points ({3:.1f}x)".format(
+    native_time, read_time, len(result), pdal_time / native_time
+))
+
+# Match the points of both outputs on their coordinates, PDAL does not keep the input order for every reader
+order_reference = np.lexsort(reference.xyz.T[::-1])
+order_result = np.lexsort(result.xyz.T[::-1])
+
+noise_reference = reference.classification[order_reference] == NOISE
+noise_result = result.classification[order_result] == NOISE
+
+print("noise points (pdal / native):", int(noise_reference.sum()), "/", int(noise_result.sum()))
+print("noise in both:", int((noise_reference & noise_result).sum()))
+print("classification agreement: {0:.4f}%".format(100 * float(np.mean(noise_reference == noise_result))))
+
+for stage in ["interpolated_dtm", "interpolated_dsm"]:
+    print("{0} points (pdal / native): {1} / {2}".format(
+        stage,
+        len(GroundFiltering.select_points(reference, stage)),
+        len(GroundFiltering.select_points(result, stage))
+    ))
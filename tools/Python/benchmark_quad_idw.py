@@ -0,0 +1,121 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", ".."))
+
+from src.interpolation.binning import bin_points
+from src.interpolation.quad_idw import (
+    INCR_RK, MAX_ITER, NO_DATA, START_RK, GridBucketNeighbours, KDTreeNeighbours, quad_idw_cells, quad_idw_grid,
+    quad_idw_loop
+)
+
+# Benchmarks the batch (with cKDTree and with grid buckets) and hybrid Quad-IDW engines against the cell-by-cell loop
+# on a synthetic point cloud with a gap in it. The hybrid engine bins the points into cells first, so its output differs
+# from the loop by design.
+# Usage: python benchmark_quad_idw.py --size 100 --density 10 --cell-size 0.5
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--size", type=float, default=100, help="width and height of the test area in meters")
+parser.add_argument("--density", type=float, default=10, help="points per square meter")
+parser.add_argument("--cell-size", type=float, default=0.5, help="raster cell size in meters")
+parser.add_argument("--workers", type=int, default=-1, help="number of workers for the batch neighbour searches")
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+rng = np.random.default_rng(args.seed)
+
+n = int(args.size * args.size * args.density)
+xy = rng.uniform(0, args.size, size=(n, 2))
+z = np.sin(xy[:, 0] / 20) * 2 + np.cos(xy[:, 1] / 35) * 3 + rng.normal(0, 0.05, n)
+
+# Leave a gap (e.g. a water body) so that radius expansion and NO_DATA cells are exercised as well
+gap = (np.abs(xy[:, 0] - args.size / 2) < args.size / 10) & (np.abs(xy[:, 1] - args.size / 2) < args.size / 10)
+points = np.column_stack((xy, z))[~gap]
+
+resolution = int(args.size // args.cell_size)
+x_range = np.arange(0, resolution * args.cell_size, args.cell_size)
+y_range = np.arange(0, resolution * args.cell_size, args.cell_size)[::-1]
+
+print("points:", len(points), "cells:", resolution * resolution)
+
+start_time = time.time()
+reference = quad_idw_loop(points=points, x_range=x_range, y_range=y_range)
+loop_time = time.time() - start_time
+print("loop:  {0:.2f} seconds".format(loop_time))
+
+start_time = time.time()
+result = quad_idw_grid(
+    points=points,
+    neighbours=KDTreeNeighbours(points, workers=args.workers),
+    x_range=x_range,
+    y_range=y_range
+)
+batch_time = time.time() - start_time
+print("batch: {0:.2f} seconds ({1:.1f}x)".format(batch_time, loop_time / batch_time))
+
+print("NO_DATA cells (loop / batch):", int((reference == NO_DATA).sum()), "/", int((result == NO_DATA).sum()))
+print("max absolute difference:", float(np.abs(reference - result).max()))
+
+start_time = time.time()
+binned = bin_points(
+    points=points,
+    origin=[0, resolution * args.cell_size],
+    cell_size=args.cell_size,
+    shape=(resolution, resolution),
+    reducer="max"
+)
+rows, cols = np.nonzero(binned == NO_DATA)
+binned[rows, cols] = quad_idw_cells(
+    points=points,
+    neighbours=KDTreeNeighbours(points, workers=args.workers),
+    qx=x_range[cols],
+    qy=y_range[rows]
+)
+hybrid_time = time.time() - start_time
+print("hybrid: {0:.2f} seconds ({1:.1f}x), {2} cells interpolated".format(
+    hybrid_time, loop_time / hybrid_time, rows.size
+))
+
+# Neighbour backends on their own; building the index and querying the first search radius for every cell
+qx = np.tile(x_range, len(y_range))
+qy = np.repeat(y_range, len(x_range))
+
+for name, backend in [
+    ("cKDTree", lambda: KDTreeNeighbours(points, workers=args.workers)),
+    ("buckets", lambda: GridBucketNeighbours(points, cell_size=max(args.cell_size, 1.0), origin=[0, 0])),
+]:
+    start_time = time.time()
+    neighbours = backend()
+    build_time = time.time() - start_time
+
+    start_time = time.time()
+    owner, index = neighbours.query(qx, qy, 1.0)
+    query_time = time.time() - start_time
+
+    start_time = time.time()
+    result = quad_idw_grid(points=points, neighbours=neighbours, x_range=x_range, y_range=y_range)
+    grid_time = time.time() - start_time
+
+    print("{0}: build {1:.3f} s, query {2:.3f} s ({3} neighbours), batch engine {4:.2f} s, max difference {5}".format(
+        name, build_time, query_time, index.size, grid_time, float(np.abs(reference - result).max())
+    ))
+
+# Both backends have to find the same neighbours for queries around and far outside the points as well
+outside = np.linspace(-args.size, 2 * args.size, 61)
+qx = np.tile(outside, len(outside))
+qy = np.repeat(outside, len(outside))
+
+neighbour_sets = []
+
+for neighbours in [
+    KDTreeNeighbours(points, workers=args.workers),
+    GridBucketNeighbours(points, cell_size=max(args.cell_size, 1.0), origin=[0, 2 * args.size])
+]:
+    owner, index = neighbours.query(qx, qy, START_RK + (MAX_ITER - 1) * INCR_RK)
+    neighbour_sets.append(set(zip(owner.tolist(), index.tolist())))
+
+print("outside the points: cKDTree and buckets find the same neighbours:", neighbour_sets[0] == neighbour_sets[1])
@@ -0,0 +1,124 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from shapely.geometry import LineString, Point, Polygon, box, shape
+from shapely.ops import linemerge, polygonize, unary_union
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", ".."))
+
+from src.utils.helpers import vector_prepare
+from src.utils.polygon_store import get_polygon_store
+
+# Clips the polygons of a polygon file (e.g. the river and water polygons of the data/polygons folder) to random
+# subtile boxes, with the bulk rectangle clipping of vector_prepare and with the previous path that polygonized the box
+# and polygon boundaries. Reports the time of both and how far their results are from the exact intersection of every
+# polygon with the box, as the area that differs. The previous path only handled Polygons, it skips the other features
+# (e.g. the MultiPolygons of the homogenization polygons) and is compared with the exact intersection of the Polygons.
+# Usage: python benchmark_rect_clip.py path/to/polygons.shp --size 250 --count 200
+
+
+def legacy_prepare(bbox, filepath):
+    """ The previous clipping of vector_prepare, kept to compare with. Skips the features that are not Polygons. """
+    a = Point(bbox[0][0], bbox[1][1])
+    b = Point(bbox[0][1], bbox[1][1])
+    c = Point(bbox[0][1], bbox[1][0])
+    d = Point(bbox[0][0], bbox[1][0])
+
+    bbox_lines = LineString([a, b, c, d, a])
+    bbox_object = box(bbox[0][0], bbox[1][0], bbox[0][1], bbox[1][1])
+    out = []
+    errors = 0
+    skipped = 0
+
+    for feature in get_polygon_store(filepath).query(bbox_object):
+        if feature['geometry']['type'] != 'Polygon':
+            skipped += 1
+            continue
+
+        merger = [bbox_lines]
+        rings = feature['geometry']['coordinates']
+
+        for ring_coords in rings:
+            ring = Polygon(ring_coords)
+
+            if ring.within(bbox_object):
+                out.append(shape(feature['geometry']))
+
+            elif ring.intersects(bbox_object):
+                merger.append(ring.boundary)
+
+        if len(merger) != 1:
+            poly = Polygon(rings[0], rings[1:])
+
+            for p in polygonize(unary_union(linemerge(merger))):
+                try:
+                    if p.within(bbox_object) and poly.contains(p.buffer(-1e-8)):
+                        out.append(Polygon(p.exterior.coords))
+
+                except Exception:
+                    errors += 1
+
+    return out, errors, skipped
+
+
+def exact_prepare(bbox, filepath, polygons_only=False):
+    """ The exact intersection of every polygon with the box, as the reference. """
+    bbox_object = box(bbox[0][0], bbox[1][0], bbox[0][1], bbox[1][1])
+    geometries = get_polygon_store(filepath).query_geometries(bbox_object)
+
+    if polygons_only:
+        geometries = [geometry for geometry in geometries if geometry.geom_type == "Polygon"]
+
+    return [geometry.buffer(0).intersection(bbox_object) for geometry in geometries]
+
+
+def difference(polygons, reference):
+    return unary_union(polygons).symmetric_difference(unary_union(reference)).area if len(reference) > 0 else 0.0
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("filepath", help="polygon file (e.g. shapefile) to clip")
+parser.add_argument("--size", type=float, default=250, help="size of the subtile boxes in m")
+parser.add_argument("--count", type=int, default=200, help="number of subtile boxes")
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+store = get_polygon_store(args.filepath)
+minx, miny, maxx, maxy = unary_union(store.query_geometries(box(-1e9, -1e9, 1e9, 1e9))).bounds
+
+random = np.random.RandomState(args.seed)
+corners = random.uniform([minx, miny], [max(minx, maxx - args.size), max(miny, maxy - args.size)], (args.count, 2))
+bboxes = [[[x, x + args.size], [y, y + args.size]] for x, y in corners]
+
+print("{0} polygons, {1} boxes of {2} m".format(len(store), len(bboxes), args.size))
+
+results = {}
+
+for name, prepare in (("rectangle clip", vector_prepare), ("previous", legacy_prepare)):
+    start_time = time.time()
+    results[name] = [prepare(bbox, args.filepath) for bbox in bboxes]
+
+    print("{0}: {1:.2f} seconds".format(name, time.time() - start_time))
+
+errors = sum(result[1] for result in results["previous"])
+skipped = sum(result[2] for result in results["previous"])
+results["previous"] = [result[0] for result in results["previous"]]
+
+references = {
+    "rectangle clip": [exact_prepare(bbox, args.filepath) for bbox in bboxes],
+    "previous": [exact_prepare(bbox, args.filepath, polygons_only=True) for bbox in bboxes],
+}
+
+for name, clipped in results.items():
+    differences = [difference(polygons, exact) for polygons, exact in zip(clipped, references[name])]
+
+    print("{0}: {1} polygons, {2} boxes differ from the exact intersection, at most {3:.4f} m2".format(
+        name, sum(len(polygons) for polygons in clipped), sum(1 for area in differences if area > 1e-6),
+        max(differences)
+    ))
+
+print("previous: {0} topological errors, {1} features skipped that are not Polygons".format(errors, skipped))
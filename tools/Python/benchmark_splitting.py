@@ -0,0 +1,76 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from laspy.file import File
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", ".."))
+
+from src.subtiling.splitter import split_files
+
+# Splits a tile into a grid of buffered subtiles with one las2las run per subtile and with the single pass splitter,
+# and reports the time of both and the number of points per subtile.
+# Usage: python benchmark_splitting.py path/to/C_37EN1.LAZ --neighbours path/to/C_37EN2.LAZ --columns 4 --rows 5
+
+parser = argparse.ArgumentParser()
+parser.add_argument("filepath", help="LAS/LAZ file of the tile to split")
+parser.add_argument("--neighbours", nargs="*", default=[], help="LAS/LAZ files of the neighbouring tiles")
+parser.add_argument("--columns", type=int, default=4)
+parser.add_argument("--rows", type=int, default=5)
+parser.add_argument("--buffer", type=float, default=25)
+parser.add_argument("--threads", type=int, default=4, help="number of files the single pass splitter reads or writes at once")
+args = parser.parse_args()
+
+las_file = File(args.filepath, mode="r")
+minx, miny = [round(value) for value in las_file.header.min[:2]]
+maxx, maxy = [round(value) for value in las_file.header.max[:2]]
+las_file.close()
+
+width = (maxx - minx) / args.columns
+height = (maxy - miny) / args.rows
+
+boxes = [
+    [
+        minx + col * width - args.buffer,
+        miny + row * height - args.buffer,
+        minx + (col + 1) * width + args.buffer,
+        miny + (row + 1) * height + args.buffer
+    ]
+    for col in range(args.columns) for row in range(args.rows)
+]
+
+with tempfile.TemporaryDirectory() as directory:
+    las2las_names = [os.path.join(directory, "las2las_{0}.LAS".format(index)) for index in range(len(boxes))]
+    single_pass_names = [os.path.join(directory, "single_pass_{0}.LAS".format(index)) for index in range(len(boxes))]
+
+    start_time = time.time()
+
+    for box, save_name in zip(boxes, las2las_names):
+        command = ["las2las", "-i", args.filepath] + args.neighbours
+        command.extend(["-merged", "-o", save_name, "-keep_xy"] + [str(value) for value in box])
+
+        subprocess.run(command, check=True)
+
+    las2las_time = time.time() - start_time
+    print("las2las:     {0:.2f} seconds".format(las2las_time))
+
+    start_time = time.time()
+    counts = split_files(
+        filepath=args.filepath,
+        neighbour_filepaths=args.neighbours,
+        boxes=boxes,
+        save_names=single_pass_names,
+        threads=args.threads
+    )
+    single_pass_time = time.time() - start_time
+    print("single pass: {0:.2f} seconds ({1:.1f}x)".format(single_pass_time, las2las_time / single_pass_time))
+
+    for index, (save_name, count) in enumerate(zip(las2las_names, counts)):
+        las_file = File(save_name, mode="r")
+        print("subtile {0}: {1} points (las2las) / {2} points (single pass)".format(
+            index + 1, las_file.header.point_records_count, count
+        ))
+        las_file.close()
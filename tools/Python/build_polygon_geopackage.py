@@ -0,0 +1,116 @@
+import argparse
+import configparser
+import json
+import os
+import sys
+import time
+
+import fiona
+import numpy as np
+
+from shapely.geometry import mapping, MultiPolygon, Polygon, shape
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", ".."))
+
+from src.utils.helpers import get_ahn_index
+
+# Builds the GeoPackage with the flattening and homogenization polygons cut into pieces per AHN3 sheet, so the
+# flattening only reads the pieces around a subtile through the R-tree index of the GeoPackage. Every piece keeps the
+# source file and feature it came from, to join the pieces of a polygon again, and whether its geometry is valid.
+# Usage: python build_polygon_geopackage.py --polygons path/to/polygons --output path/to/polygons.gpkg
+# Then set polygon_geopackage in the config to the output path.
+
+LAYERS = {
+    "flattening": "",  # The shapefiles in the polygons folder itself
+    "homogenization": "homogenization",
+}
+
+SCHEMA = {
+    "geometry": "MultiPolygon",
+    "properties": {"sheet": "str", "source": "str", "source_fid": "int", "valid": "int"},
+}
+
+directory = os.path.dirname(os.path.realpath(__file__))
+
+config = configparser.ConfigParser()
+config.read(os.path.join(directory, "..", "..", "src", "config.ini"))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--polygons", default=config.get("folder_paths", "flattening_polygons", fallback=None),
+                    help="folder containing the shapefiles (the data/polygons folder, unzipped)")
+parser.add_argument("--output", default=config.get("folder_paths", "polygon_geopackage", fallback=None),
+                    help="GeoPackage to create, overwritten if it exists")
+parser.add_argument("--index", default=None, help="GeoJSON of the AHN3 sheets, downloaded from the AHN3 WFS if omitted")
+args = parser.parse_args()
+
+if args.index is not None:
+    with open(args.index, "r") as index_file:
+        sheets = json.load(index_file)["features"]
+else:
+    sheets = get_ahn_index()
+
+sheet_names = [sheet["properties"]["bladnr"].upper() for sheet in sheets]
+sheet_polygons = [Polygon(sheet["geometry"]["coordinates"][0][0]) for sheet in sheets]
+sheet_bounds = np.array([polygon.bounds for polygon in sheet_polygons])
+
+if os.path.exists(args.output):
+    os.remove(args.output)
+
+for layer, subfolder in LAYERS.items():
+    start_time = time.time()
+
+    folder = os.path.join(args.polygons, subfolder)
+    shapefiles = sorted(f for f in os.listdir(folder) if f.endswith(".shp"))
+
+    crs = None
+    records = []
+
+    for shapefile in shapefiles:
+        with fiona.open(os.path.join(folder, shapefile)) as source:
+            crs = source.crs
+
+            for source_fid, feature in enumerate(source):
+                if feature["geometry"] is None:
+                    continue
+
+                geometry = shape(feature["geometry"])
+                minx, miny, maxx, maxy = geometry.bounds
+
+                # Sheets whose bounding box overlaps the polygon, then the exact cut
+                candidates = np.nonzero(
+                    (sheet_bounds[:, 0] < maxx) & (sheet_bounds[:, 2] > minx) &
+                    (sheet_bounds[:, 1] < maxy) & (sheet_bounds[:, 3] > miny)
+                )[0]
+
+                for index in candidates:
+                    piece = geometry.intersection(sheet_polygons[index])
+
+                    parts = [part for part in getattr(piece, "geoms", [piece]) if part.geom_type == "Polygon"]
+                    parts = [part for part in parts if part.area > 0]
+
+                    if len(parts) == 0:
+                        continue
+
+                    piece = MultiPolygon(parts)
+
+                    records.append({
+                        "geometry": mapping(piece),
+                        "properties": {
+                            "sheet": sheet_names[index],
+                            "source": shapefile,
+                            "source_fid": source_fid,
+                            "valid": int(piece.is_valid),
+                        },
+                    })
+
+    # The GPKG driver creates the R-tree index of the layer
+    with fiona.open(args.output, "w", driver="GPKG", layer=layer, schema=SCHEMA, crs=crs) as dest:
+        dest.writerecords(records)
+
+    print("{0}: {1} pieces from {2} shapefiles, {3} invalid, in {4:.2f} seconds".format(
+        layer,
+        len(records),
+        len(shapefiles),
+        sum(1 for record in records if record["properties"]["valid"] == 0),
+        time.time() - start_time
+    ))
@@ -0,0 +1,88 @@
+import argparse
+import json
+import time
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+from shapely.geometry import box, shape
+
+# Serves the features of a GeoJSON file as a minimal WFS 2.0 GetFeature endpoint (bbox, count and startIndex), to stand
+# in for the 3D BAG WFS when testing the footprint cache without network access. A delay per request and failing
+# requests simulate a slow or unreliable server.
+# Usage: python local_wfs.py buildings.geojson --port 8000 --delay 0.5
+# Then set url in the footprints section of the config to http://localhost:8000/wfs
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class WFSHandler(BaseHTTPRequestHandler):
+    features = []
+    bounds = []
+    delay = 0.0
+    fail_every = 0
+    requests = 0
+
+    def do_GET(self):
+        WFSHandler.requests += 1
+
+        time.sleep(self.delay)
+
+        if self.fail_every > 0 and WFSHandler.requests % self.fail_every == 0:
+            self.send_error(503, "Simulated failure")
+            return
+
+        params = {key.lower(): values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+
+        if params.get("request", "").lower() != "getfeature":
+            self.send_error(400, "Only GetFeature is supported")
+            return
+
+        selected = list(range(len(self.features)))
+
+        if "bbox" in params:
+            extent = box(*[float(value) for value in params["bbox"].split(",")[:4]])
+            selected = [index for index in selected if self.bounds[index].intersects(extent)]
+
+        start = int(params.get("startindex", 0))
+        count = int(params.get("count", len(selected)))
+
+        body = json.dumps({
+            "type": "FeatureCollection",
+            "features": [self.features[index] for index in selected[start:start + count]],
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("filepath", help="GeoJSON file with the features to serve")
+parser.add_argument("--port", type=int, default=8000)
+parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before every response")
+parser.add_argument("--fail-every", type=int, default=0, help="answer every n-th request with an error, 0 never")
+args = parser.parse_args()
+
+with open(args.filepath, "r") as geojson_file:
+    features = json.load(geojson_file)["features"]
+
+for index, feature in enumerate(features):
+    feature.setdefault("id", "feature.{0}".format(index))
+
+WFSHandler.features = features
+WFSHandler.bounds = [box(*shape(feature["geometry"]).bounds) for feature in features]
+WFSHandler.delay = args.delay
+WFSHandler.fail_every = args.fail_every
+
+print("Serving {0} features on http://localhost:{1}/wfs".format(len(features), args.port))
+
+ThreadingHTTPServer(("", args.port), WFSHandler).serve_forever()